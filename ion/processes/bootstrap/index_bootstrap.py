@@ -13,8 +13,11 @@ from pyon.core.exception import BadRequest
 from interface.objects import SearchOptions
 from pyon.public import RT, log, CFG
 import interface.objects
+from functools import partial
+from gevent.pool import Pool
 import elasticpy as ep
 import re
+import time
 
 
 '''
@@ -93,12 +96,17 @@ class IndexBootStrap(ImmediateProcess):
         self.river_shards   = self.CFG.get_safe('server.elasticsearch.river_shards',5)
         self.river_replicas = self.CFG.get_safe('server.elasticsearch.river_replicas',1)
 
+        # Number of concurrent requests while bootstrapping
+        self.concurrency    = self.CFG.get_safe('server.elasticsearch.bootstrap_concurrency', 8)
+
         self.es = ep.ElasticSearch(host=self.es_host, port=self.es_port, timeout=10)
 
         op = self.CFG.get('op',None)
 
         if op == 'index_bootstrap':
             self.index_bootstrap()
+        elif op == 'update_bootstrap':
+            self.index_bootstrap(missing_only=True)
         elif op == 'clean_bootstrap':
             self.clean_bootstrap()
         else:
@@ -164,180 +172,198 @@ class IndexBootStrap(ImmediateProcess):
 
         self.index_bootstrap()
 
-    def index_bootstrap(self):
+    def _es_request(self, check, func, *args, **kwargs):
+        '''
+        @brief Binds an ElasticSearch call to run in a phase
+        @param check whether the response must be ok
+        '''
+        def request():
+            response = IndexManagementService._es_call(func, *args, **kwargs)
+            if check:
+                IndexManagementService._check_response(response)
+            return response
+        return request
+
+    def _run_phase(self, phase, requests):
+        '''
+        @brief Runs the requests of a bootstrap phase concurrently in a bounded greenlet pool
+        @param requests list of callables
+        @return list of the results
+        '''
+        start = time.time()
+        pool = Pool(self.concurrency)
+        greenlets = [pool.spawn(request) for request in requests]
+        pool.join()
+        log.info('Index bootstrap phase %s: %d requests in %.2fs', phase, len(requests), time.time() - start)
+        for greenlet in greenlets:
+            if not greenlet.successful():
+                raise greenlet.exception
+        return [greenlet.value for greenlet in greenlets]
+
+    def existing_mappings(self):
+        '''
+        @brief Gets what already exists in ElasticSearch
+        @return dict of index name to the set of its mapped types, the types of the _river index are the rivers
+        '''
+        indexes = IndexManagementService._es_call(self.es.index_list) or []
+        mappings = IndexManagementService._es_call(self.es.raw, '_mapping', 'GET') or {}
+        retval = dict((index, set()) for index in indexes)
+        for index, types in mappings.iteritems():
+            if isinstance(types, dict):
+                retval.setdefault(index, set()).update(types.keys())
+        return retval
+
+    def index_bootstrap(self, missing_only=False):
         '''
         Creates the initial set of desired indexes based on a standard definition
+        @param missing_only only create the indexes, mappings, rivers and index resources which do not exist yet
         '''
+        start = time.time()
+        existing = self.existing_mappings() if missing_only else {}
+        rivers = existing.get('_river', set())
+
+        resources_index = '%s_resources_index' % self.sysname
+        events_index = '%s_events_index' % self.sysname
 
         #=======================================================================================
-        # Create the _river index based on the cluster configurations
+        # Create the _river index based on the cluster configurations and the indexes
         #=======================================================================================
-        IndexManagementService._es_call(
-            self.es.index_create,
-            '_river',
-            number_of_shards = self.river_shards, 
-            number_of_replicas = self.river_replicas
-        )
+        requests = []
+        if '_river' not in existing:
+            requests.append(self._es_request(False, self.es.index_create, '_river',
+                number_of_shards = self.river_shards,
+                number_of_replicas = self.river_replicas
+            ))
+        for k in STD_INDEXES.keys() + EDGE_INDEXES.keys():
+            if k not in existing:
+                requests.append(self._es_request(True, self.es.index_create, k,
+                    number_of_shards=self.index_shards,
+                    number_of_replicas=self.index_replicas
+                ))
+        self._run_phase('indexes', requests)
 
+        #=======================================================================================
+        # For each of the resource types in the list of values for each standard index,
+        # create a mapping and a context type in ElasticSearch based on the searchable fields.
+        # The resources index maps every resource type and the events index every event.
+        #=======================================================================================
         filters = {
             '_id' : '_design/filters',
             'filters' : {
             }
         }
-        #=======================================================================================
-        # For each of the resource types in the list of values for each standard index,
-        # create a mapping and a context type in ElasticSearch based on the searchable fields.
-        #=======================================================================================
+        mapped_types = [(k, v) for k, v in STD_INDEXES.iteritems()]
+        mapped_types.append((resources_index, RT.values()))
+        mapped_types.append((events_index, get_events()))
+
+        requests = []
+        for k,v in mapped_types:
+            for res in v:
+                if res not in existing.get(k, ()):
+                    requests.append(self._es_request(True, self.es.raw, '%s/%s/_mapping' %(k,res), 'POST', self.es_mapping(res)))
+        self._run_phase('mappings', requests)
 
         for k,v in STD_INDEXES.iteritems():
-            response = IndexManagementService._es_call(
-                self.es.index_create,
-                k,
-                number_of_shards=self.index_shards,
-                number_of_replicas=self.index_replicas
-            )
-            IndexManagementService._check_response(response)
-            
             body = 'function(doc, req) { switch(doc.type_) { default: return false; }}'
             for res in v:
                 body = re.sub(r'default:', 'case "%s": return true; default:' % res, body)
-                mappings = self.es_mapping(res)
-                response = IndexManagementService._es_call(self.es.raw,'%s/%s/_mapping' %(k,res), 'POST', mappings)
-                IndexManagementService._check_response(response)
-
             filters['filters'][k] = body
-        
+
         #=======================================================================================
         # Get an instance of the datastore instance used to create the CouchDB filters
         # in support of the ElasticSearch river's filter
         #  - Allows us to filter based on resource type
         #=======================================================================================
-       
+
         cc = self.container
         db = cc.datastore_manager.get_datastore('resources')
         datastore_name = db.datastore_name
         db = db.server[datastore_name]
 
-        db.create(filters)
+        phase_start = time.time()
+        if missing_only and filters['_id'] in db:
+            filters['_rev'] = db[filters['_id']]['_rev']
+            db.save(filters)
+        else:
+            db.create(filters)
+        log.info('Index bootstrap phase filters: %.2fs', time.time() - phase_start)
 
         #--------------------------------------------------------------------------------
         # Create the river connection between CouchDB and ElasticSearch
         #--------------------------------------------------------------------------------
-
-        for k,v in STD_INDEXES.iteritems():
-            response = IndexManagementService._es_call(self.es.river_couchdb_create,
+        river_sources = [(k, datastore_name, 'filters/%s' % k) for k in STD_INDEXES.iterkeys()]
+        river_sources.append((resources_index, datastore_name, None))
+        river_sources.append((events_index, '%s_events' % self.sysname, None))
+
+        requests = []
+        for k, couchdb_db, couchdb_filter in river_sources:
+            if k in rivers:
+                continue
+            kwargs = dict(
                 index_name = k,
-                couchdb_db = datastore_name,
+                couchdb_db = couchdb_db,
                 couchdb_host = CFG.server.couchdb.host,
-                couchdb_port = CFG.server.couchdb.port, 
+                couchdb_port = CFG.server.couchdb.port,
                 couchdb_user = CFG.server.couchdb.username,
                 couchdb_password = CFG.server.couchdb.password,
-                couchdb_filter = 'filters/%s' % k,
                 script= ELASTICSEARCH_CONTEXT_SCRIPT
             )
-            IndexManagementService._check_response(response)
-
-        #=======================================================================================
-        # Create and map the edge indexes
-        #=======================================================================================
-
-        #--------------------------------------------------------------------------------
-        # Resources Index
-        #--------------------------------------------------------------------------------
-
-        response = IndexManagementService._es_call(self.es.index_create,'%s_resources_index' % self.sysname,
-            number_of_shards=self.index_shards,
-            number_of_replicas=self.index_replicas
-        )
-        IndexManagementService._check_response(response)
-        for t in RT.values():
-            mappings = self.es_mapping(t)
-            response = IndexManagementService._es_call(self.es.raw,'%s_resources_index/%s/_mapping' % (self.sysname,t), 'POST', mappings)
-            IndexManagementService._check_response(response)
-
-        response = IndexManagementService._es_call(self.es.river_couchdb_create,
-            index_name = '%s_resources_index' % self.sysname,
-            couchdb_db = datastore_name,
-            couchdb_host = CFG.server.couchdb.host,
-            couchdb_port = CFG.server.couchdb.port,
-            couchdb_user = CFG.server.couchdb.username,
-            couchdb_password = CFG.server.couchdb.password,
-            script= ELASTICSEARCH_CONTEXT_SCRIPT
-        )
-        IndexManagementService._check_response(response)
-
-        #--------------------------------------------------------------------------------
-        # Events Index
-        #--------------------------------------------------------------------------------
-
-        response = IndexManagementService._es_call(self.es.index_create,'%s_events_index' % self.sysname,
-            number_of_shards=self.index_shards,
-            number_of_replicas=self.index_replicas
-        )
-        IndexManagementService._check_response(response)
-        for event in get_events():
-            mappings = self.es_mapping(event)
-            response = IndexManagementService._es_call(self.es.raw, '%s_events_index/%s/_mapping' % (self.sysname, event), 'POST', mappings)
-            IndexManagementService._check_response(response)
-
-        response = IndexManagementService._es_call(self.es.river_couchdb_create,
-            index_name = '%s_events_index' % self.sysname,
-            couchdb_db = '%s_events' % self.sysname,
-            couchdb_host = CFG.server.couchdb.host,
-            couchdb_port = CFG.server.couchdb.port,
-            couchdb_user = CFG.server.couchdb.username,
-            couchdb_password = CFG.server.couchdb.password,
-            script= ELASTICSEARCH_CONTEXT_SCRIPT
-        )
-        IndexManagementService._check_response(response)
-
-
-
+            if couchdb_filter:
+                kwargs['couchdb_filter'] = couchdb_filter
+            requests.append(self._es_request(True, self.es.river_couchdb_create, **kwargs))
+        self._run_phase('rivers', requests)
 
         #=======================================================================================
         # Construct the resources
         #=======================================================================================
 
         ims_cli = IndexManagementServiceClient()
+        index_resources = ims_cli.list_indexes() if missing_only else {}
+
+        requests = []
 
         #--------------------------------------------------------------------------------
         # Standard Indexes
         #--------------------------------------------------------------------------------
 
         for index,resources in STD_INDEXES.iteritems():
-            ims_cli.create_index(
+            requests.append(partial(ims_cli.create_index,
                 name=index,
                 description='%s ElasticSearch Index Resource' % index,
                 content_type=IndexManagementService.ELASTICSEARCH_INDEX,
                 options=self.attr_mapping(resources)
-            )
+            ))
 
         #--------------------------------------------------------------------------------
         # CouchDB Indexes
         #--------------------------------------------------------------------------------
-        
+
         for index,datastore in COUCHDB_INDEXES.iteritems():
-            ims_cli.create_index(
+            requests.append(partial(ims_cli.create_index,
                 name=index,
                 description='%s CouchDB Index Resource' % index,
                 content_type=IndexManagementService.COUCHDB_INDEX,
                 datastore_name=datastore
-            )
+            ))
 
         #--------------------------------------------------------------------------------
         # Edge Indexes
         #--------------------------------------------------------------------------------
 
-        ims_cli.create_index(
-            name='%s_resources_index' % self.sysname,
+        requests.append(partial(ims_cli.create_index,
+            name=resources_index,
             description='Resources Index',
             content_type=IndexManagementService.ELASTICSEARCH_INDEX,
             options=self.attr_mapping(RT.keys())
-        )
+        ))
 
-        ims_cli.create_index(
-            name='%s_events_index' % self.sysname,
+        requests.append(partial(ims_cli.create_index,
+            name=events_index,
             description='Events Index',
             content_type=IndexManagementService.ELASTICSEARCH_INDEX,
             options=self.attr_mapping(get_events())
-        )
+        ))
+
+        self._run_phase('resources', [request for request in requests if request.keywords['name'] not in index_resources])
+
+        log.info('Index bootstrap completed in %.2fs', time.time() - start)
@@ -94,6 +94,58 @@ class IndexBootStrapUnitTest(PyonTestCase):
         total_count = len(STD_INDEXES) + len(COUCHDB_INDEXES) + len(EDGE_INDEXES)
         self.assertTrue(ims_cli().create_index.call_count == total_count, 'Improper number of index resources created')
 
+    @patch('ion.processes.bootstrap.index_bootstrap.IndexManagementServiceClient')
+    @patch('ion.processes.bootstrap.index_bootstrap.ep.ElasticSearch')
+    def test_update_bootstrap(self, mock_es, ims_cli):
+        #---------------------------------------------
+        # Everything exists but the sites index and its river
+        #---------------------------------------------
+        sites_index = '%s_sites_index' % get_sys_name().lower()
+        existing = dict((index, {}) for index in STD_INDEXES.keys() + EDGE_INDEXES.keys() if index != sites_index)
+        existing['_river'] = dict((index, {}) for index in existing if index != '_river')
+        for index, resources in STD_INDEXES.iteritems():
+            if index in existing:
+                existing[index] = dict((res, {}) for res in resources)
+
+        mock_es().index_list.return_value           = existing.keys()
+        mock_es().raw.side_effect                   = lambda path, method, data=None : existing if method == 'GET' else {'ok':True, 'status':200}
+        mock_es().index_create.return_value         = {'ok':True, 'status':200}
+        mock_es().river_couchdb_create.return_value = {'ok':True, 'status':200}
+        ims_cli().list_indexes.return_value = dict((index, 'id') for index in STD_INDEXES if index != sites_index)
+
+        db = Mock()
+        db.__contains__ = Mock(return_value=True)
+        db.__getitem__ = Mock(return_value={'_rev':'1'})
+        datastore = DotDict()
+        datastore.datastore_name = 'test'
+        datastore.server.test = db
+
+        container = DotDict()
+        container.datastore_manager.get_datastore = Mock()
+        container.datastore_manager.get_datastore.return_value = datastore
+
+        config = CFG
+        config.system.elasticsearch=True
+        config.server.elasticsearch.host = ''
+        config.server.elasticsearch.port = ''
+        config.op = 'update_bootstrap'
+
+        ibs = IndexBootStrap()
+        ibs.CFG = config
+        ibs.container = container
+        ibs.on_start()
+
+        mock_es().index_create.assert_called_once_with(sites_index, number_of_shards=ibs.index_shards, number_of_replicas=ibs.index_replicas)
+        self.assertEquals(mock_es().river_couchdb_create.call_count, 1)
+        self.assertEquals(mock_es().river_couchdb_create.call_args[1]['index_name'], sites_index)
+
+        # The filters design document is updated rather than created
+        self.assertFalse(db.create.called)
+        self.assertEquals(db.save.call_args[0][0]['_rev'], '1')
+
+        created = [kwargs['name'] for args, kwargs in ims_cli().create_index.call_args_list]
+        self.assertEquals(sorted(created), sorted([sites_index] + COUCHDB_INDEXES.keys() + EDGE_INDEXES.keys()))
+
 
 @attr('INT',group='dm')
 class IndexBootStrapIntTest(IonIntegrationTestCase):
@@ -23,6 +23,7 @@ class CacheLauncher(StandaloneProcess):
         pd_cli = ProcessDispatcherServiceClient()
         dname = CACHE_DATASTORE_NAME
         number_of_workers = self.CFG.get_safe('process.number_of_workers', 2)
+        flush_interval = self.CFG.get_safe('process.flush_interval', 1.0)
 
         proc_def = ProcessDefinition(name='last_update_worker_process',description='Worker process for caching the last update from a stream')
         proc_def.executable['module'] = 'ion.processes.data.last_update_cache'
@@ -42,6 +43,9 @@ class CacheLauncher(StandaloneProcess):
             'couch_storage' : {
                 'datastore_name' : dname,
                 'datastore_profile' : 'SCIDATA'
+            },
+            'process' : {
+                'flush_interval' : flush_interval
             }
         }
 
@@ -16,12 +16,18 @@ from pyon.util.async import spawn
 from pyon.core.exception import IonException
 
 from pyon.datastore.couchdb.couchdb_datastore import sha1hex
-from interface.objects import DatasetIngestionTypeEnum, Coverage, CountElement
+from interface.objects import DatasetIngestionTypeEnum, Coverage, CountElement, QuantityRangeElement
 from pyon.core.exception import BadRequest
 from interface.services.coi.iresource_registry_service import ResourceRegistryServiceClient
 from pyon.event.event import EventSubscriber, EventPublisher
 
 from pyon.util.file_sys import FS, FileSystem
+from ion.services.dm.utility.granule_manifest import GranuleManifest
+from ion.services.dm.utility.dataset_store import DatasetStore
+from ion.services.dm.utility.hdf_image import HDFImage
+from gevent.coros import RLock
+from gevent.pool import Pool
+import gevent
 import hashlib
 
 class IngestionWorkerException(IonException):
@@ -64,6 +70,21 @@ class IngestionWorker(TransformDataProcess):
 
         self.ingest_config_id = self.CFG.get('configuration_id')
 
+        # 'file' writes one cache file per granule sha1, 'dataset' appends to one HDF5 store per stream
+        self.storage_backend = self.CFG.get('storage_backend', 'file')
+
+        #----------------------------------------------
+        # Batching: granules are held until batch_size of them are pending or batch_interval seconds pass
+        #----------------------------------------------
+        self.batch_size = self.CFG.get('batch_size', 1)
+        self.batch_interval = self.CFG.get('batch_interval', 0)
+        self.batch = []
+        self.batch_lock = RLock()
+        self.writer_pool = Pool(self.CFG.get('writer_pool_size', 4))
+        self.flush_gl = None
+        if self.batch_size > 1 and self.batch_interval > 0:
+            self.flush_gl = spawn(self._flush_loop)
+
         self.datastore_name = self.couch_config.get('datastore_name',None) or 'dm_datastore'
         try:
             self.datastore_profile = getattr(DataStore.DS_PROFILE, self.couch_config.get('datastore_profile','SCIDATA'))
@@ -126,6 +147,10 @@ class IngestionWorker(TransformDataProcess):
         # Get the dataset config for this stream
         dset_config = self.get_dataset_config(packet)
 
+        if self.batch_size > 1:
+            self.batch_granule(packet, dset_config)
+            return
+
         # Process the packet
 
         ingest_attributes = self.process_stream(packet, dset_config)
@@ -163,6 +188,132 @@ class IngestionWorker(TransformDataProcess):
 
         # Do the id or revision have a purpose? do we need a return value?
 
+    def persist_immutable_mult(self, objs):
+        """
+        Persists a batch of objects with a single bulk request, the ids are the content sha1 just like persist_immutable
+        @return: list with one flag per object, True when its document was written or already existed
+        """
+        docs = []
+        for obj in objs:
+            doc = self.db._ion_object_to_persistence_dict(obj)
+            doc['_id'] = sha1hex(doc)
+            docs.append(doc)
+
+        try:
+            results = self.db.create_doc_mult(docs, allow_ids=True)
+        except BadRequest:
+            log.exception('Failed to write batch of %d packets!', len(docs))
+            return [False] * len(docs)
+
+        written = []
+        for success, doc_id, rev in results:
+            # A conflict is a duplicate granule, deduplication in action
+            if success or 'conflict' in str(rev).lower():
+                written.append(True)
+            else:
+                log.error('Failed to write packet %s: %s', doc_id, rev)
+                written.append(False)
+        log.debug('Persisted %d of %d documents', written.count(True), len(docs))
+        return written
+
+    def batch_granule(self, packet, dset_config):
+        """
+        Adds a packet to the pending batch and flushes the batch once it is full
+        """
+        if dset_config is None:
+            log.info('No dataset config for this stream!')
+            return
+
+        with self.batch_lock:
+            self.batch.append((packet, dset_config))
+            full = len(self.batch) >= self.batch_size
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Persists the pending batch: the cache files are written by the writer pool, the couch documents with one bulk
+        request and one aggregated GranuleIngestedEvent is published per dataset in the batch. A granule which fails to
+        be prepared, or whose cache file or document fails to be written, is left out, the rest of the batch is still
+        ingested and an IngestionWorkerException reports the failures afterwards.
+        """
+        with self.batch_lock:
+            batch, self.batch = self.batch, []
+
+        if not batch:
+            return
+
+        prepared = []
+        for packet, dset_config in batch:
+            try:
+                ingestion_attributes, persist, write = self.prepare_stream(packet, dset_config)
+            except Exception:
+                log.exception('Failed to prepare a granule of stream %s', dset_config.stream_id)
+                continue
+            writer = None
+            if write:
+                writer = self.writer_pool.spawn(self.write_cache, packet, dset_config.stream_id,
+                    ingestion_attributes['number_of_records'], *write)
+            prepared.append((packet, dset_config, ingestion_attributes, persist, writer))
+
+        # The files are on disk before the documents which reference them are visible
+        self.writer_pool.join()
+        ingested = []
+        for packet, dset_config, ingestion_attributes, persist, writer in prepared:
+            if writer is not None and writer.exception is not None:
+                log.error('Failed to write a granule of stream %s to the cache: %s', dset_config.stream_id, writer.exception)
+                continue
+            ingested.append((packet, dset_config, ingestion_attributes, persist))
+
+        # Granules whose documents were not written are left out of the events
+        persisted = [item for item in ingested if item[3]]
+        if persisted:
+            written = self.persist_immutable_mult([item[0] for item in persisted])
+            failed = set([id(item) for item, ok in zip(persisted, written) if not ok])
+            ingested = [item for item in ingested if id(item) not in failed]
+
+        datasets = {}
+        for packet, dset_config, ingestion_attributes, persist in ingested:
+            if not datasets.has_key(dset_config.dataset_id):
+                datasets[dset_config.dataset_id] = {
+                    'stream_id' : dset_config.stream_id,
+                    'ingest_attributes' : {'variables':[], 'number_of_records':0, 'number_of_granules':0, 'updated_metadata':False, 'updated_data':False, 'bounds':{}}
+                }
+            aggregate = datasets[dset_config.dataset_id]['ingest_attributes']
+            for variable in ingestion_attributes['variables']:
+                if variable not in aggregate['variables']:
+                    aggregate['variables'].append(variable)
+            aggregate['number_of_records'] += max(ingestion_attributes['number_of_records'], 0)
+            aggregate['number_of_granules'] += 1
+            aggregate['updated_metadata'] = aggregate['updated_metadata'] or ingestion_attributes['updated_metadata']
+            aggregate['updated_data'] = aggregate['updated_data'] or ingestion_attributes['updated_data']
+            for key, value_pair in ingestion_attributes['bounds'].iteritems():
+                if key in aggregate['bounds']:
+                    value_pair = [min(aggregate['bounds'][key][0], value_pair[0]), max(aggregate['bounds'][key][1], value_pair[1])]
+                aggregate['bounds'][key] = value_pair
+
+        for dataset_id, aggregate in datasets.iteritems():
+            self.event_pub.publish_event(event_type="GranuleIngestedEvent", sub_type="DatasetIngest",
+                origin=dataset_id, status=200,
+                ingest_attributes=aggregate['ingest_attributes'], stream_id=aggregate['stream_id'])
+
+        headers = ''
+        for packet, dset_config, ingestion_attributes, persist in ingested:
+            # Hook to override just before processing is complete
+            self.ingest_process_test_hook(packet, headers)
+
+        if len(ingested) < len(batch):
+            raise IngestionWorkerException('Failed to ingest %d of %d granules' % (len(batch) - len(ingested), len(batch)))
+
+    def _flush_loop(self):
+        while True:
+            gevent.sleep(self.batch_interval)
+            try:
+                self.flush()
+            except Exception:
+                log.exception('Failed to flush the ingestion batch')
+
 
     def process_stream(self, packet, dset_config):
         """
@@ -173,12 +324,30 @@ class IngestionWorker(TransformDataProcess):
         """
 
 
-        ingestion_attributes={'variables':[], 'number_of_records':-1,'updated_metadata':False, 'updated_data':False}
-
         if dset_config is None:
             log.info('No dataset config for this stream!')
             return
 
+        ingestion_attributes, persist, write = self.prepare_stream(packet, dset_config)
+
+        if persist:
+            log.debug("Persisting data....")
+            self.persist_immutable(packet )
+
+        if write:
+            self.write_cache(packet, dset_config.stream_id, ingestion_attributes['number_of_records'], *write)
+
+        return ingestion_attributes
+
+    def prepare_stream(self, packet, dset_config):
+        """
+        Strips the values out of the packet and determines what the dset_config asks to persist.
+        @param: packet The incoming data stream of type stream.
+        @param: dset_config The dset_config telling this method what to do with the incoming data stream.
+        @return: tuple of the ingestion attributes, whether to persist the metadata and the cache write arguments (or None)
+        """
+        ingestion_attributes={'variables':[], 'number_of_records':-1,'updated_metadata':False, 'updated_data':False, 'bounds':{}}
+
         values_string = ''
         sha1 = ''
         encoding_type = ''
@@ -198,11 +367,15 @@ class IngestionWorker(TransformDataProcess):
             elif isinstance(value, CountElement):
                 ingestion_attributes['number_of_records'] = value.value
 
-        if dset_config.archive_metadata is True:
-            log.debug("Persisting data....")
+            elif isinstance(value, QuantityRangeElement):
+                # Lets dataset management keep the dataset bounds up to date without a map/reduce query
+                ingestion_attributes['bounds'][key] = list(value.value_pair)
+
+        persist = dset_config.archive_metadata is True
+        if persist:
             ingestion_attributes['updated_metadata'] = True
-            self.persist_immutable(packet )
 
+        write = None
         if dset_config.archive_data is True:
             #@todo - grab the filepath to save the hdf string somewhere..
 
@@ -216,18 +389,40 @@ class IngestionWorker(TransformDataProcess):
                 if sha1 != calculated_sha1:
                     raise  IngestionWorkerException('The sha1 stored is different than the calculated from the received hdf_string')
 
-                #log.warn('writing to filename: %s' % filename)
-
-                with open(filename, mode='wb') as f:
-                    f.write(values_string)
-                    f.close()
+                write = (filename, values_string, calculated_sha1, encoding_type)
             else:
                 log.warn("Nothing to write!")
 
+        return ingestion_attributes, persist, write
 
-        return ingestion_attributes
+    def write_cache(self, packet, stream_id, record_count, filename, values_string, sha1, encoding_type):
+        """
+        Writes the hdf string to the cache hierarchy, or the stream's dataset store, and records it in the stream's manifest
+        """
+        if self.storage_backend == 'dataset':
+            DatasetStore(stream_id).append(sha1, HDFImage(values_string).datasets)
+        else:
+            #log.warn('writing to filename: %s' % filename)
+
+            with open(filename, mode='wb') as f:
+                f.write(values_string)
+                f.close()
+
+        self.update_manifest(packet, stream_id, sha1, encoding_type, record_count)
+
+    def update_manifest(self, packet, stream_id, sha1, encoding_type, record_count):
+        """
+        Records the time span of a persisted granule in the stream's manifest so replay can skip files outside a window
+        """
+        time_bounds = packet.identifiables.get('time_bounds')
+        if time_bounds is None or record_count < 1:
+            log.debug('Granule has no time bounds, not adding it to the manifest')
+            return
+        first, last = time_bounds.value_pair[0], time_bounds.value_pair[1]
+        GranuleManifest(stream_id).append(sha1, encoding_type, first, last, record_count)
 
     def on_stop(self):
+        self._stop_batching()
         TransformDataProcess.on_stop(self)
 
         # close event subscriber safely
@@ -238,6 +433,7 @@ class IngestionWorker(TransformDataProcess):
         self.db.close()
 
     def on_quit(self):
+        self._stop_batching()
         TransformDataProcess.on_quit(self)
 
         # close event subscriber safely
@@ -249,6 +445,16 @@ class IngestionWorker(TransformDataProcess):
 
 
 
+    def _stop_batching(self):
+        if self.flush_gl is not None:
+            self.flush_gl.kill()
+            self.flush_gl = None
+        # Nothing pending may be lost on shutdown, a failed granule must not stop the teardown either
+        try:
+            self.flush()
+        except Exception:
+            log.exception('Failed to flush the ingestion batch on shutdown')
+
     def get_dataset_config(self, incoming_packet):
         """
         Gets the dset_config for the data stream
@@ -26,6 +26,7 @@ from pyon.event.event import EventSubscriber, EventPublisher
 from pyon.util.containers import get_ion_ts
 
 from pyon.util.file_sys import FS, FileSystem
+from ion.services.dm.utility.dataset_store import DatasetStore
 import hashlib
 
 class IngestionWorkerException(IonException):
@@ -67,6 +68,9 @@ class IngestionWorker(TransformDataProcess):
 
         self.ingest_config_id = self.CFG.get('configuration_id')
 
+        # 'file' writes one cache file per granule sha1, 'dataset' appends to one HDF5 store per stream
+        self.storage_backend = self.CFG.get('storage_backend', 'file')
+
         self.datastore_name = self.couch_config.get('datastore_name',None) or 'dm_datastore'
         try:
             self.datastore_profile = getattr(DataStore.DS_PROFILE, self.couch_config.get('datastore_profile','SCIDATA'))
@@ -193,11 +197,14 @@ class IngestionWorker(TransformDataProcess):
 
 
 
-        filename = FileSystem.get_hierarchical_url(FS.CACHE, calculated_sha1, ".%s" % encoding_type)
+        if self.storage_backend == 'dataset':
+            DatasetStore(dset_config.stream_id).append_bytes(calculated_sha1, byte_string)
+        else:
+            filename = FileSystem.get_hierarchical_url(FS.CACHE, calculated_sha1, ".%s" % encoding_type)
 
-        with open(filename, mode='wb') as f:
-            f.write(byte_string)
-            f.close()
+            with open(filename, mode='wb') as f:
+                f.write(byte_string)
+                f.close()
 
 
         return ingestion_attributes
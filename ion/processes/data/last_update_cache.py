@@ -6,6 +6,7 @@
 from prototype.sci_data.stream_parser import PointSupplementStreamParser
 from pyon.core.exception import NotFound
 from pyon.public import log
+from pyon.util.async import spawn
 from pyon.ion.transform import TransformDataProcess
 from pyon.datastore.datastore import DataStore
 from pyon.util.file_sys import FileSystem
@@ -13,15 +14,116 @@ from interface.objects import StreamGranuleContainer, LastUpdate
 from interface.objects import LastUpdateVariable as Variable
 from interface.services.dm.ipubsub_management_service import PubsubManagementServiceProcessClient
 from prototype.hdf.hdf_array_iterator import acquire_data
+from ion.services.dm.utility.hdf_image import last_values
+import gevent
 
 
 
 CACHE_DATASTORE_NAME = 'last_update_datastore'
 
+
+class LastUpdateTable(object):
+    '''
+    The last update of each stream, held in memory for the container and written to couch in bulk.
+
+    The cache workers of a container share one table, the table is flushed every interval seconds by a greenlet
+    which runs while any worker uses the table. Only the streams updated since the last flush are written.
+    '''
+    def __init__(self, db, interval=1.0):
+        self.db = db
+        self.interval = interval
+        self.values = {}
+        self.dirty = set()
+        self.revisions = {}
+        self._users = 0
+        self._greenlet = None
+
+    @classmethod
+    def get(cls, container, db, interval=1.0):
+        table = getattr(container, 'last_update_table', None)
+        if table is None:
+            table = cls(db, interval)
+            container.last_update_table = table
+        return table
+
+    def start(self):
+        self._users += 1
+        if self._greenlet is None:
+            self._greenlet = spawn(self._run)
+
+    def stop(self):
+        self._users -= 1
+        if self._users <= 0 and self._greenlet is not None:
+            # A flush interrupted by the kill leaves its streams dirty, they are written below
+            self._greenlet.kill(block=True)
+            self._greenlet = None
+            self.flush()
+
+    def _run(self):
+        while True:
+            gevent.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                log.exception('Failed to flush the last update cache')
+
+    def update(self, stream_id, last_update):
+        self.values[stream_id] = last_update
+        self.dirty.add(stream_id)
+
+    def read(self, stream_id):
+        '''
+        @return the LastUpdate of the stream, None when the stream has not been updated since the table started
+        '''
+        return self.values.get(stream_id)
+
+    def flush(self):
+        '''
+        @brief Writes the dirty streams, a stream stays dirty until its last update is written
+        '''
+        if not self.dirty:
+            return
+        values = dict((stream_id, self.values[stream_id]) for stream_id in self.dirty)
+
+        unknown = [stream_id for stream_id in values if stream_id not in self.revisions]
+        if unknown:
+            self._read_revisions(unknown)
+
+        docs = []
+        for stream_id, value in values.iteritems():
+            doc = self.db._ion_object_to_persistence_dict(value)
+            doc['_id'] = stream_id
+            if stream_id in self.revisions:
+                doc['_rev'] = self.revisions[stream_id]
+            docs.append(doc)
+
+        for success, doc_id, rev in self.db.create_doc_mult(docs, allow_ids=True):
+            if success:
+                self.revisions[doc_id] = rev
+                # Streams updated during the write are written again on the next flush
+                if self.values.get(doc_id) is values[doc_id]:
+                    self.dirty.discard(doc_id)
+            else:
+                # Updated elsewhere, the revision is read again on the next flush
+                log.debug('Conflict writing the last update of %s', doc_id)
+                self.revisions.pop(doc_id, None)
+        log.debug('Flushed the last update of %d streams', len(docs))
+
+    def _read_revisions(self, stream_ids):
+        try:
+            docs = self.db.read_doc_mult(stream_ids)
+        except NotFound:
+            docs = []
+        for doc in docs:
+            if doc:
+                self.revisions[doc['_id']] = doc['_rev']
+
+
 class LastUpdateCache(TransformDataProcess):
     def __init__(self, *args, **kwargs):
         super(LastUpdateCache, self).__init__()
         self.def_cache = {}
+        self.field_cache = {}
 
 
     def on_start(self):
@@ -45,25 +147,20 @@ class LastUpdateCache(TransformDataProcess):
 
         self.ps_cli = PubsubManagementServiceProcessClient(process=self)
 
+        self.table = LastUpdateTable.get(self.container, self.db, self.CFG.get_safe('process.flush_interval', 1.0))
+        self.table.start()
+
+    def on_quit(self):
+        self.table.stop()
+        super(LastUpdateCache, self).on_quit()
 
 
     def process(self, packet):
 
         if isinstance(packet,StreamGranuleContainer):
             granule = packet
-            lu = self.db._ion_object_to_persistence_dict(self.get_last_value(granule))
-            try:
-                doc = self.db.read_doc(granule.stream_resource_id)
-                doc_id = doc.id
-                doc_rev = doc.rev
-
-            except NotFound:
-                log.debug('Creating...')
-                doc_id, doc_rev = self.db.create_doc(lu,object_id=granule.stream_resource_id)
-            lu['_id'] = doc_id
-            lu['_rev'] = doc_rev
-
-            self.db.update_doc(lu)
+            # Written to couch by the table's flush
+            self.table.update(granule.stream_resource_id, self.get_last_value(granule))
 
 
         else:
@@ -79,7 +176,59 @@ class LastUpdateCache(TransformDataProcess):
             self.def_cache[stream_resource_id] = stream_def.container
 
         definition = self.def_cache[stream_resource_id]
+        if not self.field_cache.has_key(stream_resource_id):
+            self.field_cache[stream_resource_id] = self.get_fields(definition, granule)
+        fields = self.field_cache[stream_resource_id]
+
+        data_stream = granule.identifiables[granule.data_stream_id]
+
+        # Only the last record of each field is read from the hdf string
+        values_paths = {}
+        for field, range_id, _, _ in fields:
+            range_set = granule.identifiables.get(range_id)
+            values_paths[field] = getattr(range_set, 'values_path', None) or definition.identifiables[range_id].values_path
+        last = last_values(data_stream.values, values_paths.values())
+        if not all(('/' + values_paths[field].lstrip('/')) in last for field in values_paths):
+            log.debug('Granule values are not where the definition expects them, parsing the whole granule')
+            return self.parse_last_value(definition, granule)
 
+        lu = LastUpdate()
+        lu.timestamp = data_stream.timestamp.value
+        for field, range_id, field_definition, units in fields:
+            lu.variables[field] = Variable()
+            if field_definition is not None:
+                lu.variables[field].definition = field_definition
+            if units is not None:
+                lu.variables[field].units = units
+            value = last['/' + values_paths[field].lstrip('/')]
+            if value is not None:
+                lu.variables[field].value = float(value)
+        return lu
+
+    @staticmethod
+    def get_fields(definition, granule):
+        '''
+        @brief Gets the field metadata of a stream definition, it is the same for every granule on the stream
+        @return list of (field name, range id, field definition, units)
+        '''
+        psp = PointSupplementStreamParser(stream_definition=definition, stream_granule=granule)
+        fields = []
+        for field in psp.list_field_names():
+            range_id = definition.identifiables[field].range_id
+            field_definition = None
+            units = None
+            if definition.identifiables.has_key(field):
+                field_definition = definition.identifiables[field].definition
+            if definition.identifiables.has_key(range_id):
+                units = definition.identifiables[range_id].unit_of_measure.code
+            fields.append((field, range_id, field_definition, units))
+        return fields
+
+    @staticmethod
+    def parse_last_value(definition, granule):
+        '''
+        @brief Gets the last values by parsing the whole granule
+        '''
         psp = PointSupplementStreamParser(stream_definition=definition, stream_granule=granule)
         fields = psp.list_field_names()
 
@@ -94,4 +243,4 @@ class LastUpdateCache(TransformDataProcess):
             if definition.identifiables.has_key(range_id):
                 lu.variables[field].units = definition.identifiables[range_id].unit_of_measure.code
             lu.variables[field].value = float(psp.get_values(field_name=field)[-1])
-        return lu
\ No newline at end of file
+        return lu
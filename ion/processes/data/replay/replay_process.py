@@ -19,7 +19,10 @@ from pyon.util.file_sys import FS, FileSystem
 
 from prototype.hdf.hdf_array_iterator import acquire_data
 from prototype.hdf.hdf_codec import HDFEncoder
-from prototype.sci_data.constructor_apis import DefinitionTree, PointSupplementConstructor
+from prototype.sci_data.constructor_apis import DefinitionTree
+from ion.services.dm.utility.granule_manifest import GranuleManifest
+from ion.services.dm.utility.hdf_image import HDFImage
+from ion.services.dm.utility.dataset_store import DatasetStore
 
 from interface.objects import BlogBase, StreamGranuleContainer, StreamDefinitionContainer, CoordinateAxis, QuantityRangeElement, CountElement, RangeSet
 from interface.services.dm.ireplay_process import BaseReplayProcess
@@ -44,6 +47,7 @@ class ReplayProcess(BaseReplayProcess):
 
         super(ReplayProcess,self).__init__(*args,**kwargs)
         self.lock = RLock()
+        self._hdf_image = None
 
     def on_start(self):
 
@@ -59,6 +63,10 @@ class ReplayProcess(BaseReplayProcess):
 
         self.fields = self.delivery_format.get('fields',None)
 
+        # Streaming replay walks the view page by page instead of merging the whole dataset up front
+        self.streaming = self.delivery_format.get('streaming', False)
+        self.page_size = self.delivery_format.get('page_size', 100)
+
         self.view_name = self.CFG.get_safe('process.view_name','datasets/dataset_by_id')
         self.key_id = self.CFG.get_safe('process.key_id')
         self.stream_id = self.CFG.get_safe('process.publish_streams.output')
@@ -75,6 +83,9 @@ class ReplayProcess(BaseReplayProcess):
         self.domain_ids = self.definition.identifiables[self.data_record_id].domain_ids
         self.time_id = self.definition.identifiables[self.domain_ids[0]].temporal_coordinate_vector_id
 
+        # Granules ingested with the dataset storage backend
+        self.store = DatasetStore(self.key_id)
+
     def execute_replay(self):
         '''
         @brief Spawns a greenlet to take care of the query and work
@@ -93,8 +104,11 @@ class ReplayProcess(BaseReplayProcess):
             'include_docs':True
         }
 
-        g = Greenlet(self._query,datastore_name=datastore_name, view_name=view_name, opts=opts,
-            callback=lambda results: self._publish_query(results))
+        if self.streaming:
+            g = Greenlet(self._publish_stream, datastore_name=datastore_name, view_name=view_name, opts=opts)
+        else:
+            g = Greenlet(self._query,datastore_name=datastore_name, view_name=view_name, opts=opts,
+                callback=lambda results: self._publish_query(results))
         g.start()
 
     def _query(self,datastore_name='dm_datastore', view_name='posts/posts_by_id', opts={}, callback=None):
@@ -111,6 +125,170 @@ class ReplayProcess(BaseReplayProcess):
 
         callback(ret)
 
+    def _query_pages(self, datastore_name='dm_datastore', view_name='posts/posts_by_id', opts={}, page_size=100):
+        '''
+        @brief Generator which walks the view one page at a time
+        @param datastore_name Name of the datastore
+        @param view_name The name of the design view where the data is organized
+        @param opts options to pass, limit and the start of each page are managed here
+        @param page_size Number of rows to fetch per query
+        @return Yields a list of view results per page
+        '''
+        assert page_size > 0, 'page size must be positive.'
+        db = self.container.datastore_manager.get_datastore(datastore_name, DataStore.DS_PROFILE.SCIDATA, self.CFG)
+
+        #-------------------------------------------------------------------------------------
+        # Each query fetches one row more than a page, that row is where the next page starts.
+        # Rows sharing a key are told apart by their document id, so no rows are skipped over.
+        #-------------------------------------------------------------------------------------
+        page_opts = dict(opts)
+        page_opts['limit'] = page_size + 1
+        while True:
+            results = db.query_view(view_name=view_name, opts=page_opts)
+            if not results:
+                return
+            yield results[:page_size]
+            if len(results) <= page_size:
+                return
+            page_opts['start_key'] = results[page_size]['key']
+            page_opts['startkey_docid'] = results[page_size]['id']
+
+    def _record_window(self):
+        '''
+        @brief Determines the window of records requested in the delivery format
+        @return tuple (lower, upper) where upper is None when unbounded
+        '''
+        if not self.delivery_format.has_key('time'):
+            return 0, None
+        time_bounds = self.delivery_format['time']
+        return max(time_bounds[0]-1, 0), time_bounds[1]
+
+    def _publish_stream(self, datastore_name='dm_datastore', view_name='posts/posts_by_id', opts={}):
+        '''
+        @brief Publishes the dataset incrementally while walking the view page by page
+        @param datastore_name Name of the datastore
+        @param view_name The name of the design view where the data is organized
+        @param opts options to pass
+
+        @description Only the granules which have not been completely published are held in memory. Once enough
+        records are pending they are merged, subset and published in chunks of delivery_format['records'], when
+        no chunk size is given the pending records are published at the end of each page. Records are published in
+        the order of the view, a granule whose first time value was already published is dropped as _merge does.
+        '''
+        chunk_size = self.delivery_format.get('records', 0)
+        assert isinstance(chunk_size, int), 'delivery format is incorrectly formatted.'
+        lower, upper = self._record_window()
+        # Granules outside the time range are not read, unless records are being counted for a record window
+        time_range = None
+        if not self.delivery_format.has_key('time'):
+            time_range = self.delivery_format.get('time_range')
+
+        pending = []    # parsed granules that are not yet completely published
+        pending_count = 0 # records held in pending
+        start = 0       # index within the pending records where the next output begins
+        seen = 0        # records read from the view so far
+        used_vals = set() # first time values of the granules read so far
+
+        for results in self._query_pages(datastore_name, view_name, opts, self.page_size):
+            for msg in self._parse_results(results):
+                if upper is not None and seen >= upper:
+                    break
+                if msg['time_bounds'][0] in used_vals:
+                    continue
+                used_vals.add(msg['time_bounds'][0])
+                if time_range and not (msg['time_bounds'][0] <= time_range[1] and msg['time_bounds'][1] >= time_range[0]):
+                    continue
+                first = seen
+                seen += msg['records']
+                if seen <= lower:
+                    continue # Entirely before the requested window
+                if not pending:
+                    start = max(lower - first, 0)
+                pending.append(msg)
+                pending_count += msg['records']
+
+                if chunk_size and self._stop_index(seen, pending_count, upper) - start >= chunk_size:
+                    start = self._publish_pending(pending, start, self._stop_index(seen, pending_count, upper), chunk_size)
+                    start, pending_count = self._trim_pending(pending, start, pending_count)
+
+            if upper is not None and seen >= upper:
+                break
+
+            if pending and not chunk_size:
+                start = self._publish_pending(pending, start, self._stop_index(seen, pending_count, upper), 0, drain=True)
+                start, pending_count = self._trim_pending(pending, start, pending_count)
+
+        if pending:
+            self._publish_pending(pending, start, self._stop_index(seen, pending_count, upper), chunk_size, drain=True)
+
+    def _stop_index(self, seen, pending_count, upper):
+        '''
+        @brief Converts the upper bound of the window into an index within the pending records
+        '''
+        if upper is None:
+            return pending_count
+        return min(pending_count, upper - (seen - pending_count))
+
+    def _publish_pending(self, pending, start, stop, chunk_size, drain=False):
+        '''
+        @brief Merges the pending granules and publishes the records from start to stop
+        @param pending list of parsed granules
+        @param start index of the first record to publish
+        @param stop index after the last record to publish
+        @param chunk_size number of records per published granule, 0 for a single granule
+        @param drain publish a trailing chunk smaller than chunk_size
+        @return index of the first record that was not published
+        '''
+        if stop <= start:
+            return start
+
+        # Merging modifies the first granule in place and it may be needed for the next merge
+        msgs = [dict(pending[0], granule=copy.deepcopy(pending[0]['granule']))] + pending[1:]
+        # The records are counted in the order of pending, so they have to be merged in that order
+        granule = self._merge(msgs, keep_order=True)
+        if not granule:
+            return start
+
+        if self.delivery_format.has_key('fields'):
+            granule = self.subset(granule,self.delivery_format['fields'])
+
+        total_records = granule.identifiables[self.element_count_id].value
+        granule.identifiables[self.element_count_id].constraint.intervals = [[0, total_records-1],]
+
+        step = chunk_size or (stop - start)
+        while stop - start >= step:
+            self._publish_chunk(self._slice(granule, slice(start, start+step)))
+            start += step
+
+        if drain and start < stop:
+            self._publish_chunk(self._slice(granule, slice(start, stop)))
+            start = stop
+
+        return start
+
+    def _publish_chunk(self, chunk):
+        '''
+        @brief Applies the time range to a streamed chunk and publishes what is left of it
+        '''
+        if self.delivery_format.has_key('time_range'):
+            chunk = self.time_range_subset(chunk, self.delivery_format['time_range'])
+            if chunk is None:
+                return
+        self.lock.acquire()
+        self.output.publish(chunk)
+        self.lock.release()
+
+    def _trim_pending(self, pending, start, pending_count):
+        '''
+        @brief Drops the granules whose records have all been published
+        @return tuple of the adjusted start index and pending record count
+        '''
+        while pending and pending[0]['records'] <= start:
+            records = pending.pop(0)['records']
+            start -= records
+            pending_count -= records
+        return start, pending_count
+
     def _publish_query(self, results):
         '''
         @brief Publishes the appropriate data based on the delivery format and data returned from query
@@ -124,6 +302,7 @@ class ReplayProcess(BaseReplayProcess):
         publish_queue = self._parse_results(results)
         for item in publish_queue:
             log.debug('Item in queue: %s' % type(item))
+        publish_queue, window = self._select_from_manifest(publish_queue)
         granule = self._merge(publish_queue)
         if not granule:
             return # no dataset
@@ -132,9 +311,17 @@ class ReplayProcess(BaseReplayProcess):
             res = self.subset(granule,self.delivery_format['fields'])
             granule = res
 
-        if self.delivery_format.has_key('time'):
+        if window is not None:
+            granule = self._slice(granule, window)
+        elif self.delivery_format.has_key('time'):
             granule = self.time_subset(granule, self.delivery_format['time'])
 
+        if self.delivery_format.has_key('time_range'):
+            granule = self.time_range_subset(granule, self.delivery_format['time_range'])
+            if granule is None:
+                log.info('No records in the requested time range')
+                return
+
         total_records = granule.identifiables[self.element_count_id].value
         granule.identifiables[self.element_count_id].constraint.intervals = [[0, total_records-1],]
 
@@ -153,6 +340,39 @@ class ReplayProcess(BaseReplayProcess):
         self.output.publish(granule)
         self.lock.release()
 
+    def _select_from_manifest(self, publish_queue):
+        '''
+        @brief Drops the granules which fall outside the requested window before they are merged
+        @param publish_queue parsed granules
+        @return tuple of the remaining granules and the record slice to take from their merge (None for time_subset)
+
+        @description Record windows are counted over the granules which are merged, in the order _merge concatenates
+        them. Time ranges use the stream's granule manifest, which is only trusted when it covers every granule in
+        the queue, otherwise the whole dataset is merged and subset as before.
+        '''
+        if self.delivery_format.has_key('time'):
+            lower, upper = self._record_window()
+            ordered = self._merge_order(publish_queue)
+            retval, offset = GranuleManifest.in_record_range(ordered, lower, upper)
+            log.debug('Record window selected %d of %d granules', len(retval), len(publish_queue))
+            return retval, slice(lower - offset, upper - offset)
+
+        if not self.delivery_format.has_key('time_range'):
+            return publish_queue, None
+
+        entries = GranuleManifest(self.key_id).entries()
+        manifested = set([entry['sha1'] for entry in entries])
+        if not entries or any(msg['sha1'] not in manifested for msg in publish_queue):
+            return publish_queue, None
+
+        lower, upper = self.delivery_format['time_range']
+        entries = GranuleManifest.in_time_range(entries, lower, upper)
+
+        selected = set([entry['sha1'] for entry in entries])
+        retval = [msg for msg in publish_queue if msg['sha1'] in selected]
+        log.debug('Manifest selected %d of %d granules', len(retval), len(publish_queue))
+        return retval, None
+
     def _parse_results(self, results):
         '''
         @brief Switch-case logic for what packet types replay can handle and how to handle
@@ -242,43 +462,42 @@ class ReplayProcess(BaseReplayProcess):
         fields = self._list_data(self.definition,granule)
         record_count = slice_.stop - slice_.start
         assert record_count > 0, 'slice is malformed'
-        pairs = self._pair_up(granule)
-        var_names = list([i[0] for i in pairs]) # Get the var_names from the pairs
-        log.debug('var_names: %s',var_names)
-        file_path = self._get_hdf_from_string(granule.identifiables[self.data_stream_id].values)
+        image = self._get_image(granule.identifiables[self.data_stream_id].values)
         codec = HDFEncoder()
-        vectors = acquire_data([file_path],var_names,record_count,slice_ ).next()
-
-        for row, value in vectors.iteritems():
-            vp = self._find_vp(pairs, row)
-            # Determine the range_id reverse dictionary lookup
-            #@todo: improve this pattern
-            for field,path in fields.iteritems():
-                if vp==path:
-                    range_id = field
-                    break
+
+        for range_id, vp in fields.iteritems():
+            values = image.values(vp, slice_)
             bounds_id = retval.identifiables[range_id].bounds_id
             # Recalculate the bounds for this fields and update the granule
-            range = value['range']
+            range = HDFImage.bounds(values)
             retval.identifiables[bounds_id].value_pair[0] = float(range[0])
             retval.identifiables[bounds_id].value_pair[1] = float(range[1])
-            codec.add_hdf_dataset(vp, value['values'])
-            record_count = len(value['values'])
+            codec.add_hdf_dataset(vp, values)
+            record_count = len(values)
             #----- DEBUGGING ---------
-            log.debug('slice- row: %s', row)
             log.debug('slice- value_path: %s', vp)
             log.debug('slice- range_id: %s', range_id)
             log.debug('slice- bounds_id: %s', bounds_id)
-            log.debug('slice- limits: %s', value['range'])
+            log.debug('slice- limits: %s', range)
             #-------------------------
 
 
         retval.identifiables[self.element_count_id].value = record_count
         hdf_string = codec.encoder_close()
         self._patch_granule(retval, hdf_string)
-        FileSystem.unlink(file_path)
         return retval
 
+    def _get_image(self, hdf_string):
+        '''
+        @brief Decodes the hdf_string in memory, the last image is kept since subsetting reads the same dataset repeatedly
+        @param hdf_string binary string consisting of an HDF5 file.
+        @return HDFImage of the string
+        '''
+        sha1 = hashlib.sha1(hdf_string).hexdigest().upper()
+        if self._hdf_image is None or self._hdf_image.sha1 != sha1:
+            self._hdf_image = HDFImage(hdf_string)
+        return self._hdf_image
+
 
     def _parse_granule(self, granule):
         '''
@@ -309,17 +528,22 @@ class ReplayProcess(BaseReplayProcess):
             log.debug('Granule had no sha1')
             return None
 
+        if not 'time_bounds' in granule.identifiables:
+            log.debug('Granule had no time bounds discarding.')
+            return None
+
 
         filepath = FileSystem.get_hierarchical_url(FS.CACHE, sha1, '.hdf5')
 
-        if not os.path.exists(filepath):
+        if not os.path.exists(filepath) and not self.store.has(sha1):
             log.debug('File with sha1 does not exist')
             return None
 
         return {
             'granule':granule,
             'records':record_count,
-            'sha1':sha1
+            'sha1':sha1,
+            'time_bounds':tuple(granule.identifiables['time_bounds'].value_pair)
         }
 
     @staticmethod
@@ -467,73 +691,75 @@ class ReplayProcess(BaseReplayProcess):
 
 
 
-    def _merge(self, msgs):
+    def _merge_order(self, msgs):
+        '''
+        @brief Orders the parsed granules the way _merge concatenates their records
+        @param msgs parsed granules
+        @return the granules ordered by their first time value, a granule whose first time value was already used
+        is dropped
+        '''
+        ordered = list()
+        used_vals = set()
+        for msg in msgs:
+            first = msg['time_bounds'][0]
+            if first in used_vals:
+                continue
+            used_vals.add(first)
+            ordered.append((first, msg['sha1'], msg))
+        ordered.sort(key=lambda i: i[:2])
+        return list([i[2] for i in ordered])
+
+    def _merge(self, msgs, keep_order=False):
         '''
         @brief Merges all the granules and datasets into one large dataset (Union)
         @param msgs raw granules from couch
+        @param keep_order concatenate the records in the order of msgs instead of the order of _merge_order
         @return complete dataset
         @description
              n
         D := U [ msgs_i ]
             i=0
         '''
-        granule = None
-        file_list = list()
-        count = len(msgs)
-        used_vals = list()
+        if not keep_order:
+            msgs = self._merge_order(msgs)
 
         #-------------------------------------------------------------------------------------
         # Merge each granule to another granule one by one.
-        # After each merge operation keep track of what files belong where on the timeline
+        # The records are concatenated in the order of msgs
         #-------------------------------------------------------------------------------------
-
-
-        for i in xrange(count):
-            if i==0:
-                granule = msgs[0]['granule']
-                psc = PointSupplementConstructor(point_definition=self.definition)
-
-                res = ReplayProcess.merge_granule(definition=self.definition, granule1=granule, granule2=None)
-                granule = res['granule']
-                file_pair = res['files']
-                log.debug('file_pair: %s', file_pair)
-
-                if file_pair[0] not in file_list and file_pair[0][0] not in used_vals:
-                    file_list.append( tuple(file_pair[0]))
-                    used_vals.append(file_pair[0][0])
-
-
+        granule = None
+        for msg in msgs:
+            if granule is None:
+                res = ReplayProcess.merge_granule(definition=self.definition, granule1=msg['granule'], granule2=None)
             else:
-                res = ReplayProcess.merge_granule(definition=self.definition, granule1=granule, granule2=msgs[i]['granule'])
-
-                granule = res['granule']
-                file_pair = res['files']
-                log.debug('file_pair: %s', file_pair)
-
-                if file_pair[0] not in file_list and file_pair[0][0] not in used_vals:
-                    file_list.append( tuple(file_pair[0]))
-                    used_vals.append(file_pair[0][0])
-                if file_pair[1] not in file_list and file_pair[1][0] not in used_vals:
-                    file_list.append(tuple(file_pair[1]))
-                    used_vals.append(file_pair[1][0])
+                res = ReplayProcess.merge_granule(definition=self.definition, granule1=granule, granule2=msg['granule'])
+            granule = res['granule']
+            log.debug('file_pair: %s', res['files'])
 
         if not granule:
             return
+        file_list = list(['%s.hdf5' % msg['sha1'] for msg in msgs])
         log.debug('file_list: %s', file_list)
-        #-------------------------------------------------------------------------------------
-        # Order the lists using a stable sort from python (by the first value in the tuples
-        # Then peel off just the file names
-        # Then get the appropriate URL for the file using FileSystem
-        #-------------------------------------------------------------------------------------
-        file_list.sort()
-        file_list = list(i[1] for i in file_list)
-        file_list = list([FileSystem.get_hierarchical_url(FS.CACHE, '%s' % i) for i in file_list])
 
         pairs = self._pair_up(granule)
         var_names = list([i[0] for i in pairs])
 
         record_count = granule.identifiables[self.element_count_id].value
         codec = HDFEncoder()
+
+        #-------------------------------------------------------------------------------------
+        # Granules in the dataset store are read as contiguous hyperslabs
+        #-------------------------------------------------------------------------------------
+        sha1s = list([i.split('.')[0] for i in file_list])
+        if self.store.exists() and None not in self.store.spans(sha1s):
+            data = self.store.read([i[1] for i in pairs], sha1s)
+            for value_path, values in data.iteritems():
+                codec.add_hdf_dataset(value_path,nparray=values)
+            hdf_string = codec.encoder_close()
+            self._patch_granule(granule,hdf_string)
+            return granule
+
+        file_list = list([FileSystem.get_hierarchical_url(FS.CACHE, '%s' % i) for i in file_list])
         log.debug('acquire_data:')
         log.debug('\tfile_list: %s', file_list)
         log.debug('\tfields: %s', var_names)
@@ -580,18 +806,32 @@ class ReplayProcess(BaseReplayProcess):
 
 
 
-    def _get_time_index(self, granule, timeval):
+    def time_range_subset(self, granule, time_range):
         '''
-        @brief Obtains the index where a time's value is
+        @brief Obtains a subset of the granule dataset whose time values fall within time_range
+        @param granule Dataset
+        @param time_range tuple consisting of a lower and upper time value (inclusive)
+        @return A subset of the granule's dataset or None if no records are in the range
+        '''
+        import numpy as np
+        assert isinstance(granule, StreamGranuleContainer), 'object is not a granule.'
+        time_vector = self._get_time_vector(granule)
+        lower = np.searchsorted(time_vector, time_range[0], side='left')
+        upper = np.searchsorted(time_vector, time_range[1], side='right')
+        if upper <= lower:
+            return None
+        return self._slice(granule, slice(int(lower), int(upper)))
+
+    def _get_time_vector(self, granule):
+        '''
+        @brief Reads the time vector of a dataset
         @param granule must be a complete dataset (hdf_string provided)
-        @param timeval the vector value
-        @return Index value for timeval or closest approx such that timeval is IN the subset
+        @return numpy array of the time values
         '''
         assert isinstance(granule, StreamGranuleContainer), 'object is not a granule.'
         assert granule.identifiables[self.data_stream_id].values, 'hdf_string is not provided.'
 
         hdf_string = granule.identifiables[self.data_stream_id].values
-        file_path = self._get_hdf_from_string(hdf_string)
 
         #-------------------------------------------------------------------------------------
         # Determine the field_id for the temporal coordinate vector (aka time)
@@ -601,46 +841,7 @@ class ReplayProcess(BaseReplayProcess):
         value_path = granule.identifiables[time_field].values_path or self.definition.identifiables[time_field].values_path
         record_count = granule.identifiables[self.element_count_id].value
 
-        #-------------------------------------------------------------------------------------
-        # Go through the time vector and get the indexes that correspond to the timeval
-        # It will find a value such that
-        # t_n <= i < t_(n+1), where i is the index
-        #-------------------------------------------------------------------------------------
-
-
-        var_name = value_path.split('/').pop()
-        res = acquire_data([file_path], [var_name], record_count).next()
-        time_vector = res[var_name]['values']
-        retval = 0
-        for i in xrange(len(time_vector)):
-            if time_vector[i] == timeval:
-                retval = i
-                break
-            elif i==0 and time_vector[i] > timeval:
-                retval = i
-                break
-            elif (i+1) < len(time_vector): # not last val
-                if time_vector[i] < timeval and time_vector[i+1] > timeval:
-                    retval = i
-                    break
-            else: # last val
-                retval = i
-                break
-        FileSystem.unlink(file_path)
-        return retval
-
-    def _get_hdf_from_string(self, hdf_string):
-        '''
-        @param hdf_string binary string consisting of an HDF5 file.
-        @return temporary file (full path) where the string was written to.
-        @note client's responsible to unlink when finished.
-        '''
-        f = FileSystem.mktemp()
-        f.write(hdf_string)
-        retval = f.name
-        f.close()
-        return retval
-
+        return self._get_image(hdf_string).values(value_path, slice(0, record_count))
 
     def subset(self,granule,coverages):
         '''
@@ -649,7 +850,6 @@ class ReplayProcess(BaseReplayProcess):
         '''
         assert isinstance(granule, StreamGranuleContainer), 'object is not a granule.'
         field_ids = self.field_ids
-        element_count_id = self.element_count_id
 
 
         values_path = list()
@@ -734,26 +934,18 @@ class ReplayProcess(BaseReplayProcess):
         log.debug('Ranges: %s', coverage_ids)
         log.debug('Values_paths: %s', values_path)
 
-        file_path = self._get_hdf_from_string(granule.identifiables[self.data_stream_id].values)
+        image = self._get_image(granule.identifiables[self.data_stream_id].values)
         full_coverage = list(domain_ids + coverage_ids)
 
         log.debug('Full coverage: %s' % full_coverage)
-        log.debug('Calling acquire_data with: %s, %s, %s', [file_path],values_path,granule.identifiables[element_count_id].value)
 
         codec = HDFEncoder()
 
-        pairs = self._pair_up(granule)
-        var_names = list([i[0] for i in pairs])
-
         record_count = granule.identifiables[self.element_count_id].value
-        data = acquire_data([file_path], var_names, record_count).next()
-        for row,value in data.iteritems():
-            vp = self._find_vp(pairs, row)
-            codec.add_hdf_dataset(vp, value['values'])
+        for var_name, vp in self._pair_up(granule):
+            codec.add_hdf_dataset(vp, image.values(vp, slice(0, record_count)))
 
         hdf_string = codec.encoder_close()
         self._patch_granule(granule,hdf_string)
 
-        FileSystem.unlink(file_path)
-
         return granule
\ No newline at end of file
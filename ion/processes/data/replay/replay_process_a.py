@@ -12,9 +12,40 @@ from interface.services.dm.idataset_management_service import DatasetManagementS
 from pyon.core.exception import BadRequest, IonException
 from pyon.util.file_sys import FileSystem,FS
 from pyon.core.interceptor.encode import decode_ion
+from pyon.core.bootstrap import get_obj_registry
+from pyon.core.object import IonObjectDeserializer, ion_serializer
+from pyon.ion.granule.granule import build_granule
+from pyon.ion.granule.record_dictionary import RecordDictionaryTool
+from pyon.ion.granule.taxonomy import TaxyTool
+from pyon.public import log
+from ion.services.dm.utility.dataset_store import DatasetStore
+from collections import deque
+from gevent.pool import Pool
+import numpy as np
+import ctypes
+import ctypes.util
+import mmap
+import os
+import time
 import msgpack
 
 
+#--------------------------------------------------------------------------------
+# gevent 0.13 has no threadpool to read files in, instead the kernel is asked to read the prefetched files into the page
+# cache in the background while the publisher decodes the earlier ones
+#--------------------------------------------------------------------------------
+POSIX_FADV_WILLNEED = 3
+try:
+    _posix_fadvise = ctypes.CDLL(ctypes.util.find_library('c')).posix_fadvise
+    _posix_fadvise.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_int]
+except (OSError, AttributeError):
+    _posix_fadvise = None
+
+def will_need(fd):
+    if _posix_fadvise is not None:
+        _posix_fadvise(fd, 0, 0, POSIX_FADV_WILLNEED)
+
+
 class ReplayProcessException(IonException):
     """
     Exception class for IngestionManagementService exceptions. This class inherits from IonException
@@ -29,6 +60,10 @@ class ReplayProcess(BaseReplayProcess):
 
     def __init__(self, *args, **kwargs):
         super(ReplayProcess,self).__init__(*args,**kwargs)
+        self.page_size = 0
+        self.prefetch  = 0
+        self.coalesce  = 0
+        self.stores    = {} # stream id -> DatasetStore, the index of each store is read once per replay
 
     def on_start(self):
         super(ReplayProcess,self).on_start()
@@ -38,6 +73,10 @@ class ReplayProcess(BaseReplayProcess):
         self.delivery_format = self.CFG.get_safe('process.delivery_format',{})
         self.start_time      = self.CFG.get_safe('process.delivery_format.start_time', None)
         self.end_time        = self.CFG.get_safe('process.delivery_format.end_time', None)
+        # Pipelining: rows per view query, cache files read ahead of the publisher and records per coalesced granule
+        self.page_size       = self.CFG.get_safe('process.delivery_format.page_size', 0)
+        self.prefetch        = self.CFG.get_safe('process.delivery_format.prefetch', 0)
+        self.coalesce        = self.CFG.get_safe('process.delivery_format.coalesce', 0)
 
         if self.dataset_id is None:
             raise BadRequest('dataset_id not specified')
@@ -62,33 +101,185 @@ class ReplayProcess(BaseReplayProcess):
             opts['end_key'][1] = self.end_time
 
         #--------------------------------------------------------------------------------
-        # Gather all the dataset granules and compile the FS cache
+        # Walk the dataset granules, reading the FS cache ahead of the publisher
         #--------------------------------------------------------------------------------
 
-        for result in datastore.query_view(view_name,opts=opts):
-            doc = result.get('doc')
-            if doc is not None:
-                sha1 = doc.get('persisted_sha1')
-                encoding = doc.get('encoding_type')
+        started = time.time()
+        granule_count = 0
+        byte_count = 0
+        pending = [] # decoded granules waiting to be coalesced
+        pending_records = 0
+
+        reads = self._read_ahead(self._query_docs(datastore, view_name, opts))
+        try:
+            for doc, byte_string in reads:
+                granule_count += 1
+                byte_count += len(byte_string)
                 # Warning: redundant serialization
-                byte_string = self.read_persisted_cache(sha1,encoding)
-                obj = msgpack.unpackb(byte_string, object_hook=decode_ion)
-                self.output.publish(obj)
+                try:
+                    obj = msgpack.unpackb(byte_string, object_hook=decode_ion)
+                finally:
+                    self._close(byte_string)
+
+                if not self.coalesce:
+                    self.output.publish(obj)
+                    continue
+
+                granule = self._deserialize(obj)
+                if pending and not self._can_coalesce(pending[0], granule):
+                    self.output.publish(self._serialize(self._coalesce(pending)))
+                    pending, pending_records = [], 0
+                pending.append(granule)
+                pending_records += self._record_count(RecordDictionaryTool.load_from_granule(granule))
+                if pending_records >= self.coalesce:
+                    self.output.publish(self._serialize(self._coalesce(pending)))
+                    pending, pending_records = [], 0
+        finally:
+            reads.close()
+
+        if pending:
+            self.output.publish(self._serialize(self._coalesce(pending)))
 
         # Need to terminate the stream, null granule = {}
-        self.output.publish({}) 
+        self.output.publish({})
+
+        self._report_throughput(granule_count, byte_count, time.time() - started)
         return True
 
+    def _query_docs(self, datastore, view_name, opts):
+        '''
+        Yields the manifest documents, page_size rows are queried at a time when it is set
+        '''
+        if not self.page_size:
+            for result in datastore.query_view(view_name,opts=opts):
+                if result.get('doc') is not None:
+                    yield result.get('doc')
+            return
+
+        # One row more than a page is queried, the next page starts at that row's key and document id
+        page_opts = dict(opts)
+        page_opts['limit'] = self.page_size + 1
+        while True:
+            results = datastore.query_view(view_name,opts=page_opts)
+            for result in results[:self.page_size]:
+                if result.get('doc') is not None:
+                    yield result.get('doc')
+            if len(results) <= self.page_size:
+                return
+            page_opts['start_key'] = results[self.page_size]['key']
+            page_opts['startkey_docid'] = results[self.page_size]['id']
+
+    def _read_ahead(self, docs):
+        '''
+        Yields (doc, byte_string) in order while up to prefetch cache files are read ahead, the files read ahead but
+        not yielded are closed when the generator is closed
+        '''
+        if not self.prefetch:
+            for doc in docs:
+                yield doc, self.read_persisted_cache(doc.get('persisted_sha1'), doc.get('encoding_type'), doc.get('stream_id'))
+            return
+
+        pool = Pool(self.prefetch)
+        reads = deque()
+        try:
+            for doc in docs:
+                reads.append((doc, pool.spawn(self.read_persisted_cache, doc.get('persisted_sha1'), doc.get('encoding_type'), doc.get('stream_id'), True)))
+                if len(reads) > self.prefetch:
+                    doc, read = reads.popleft()
+                    yield doc, read.get()
+            while reads:
+                doc, read = reads.popleft()
+                yield doc, read.get()
+        finally:
+            pool.kill()
+            for doc, read in reads:
+                self._close(read.value)
+
+    def _close(self, byte_string):
+        if isinstance(byte_string, mmap.mmap):
+            byte_string.close()
 
-    def read_persisted_cache(self, sha1, encoding):
+    def _deserialize(self, simple_dict):
+        return IonObjectDeserializer(obj_registry=get_obj_registry()).deserialize(simple_dict)
+
+    def _serialize(self, granule):
+        # Coalesced granules are published in the same form as the decoded ones
+        return ion_serializer.serialize(granule)
+
+    def _record_count(self, rdt):
+        for name, value in rdt.iteritems():
+            if isinstance(value, RecordDictionaryTool):
+                return self._record_count(value)
+            return len(value)
+        return 0
+
+    def _signature(self, rdt):
+        return sorted((name, self._signature(value) if isinstance(value, RecordDictionaryTool) else None) for name, value in rdt.iteritems())
+
+    def _can_coalesce(self, granule1, granule2):
+        '''
+        Granules are only coalesced when they come from the same producer and hold the same variables
+        '''
+        if granule1.data_producer_id != granule2.data_producer_id:
+            return False
+        rdt1 = RecordDictionaryTool.load_from_granule(granule1)
+        rdt2 = RecordDictionaryTool.load_from_granule(granule2)
+        return self._signature(rdt1) == self._signature(rdt2)
+
+    def _coalesce(self, granules):
+        '''
+        Concatenates the record dictionaries of consecutive granules into one granule
+        '''
+        if len(granules) == 1:
+            return granules[0]
+        tx = TaxyTool.load_from_granule(granules[0])
+        rdts = [RecordDictionaryTool.load_from_granule(granule) for granule in granules]
+        return build_granule(data_producer_id=granules[0].data_producer_id, taxonomy=tx, record_dictionary=self._concatenate(rdts, tx))
+
+    def _concatenate(self, rdts, tx):
+        retval = RecordDictionaryTool(taxonomy=tx)
+        for name, value in rdts[0].iteritems():
+            if isinstance(value, RecordDictionaryTool):
+                retval[name] = self._concatenate([rdt[name] for rdt in rdts], tx)
+            else:
+                retval[name] = np.concatenate([rdt[name] for rdt in rdts])
+        return retval
+
+    def _report_throughput(self, granule_count, byte_count, elapsed):
+        elapsed = max(elapsed, 1e-6)
+        self.throughput = {
+            'granules'     : granule_count,
+            'bytes'        : byte_count,
+            'seconds'      : elapsed,
+            'granules_per_second' : granule_count / elapsed,
+            'bytes_per_second'    : byte_count / elapsed
+        }
+        log.info('Replay of %s: %d granules, %d bytes in %.3fs (%.1f granules/s, %.1f bytes/s)',
+            self.dataset_id, granule_count, byte_count, elapsed, self.throughput['granules_per_second'], self.throughput['bytes_per_second'])
+
+
+    def _get_store(self, stream_id):
+        if stream_id not in self.stores:
+            self.stores[stream_id] = DatasetStore(stream_id)
+        return self.stores[stream_id]
+
+    def read_persisted_cache(self, sha1, encoding, stream_id=None, read_ahead=False):
         byte_string = None
         path = FileSystem.get_hierarchical_url(FS.CACHE,sha1,'.%s' % encoding)
+        if stream_id and not os.path.exists(path):
+            # Granules ingested with the dataset storage backend
+            store = self._get_store(stream_id)
+            if store.has(sha1):
+                return store.read_bytes(sha1)
         try:
-            with open(path, 'r') as f:
-                byte_string = f.read()
+            with open(path, 'rb') as f:
+                # Map the file rather than reading it, msgpack decodes straight from the mapped pages
+                if os.fstat(f.fileno()).st_size:
+                    if read_ahead:
+                        will_need(f.fileno())
+                    byte_string = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    byte_string = ''
         except IOError as e:
             raise BadRequest(e.message)
         return byte_string
-
-
-
@@ -9,8 +9,9 @@ from pyon.core.interceptor.encode import encode_ion
 from pyon.util.unit_test import PyonTestCase
 from pyon.util.containers import DotDict
 from ion.processes.data.replay.replay_process_a import ReplayProcess
-from mock import Mock
+from mock import Mock, patch
 from nose.plugins.attrib import attr
+import mmap
 import msgpack
 
 @attr('UNIT',group='dm')
@@ -63,4 +64,199 @@ class ReplayProcessUnitTest(PyonTestCase):
         self.assertTrue(self.received_packet)
         self.assertTrue(self.end_stream)
 
+    def test_execute_replay_pipelined(self):
+        docs = [{'key':['dataset', i], 'id':str(i), 'doc':{'persisted_sha1':str(i), 'encoding_type':'test'}} for i in xrange(5)]
+        def query_view(view_name, opts):
+            self.assertNotIn('skip', opts)
+            start = (opts['start_key'], opts.get('startkey_docid', ''))
+            return [doc for doc in docs if (doc['key'], doc['id']) >= start][:opts['limit']]
+        datastore = DotDict()
+        container = DotDict()
+        datastore.query_view = Mock()
+        datastore.query_view.side_effect = query_view
+        container.datastore_manager.get_datastore = Mock()
+        container.datastore_manager.get_datastore.return_value = datastore
+        self.replay.container = container
+        self.replay.page_size = 2
+        self.replay.prefetch = 2
+
+        self.replay.read_persisted_cache = Mock()
+        self.replay.read_persisted_cache.side_effect = lambda sha1, encoding, stream_id, read_ahead: msgpack.packb({'test':sha1},default=encode_ion)
+
+        self.assertTrue(self.replay.execute_replay())
+
+        published = [call[0][0] for call in self.replay.output.publish.call_args_list]
+        self.assertEquals(published, [{'test':str(i)} for i in xrange(5)] + [{}])
+        self.assertEquals(datastore.query_view.call_count, 3)
+        self.assertEquals(self.replay.throughput['granules'], 5)
+
+    @patch('ion.processes.data.replay.replay_process_a.RecordDictionaryTool')
+    def test_execute_replay_coalesce(self, rdt):
+        docs = [{'doc':{'persisted_sha1':str(i), 'encoding_type':'test'}} for i in xrange(5)]
+        datastore = DotDict()
+        container = DotDict()
+        datastore.query_view = Mock()
+        datastore.query_view.return_value = docs
+        container.datastore_manager.get_datastore = Mock()
+        container.datastore_manager.get_datastore.return_value = datastore
+        self.replay.container = container
+        self.replay.coalesce = 4
+
+        self.replay.read_persisted_cache = Mock()
+        self.replay.read_persisted_cache.side_effect = lambda sha1, encoding, stream_id: msgpack.packb({'test':sha1},default=encode_ion)
+        # Granules of two records, the fourth comes from another producer
+        self.replay._deserialize = Mock()
+        self.replay._deserialize.side_effect = lambda simple_dict: simple_dict['test']
+        self.replay._can_coalesce = Mock()
+        self.replay._can_coalesce.side_effect = lambda granule1, granule2: granule2 != '3'
+        self.replay._record_count = Mock()
+        self.replay._record_count.return_value = 2
+        self.replay._coalesce = Mock()
+        self.replay._coalesce.side_effect = lambda granules: ''.join(granules)
+        self.replay._serialize = Mock()
+        self.replay._serialize.side_effect = lambda granule: {'test':granule}
+
+        self.assertTrue(self.replay.execute_replay())
+
+        published = [call[0][0] for call in self.replay.output.publish.call_args_list]
+        self.assertEquals(published, [{'test':'01'}, {'test':'2'}, {'test':'34'}, {}])
+
+    def test_read_ahead_closes_files(self):
+        self.replay.prefetch = 2
+        files = []
+        def read_persisted_cache(sha1, encoding, stream_id, read_ahead=False):
+            files.append(Mock(spec=mmap.mmap))
+            return files[-1]
+        self.replay.read_persisted_cache = Mock()
+        self.replay.read_persisted_cache.side_effect = read_persisted_cache
+
+        reads = self.replay._read_ahead({'persisted_sha1':str(i)} for i in xrange(5))
+        doc, byte_string = reads.next()
+        reads.close()
+
+        # The files read ahead but never yielded are closed with the generator
+        self.assertTrue(len(files) > 1)
+        self.assertFalse(files[0].close.called)
+        self.assertTrue(all(f.close.called for f in files[1:]))
+
+
+@attr('UNIT',group='dm')
+class ReplayStreamUnitTest(PyonTestCase):
+    def setUp(self):
+        from ion.processes.data.replay.replay_process import ReplayProcess as StreamingReplayProcess
+        self.replay = StreamingReplayProcess()
+        self.replay.delivery_format = {}
+        self.replay.CFG = DotDict()
+
+    def test_query_pages(self):
+        # Several rows share a key, they are ordered by document id
+        rows = [{'key':['dataset', i // 3], 'id':str(i)} for i in xrange(7)]
+        def query_view(view_name, opts):
+            self.assertNotIn('skip', opts)
+            start = (opts.get('start_key', ['dataset', 0]), opts.get('startkey_docid', ''))
+            return [row for row in rows if (row['key'], row['id']) >= start][:opts['limit']]
+        datastore = DotDict()
+        datastore.query_view = Mock()
+        datastore.query_view.side_effect = query_view
+        container = DotDict()
+        container.datastore_manager.get_datastore = Mock()
+        container.datastore_manager.get_datastore.return_value = datastore
+        self.replay.container = container
+
+        pages = list(self.replay._query_pages('datasets', 'datasets/dataset_by_id', {'include_docs':True}, page_size=3))
+
+        self.assertEquals([[row['id'] for row in page] for page in pages], [['0','1','2'],['3','4','5'],['6']])
+        self.assertEquals(datastore.query_view.call_count, 3)
+
+    def test_record_window(self):
+        self.assertEquals(self.replay._record_window(), (0, None))
+        self.replay.delivery_format['time'] = (3,10)
+        self.assertEquals(self.replay._record_window(), (2, 10))
+
+    def test_trim_pending(self):
+        pending = [{'records':4}, {'records':4}, {'records':4}]
+        start, pending_count = self.replay._trim_pending(pending, 9, 12)
+        self.assertEquals(len(pending), 1)
+        self.assertEquals(start, 1)
+        self.assertEquals(pending_count, 4)
+
+    def test_publish_stream(self):
+        self.replay.delivery_format['records'] = 5
+        self.replay.page_size = 2
+        pages_read = []
+        def query_pages(datastore_name, view_name, opts, page_size):
+            for page in [[0,1],[2,3]]:
+                pages_read.append(page)
+                yield page
+        self.replay._query_pages = Mock()
+        self.replay._query_pages.side_effect = query_pages
+        self.replay._parse_results = Mock()
+        self.replay._parse_results.side_effect = lambda results: [{'records':4, 'time_bounds':(i,i)} for i in results]
+
+        published = []
+        published_pages = []
+        def publish_pending(pending, start, stop, chunk_size, drain=False):
+            published_pages.append(len(pages_read))
+            step = chunk_size
+            while stop - start >= step:
+                published.append((start,start+step))
+                start += step
+            if drain and start < stop:
+                published.append((start,stop))
+                start = stop
+            return start
+        self.replay._publish_pending = Mock()
+        self.replay._publish_pending.side_effect = publish_pending
+
+        self.replay._publish_stream('datasets', 'datasets/dataset_by_id', {})
+
+        # 16 records published in chunks of five, the first before the second page was read
+        self.assertEquals(len(published), 4)
+        self.assertEquals(sum(stop-start for start,stop in published), 16)
+        self.assertEquals(published_pages[0], 1)
+
+    def test_publish_stream_duplicates(self):
+        self.replay.page_size = 2
+        self.replay._query_pages = Mock()
+        self.replay._query_pages.return_value = [[0,1],[1,2]]
+        self.replay._parse_results = Mock()
+        self.replay._parse_results.side_effect = lambda results: [{'records':4, 'time_bounds':(i,i)} for i in results]
+        self.replay._publish_pending = Mock()
+        self.replay._publish_pending.side_effect = lambda pending, start, stop, chunk_size, drain=False: stop
+
+        self.replay._publish_stream('datasets', 'datasets/dataset_by_id', {})
+
+        # The granule with a first time value which was already read is not counted
+        stops = [call[0][2] for call in self.replay._publish_pending.call_args_list]
+        self.assertEquals(stops, [8, 4])
+
+
+    def test_select_record_window(self):
+        # Granules in view order, the third starts at the same time as the first and is not merged
+        publish_queue = [{'sha1':'b', 'records':4, 'time_bounds':(5,8)}, {'sha1':'a', 'records':4, 'time_bounds':(1,4)},
+                         {'sha1':'c', 'records':4, 'time_bounds':(5,6)}, {'sha1':'d', 'records':4, 'time_bounds':(9,12)}]
+        self.assertEquals([msg['sha1'] for msg in self.replay._merge_order(publish_queue)], ['a','b','d'])
+
+        self.replay.delivery_format['time'] = (6,10)
+        selected, window = self.replay._select_from_manifest(publish_queue)
+        self.assertEquals([msg['sha1'] for msg in selected], ['b','d'])
+        self.assertEquals(window, slice(1,6))
+
+    def test_publish_stream_time_range(self):
+        self.replay.delivery_format['time_range'] = (5,8)
+        self.replay.page_size = 2
+        self.replay._query_pages = Mock()
+        self.replay._query_pages.return_value = [[(1,4),(5,6)],[(7,9),(10,12)]]
+        self.replay._parse_results = Mock()
+        self.replay._parse_results.side_effect = lambda results: [{'records':4, 'time_bounds':i} for i in results]
+        pending_bounds = []
+        def publish_pending(pending, start, stop, chunk_size, drain=False):
+            pending_bounds.extend([msg['time_bounds'] for msg in pending])
+            return stop
+        self.replay._publish_pending = Mock()
+        self.replay._publish_pending.side_effect = publish_pending
+
+        self.replay._publish_stream('datasets', 'datasets/dataset_by_id', {})
 
+        # Only the granules overlapping the time range are merged
+        self.assertEquals(pending_bounds, [(5,6),(7,9)])
@@ -12,7 +12,7 @@ from pyon.public import IonObject, RT, log
 from prototype.sci_data.stream_defs import L1_conductivity_stream_definition, L0_conductivity_stream_definition
 
 from prototype.sci_data.stream_parser import PointSupplementStreamParser
-from prototype.sci_data.constructor_apis import PointSupplementConstructor
+from ion.services.dm.utility.point_supplement import point_granule
 
 
 class CTDL1ConductivityTransform(TransformFunction):
@@ -53,16 +53,11 @@ class CTDL1ConductivityTransform(TransformFunction):
         #    1) Standard conversion from 5-character hex string to decimal
         #    2)Scaling
         # Use the constructor to put data into a granule
-        psc = PointSupplementConstructor(point_definition=self.outgoing_stream_def, stream_id=self.streams['output'])
         ### Assumes the config argument for output streams is known and there is only one 'output'.
         ### the stream id is part of the metadata which much go in each stream granule - this is awkward to do at the
         ### application level like this!
 
-        for i in xrange(len(conductivity)):
-            scaled_conductivity =  ( conductivity[i] / 100000.0 ) - 0.5
-            point_id = psc.add_point(time=time[i],location=(longitude[i],latitude[i],height[i]))
-            psc.add_scalar_point_coverage(point_id=point_id, coverage_id='conductivity', value=scaled_conductivity)
-
-        return psc.close_stream_granule()
+        scaled_conductivity = ( conductivity / 100000.0 ) - 0.5
+        return point_granule(self.outgoing_stream_def, self.streams['output'], time, longitude, latitude, height, {'conductivity':scaled_conductivity})
 
   
\ No newline at end of file
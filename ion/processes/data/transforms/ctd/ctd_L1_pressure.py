@@ -13,7 +13,7 @@ from pyon.public import IonObject, RT, log
 from prototype.sci_data.stream_defs import L1_pressure_stream_definition, L0_pressure_stream_definition
 
 from prototype.sci_data.stream_parser import PointSupplementStreamParser
-from prototype.sci_data.constructor_apis import PointSupplementConstructor
+from ion.services.dm.utility.point_supplement import point_granule
 
 class CTDL1PressureTransform(TransformFunction):
     ''' A basic transform that receives input through a subscription,
@@ -59,17 +59,12 @@ class CTDL1PressureTransform(TransformFunction):
 
 
         # Use the constructor to put data into a granule
-        psc = PointSupplementConstructor(point_definition=self.outgoing_stream_def, stream_id=self.streams['output'])
         ### Assumes the config argument for output streams is known and there is only one 'output'.
         ### the stream id is part of the metadata which much go in each stream granule - this is awkward to do at the
         ### application level like this!
 
-        for i in xrange(len(pressure)):
-            #todo: get pressure range from metadata (if present) and include in calc
-            scaled_pressure = ( pressure[i])
-            point_id = psc.add_point(time=time[i],location=(longitude[i],latitude[i],height[i]))
-            psc.add_scalar_point_coverage(point_id=point_id, coverage_id='pressure', value=scaled_pressure)
-
-        return psc.close_stream_granule()
+        #todo: get pressure range from metadata (if present) and include in calc
+        scaled_pressure = pressure
+        return point_granule(self.outgoing_stream_def, self.streams['output'], time, longitude, latitude, height, {'pressure':scaled_pressure})
 
   
\ No newline at end of file
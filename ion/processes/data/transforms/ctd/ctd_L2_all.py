@@ -0,0 +1,91 @@
+'''
+@file ion/processes/data/transforms/ctd/ctd_L2_all.py
+@description Transforms CTD parsed data into the L1 and L2 products in a single process
+'''
+
+from pyon.ion.transform import TransformDataProcess
+from pyon.public import log
+
+from prototype.sci_data.stream_defs import SBE37_CDM_stream_definition, L1_conductivity_stream_definition, L1_temperature_stream_definition, L1_pressure_stream_definition, L2_practical_salinity_stream_definition, L2_density_stream_definition
+
+from prototype.sci_data.stream_parser import PointSupplementStreamParser
+from ion.services.dm.utility.point_supplement import point_granule
+
+from seawater.gibbs import SP_from_cndr, rho, SA_from_SP
+from seawater.gibbs import cte
+
+
+class ctd_L2_all(TransformDataProcess):
+    """
+    Fused CTD transform: parses the parsed CTD granule once and publishes L1 conductivity, temperature and pressure
+    and L2 salinity and density, saving the intermediate L0 hop and the re-parsing in each of the split transforms.
+
+    Only the products with a configured output stream are computed and published, the split ctd_L0_all, L1 and L2
+    transforms remain for topologies that need the intermediate streams.
+    """
+
+    incoming_stream_def = SBE37_CDM_stream_definition()
+
+    outgoing_stream_defs = {
+        'conductivity' : L1_conductivity_stream_definition(),
+        'temperature' : L1_temperature_stream_definition(),
+        'pressure' : L1_pressure_stream_definition(),
+        'salinity' : L2_practical_salinity_stream_definition(),
+        'density' : L2_density_stream_definition(),
+    }
+
+    def process(self, packet):
+
+        """Processes incoming data!!!!
+        """
+
+        outputs = [name for name in self.outgoing_stream_defs if name in self.streams]
+        if not outputs:
+            log.warn('ctd_L2_all has no configured output streams')
+            return
+
+        # Use the PointSupplementStreamParser to pull data from a granule
+        psd = PointSupplementStreamParser(stream_definition=self.incoming_stream_def, stream_granule=packet)
+
+        conductivity = psd.get_values('conductivity')
+        pressure = psd.get_values('pressure')
+        temperature = psd.get_values('temperature')
+
+        longitude = psd.get_values('longitude')
+        latitude = psd.get_values('latitude')
+        height = psd.get_values('height')
+        time = psd.get_values('time')
+
+        products = self.compute(outputs, conductivity, temperature, pressure, longitude, latitude)
+
+        for name in outputs:
+            getattr(self, name).publish(point_granule(self.outgoing_stream_defs[name], self.streams[name], time, longitude,
+                latitude, height, {name:products[name]}))
+
+    @staticmethod
+    def compute(outputs, conductivity, temperature, pressure, longitude, latitude):
+        '''
+        @brief Computes the requested products with the same algorithms as the split L1 and L2 transforms
+        @param outputs names of the products to compute
+        @return dict of product name to numpy array
+        '''
+        products = {}
+        if 'conductivity' in outputs:
+            # Siemens per meter, SBE 37IM Output Format 0
+            products['conductivity'] = ( conductivity / 100000.0 ) - 0.5
+        if 'temperature' in outputs:
+            # Celsius, SBE 37IM Output Format 0
+            products['temperature'] = ( temperature / 10000.0) - 10
+        if 'pressure' in outputs:
+            #todo: get pressure range from metadata (if present) and include in calc
+            products['pressure'] = pressure
+
+        if 'salinity' in outputs or 'density' in outputs:
+            # Like the split L2 transforms, salinity and density are computed from the parsed values
+            salinity = SP_from_cndr(r=conductivity/cte.C3515, t=temperature, p=pressure)
+            products['salinity'] = salinity
+            if 'density' in outputs:
+                sa = SA_from_SP(salinity, pressure, longitude, latitude)
+                products['density'] = rho(sa, temperature, pressure)
+
+        return products
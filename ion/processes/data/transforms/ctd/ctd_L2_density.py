@@ -14,7 +14,7 @@ from pyon.public import IonObject, RT, log
 from prototype.sci_data.stream_defs import SBE37_CDM_stream_definition, L2_density_stream_definition
 
 from prototype.sci_data.stream_parser import PointSupplementStreamParser
-from prototype.sci_data.constructor_apis import PointSupplementConstructor
+from ion.services.dm.utility.point_supplement import point_granule
 
 from seawater.gibbs import SP_from_cndr, rho, SA_from_SP
 from seawater.gibbs import cte
@@ -67,15 +67,10 @@ class DensityTransform(TransformFunction):
         log.warn('Got density: %s' % str(density))
 
         # Use the constructor to put data into a granule
-        psc = PointSupplementConstructor(point_definition=self.outgoing_stream_def, stream_id=self.streams['output'])
         ### Assumes the config argument for output streams is known and there is only one 'output'.
         ### the stream id is part of the metadata which much go in each stream granule - this is awkward to do at the
         ### application level like this!
 
-        for i in xrange(len(density)):
-            point_id = psc.add_point(time=time[i],location=(longitude[i],latitude[i],height[i]))
-            psc.add_scalar_point_coverage(point_id=point_id, coverage_id='density', value=density[i])
-
-        return psc.close_stream_granule()
+        return point_granule(self.outgoing_stream_def, self.streams['output'], time, longitude, latitude, height, {'density':density})
 
   
\ No newline at end of file
@@ -10,7 +10,7 @@ from pyon.core.exception import BadRequest
 from pyon.public import IonObject, RT, log
 
 from prototype.sci_data.stream_parser import PointSupplementStreamParser
-from prototype.sci_data.constructor_apis import PointSupplementConstructor
+from ion.services.dm.utility.point_supplement import point_granule
 
 from prototype.sci_data.stream_defs import SBE37_CDM_stream_definition, L2_density_stream_definition, L2_practical_salinity_stream_definition
 
@@ -61,12 +61,7 @@ class SalinityTransform(TransformFunction):
 
 
         # Use the constructor to put data into a granule
-        psc = PointSupplementConstructor(point_definition=self.outgoing_stream_def, stream_id=self.streams['output'])
 
-        for i in xrange(len(salinity)):
-            point_id = psc.add_point(time=time[i],location=(longitude[i],latitude[i],height[i]))
-            psc.add_scalar_point_coverage(point_id=point_id, coverage_id='salinity', value=salinity[i])
-
-        return psc.close_stream_granule()
+        return point_granule(self.outgoing_stream_def, self.streams['output'], time, longitude, latitude, height, {'salinity':salinity})
 
 
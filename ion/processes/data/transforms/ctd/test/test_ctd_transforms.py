@@ -5,8 +5,11 @@
 @author Michael Meisinger
 '''
 
-from mock import Mock, sentinel, patch
+from mock import Mock, sentinel, patch, call
 from collections import defaultdict
+import time
+
+import numpy as np
 
 from pyon.public import log
 from pyon.util.containers import DotDict
@@ -22,6 +25,11 @@ from ion.processes.data.transforms.ctd.ctd_L1_pressure import CTDL1PressureTrans
 from ion.processes.data.transforms.ctd.ctd_L1_temperature import CTDL1TemperatureTransform
 from ion.processes.data.transforms.ctd.ctd_L2_salinity import SalinityTransform
 from ion.processes.data.transforms.ctd.ctd_L2_density import DensityTransform
+from ion.processes.data.transforms.ctd.ctd_L2_all import ctd_L2_all
+from ion.services.dm.utility.point_supplement import add_point_coverages, point_granule
+from prototype.sci_data.constructor_apis import PointSupplementConstructor
+from prototype.sci_data.stream_defs import L2_density_stream_definition
+from prototype.sci_data.stream_parser import PointSupplementStreamParser
 
 
 @attr('UNIT', group='ctd')
@@ -56,6 +64,12 @@ class TestScienceObjectCodec(IonUnitTestCase):
         self.tx_L2_D = DensityTransform()
         self.tx_L2_D.streams = defaultdict(Mock)
 
+        self.tx_L2_all = ctd_L2_all()
+        self.tx_L2_all.streams = {}
+        for name in ctd_L2_all.outgoing_stream_defs:
+            self.tx_L2_all.streams[name] = name
+            setattr(self.tx_L2_all, name, Mock())
+
     def test_transforms(self):
 
         length = 1
@@ -88,3 +102,118 @@ class TestScienceObjectCodec(IonUnitTestCase):
 
         L2_dens = self.tx_L2_D.execute(packet)
         log.info("L2 dens: %s" % L2_dens)
+
+    def test_fused_transform(self):
+        packet = self.px_ctd._get_ctd_packet("STR_ID", 5)
+
+        self.tx_L2_all.process(packet)
+
+        self.tx_L0.process(packet)
+        split = {
+            'conductivity' : self.tx_L1_C.execute(self.tx_L0.conductivity.publish.call_args[0][0]),
+            'temperature' : self.tx_L1_T.execute(self.tx_L0.temperature.publish.call_args[0][0]),
+            'pressure' : self.tx_L1_P.execute(self.tx_L0.pressure.publish.call_args[0][0]),
+            'salinity' : self.tx_L2_S.execute(packet),
+            'density' : self.tx_L2_D.execute(packet),
+        }
+
+        for name, granule in split.iteritems():
+            fused = getattr(self.tx_L2_all, name).publish.call_args[0][0]
+            stream_def = ctd_L2_all.outgoing_stream_defs[name]
+            np.testing.assert_array_almost_equal(
+                PointSupplementStreamParser(stream_definition=stream_def, stream_granule=fused).get_values(name),
+                PointSupplementStreamParser(stream_definition=stream_def, stream_granule=granule).get_values(name))
+
+    def test_fused_transform_outputs(self):
+        del self.tx_L2_all.streams['density']
+        del self.tx_L2_all.streams['salinity']
+
+        self.tx_L2_all.process(self.px_ctd._get_ctd_packet("STR_ID", 1))
+
+        self.assertTrue(self.tx_L2_all.conductivity.publish.called)
+        self.assertFalse(self.tx_L2_all.salinity.publish.called)
+        self.assertFalse(self.tx_L2_all.density.publish.called)
+
+    def test_add_point_coverages(self):
+        psc = Mock()
+        psc.add_point.side_effect = [0, 1]
+
+        point_ids = add_point_coverages(psc, np.array([1., 2.]), np.array([10., 11.]), np.array([20., 21.]),
+            np.array([0., 0.]), {'density':np.array([1020., 1021.])})
+
+        self.assertEquals(point_ids, [0, 1])
+        self.assertEquals(psc.add_point.call_args_list, [
+            call(time=1., location=(10., 20., 0.)),
+            call(time=2., location=(11., 21., 0.))])
+        self.assertEquals(psc.add_scalar_point_coverage.call_args_list, [
+            call(point_id=0, coverage_id='density', value=1020.),
+            call(point_id=1, coverage_id='density', value=1021.)])
+
+        with self.assertRaises(ValueError):
+            add_point_coverages(psc, [1., 2.], [0., 0.], [0., 0.], [0., 0.], {'density':[1.]})
+
+
+    def test_point_granule(self):
+        stream_def = L2_density_stream_definition()
+        density = np.array([1020., 1021.5, 1019., 1022., 1020.5])
+        time_vector = np.arange(5, dtype='float64')
+        longitude = np.linspace(-70., -69., 5)
+        latitude = np.linspace(40., 41., 5)
+        height = np.zeros(5)
+
+        bulk = point_granule(stream_def, 'stream_id', time_vector, longitude, latitude, height, {'density':density})
+        psc = PointSupplementConstructor(point_definition=stream_def, stream_id='stream_id')
+        add_point_coverages(psc, time_vector, longitude, latitude, height, {'density':density})
+        loop = psc.close_stream_granule()
+
+        assert_same_points(self, stream_def, bulk, loop)
+
+
+def assert_same_points(test, stream_def, granule1, granule2):
+    '''
+    Asserts that two point granules hold the same values, record count and bounds
+    '''
+    for name in ('time', 'longitude', 'latitude', 'height', 'density'):
+        np.testing.assert_array_equal(
+            PointSupplementStreamParser(stream_definition=stream_def, stream_granule=granule1).get_values(name),
+            PointSupplementStreamParser(stream_definition=stream_def, stream_granule=granule2).get_values(name))
+    test.assertEquals(sorted(granule1.identifiables.keys()), sorted(granule2.identifiables.keys()))
+    for key, value in granule2.identifiables.iteritems():
+        if hasattr(value, 'value_pair'):
+            test.assertEquals(list(granule1.identifiables[key].value_pair), list(value.value_pair))
+        elif hasattr(value, 'value'):
+            test.assertEquals(granule1.identifiables[key].value, value.value)
+
+
+@attr('LOAD', group='ctd')
+class CTDConstructorBenchmark(IonUnitTestCase):
+    def setUp(self):
+        FileSystem(DotDict())
+
+    def test_records_per_second(self):
+        '''
+        Compares the per sample loop the transforms used to build their output with point_granule.
+        '''
+        records = 10000
+        stream_def = L2_density_stream_definition()
+        values = np.random.random_sample(records)
+        time_vector = np.arange(records, dtype='float64')
+        zeros = np.zeros(records)
+
+        start = time.time()
+        psc = PointSupplementConstructor(point_definition=stream_def, stream_id='benchmark')
+        for i in xrange(records):
+            point_id = psc.add_point(time=time_vector[i],location=(zeros[i],zeros[i],zeros[i]))
+            psc.add_scalar_point_coverage(point_id=point_id, coverage_id='density', value=values[i])
+        loop = psc.close_stream_granule()
+        loop_time = time.time() - start
+
+        start = time.time()
+        bulk = point_granule(stream_def, 'benchmark', time_vector, zeros, zeros, zeros, {'density':values})
+        bulk_time = time.time() - start
+
+        log.info('Per sample loop: %.0f records/s', records / loop_time)
+        log.info('point_granule: %.0f records/s', records / bulk_time)
+
+        assert_same_points(self, stream_def, bulk, loop)
+        self.assertLess(bulk_time, loop_time)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+'''
+Container local adjacency index of the associations in the resource registry.
+
+Services walk the association graph one find_objects/find_subjects call at a time, each one a view query in
+the resources datastore. The index loads every association once, answers single and multi hop lookups from
+memory and is refreshed per resource from ResourceModifiedEvents. It is enabled with
+container.association_index.enabled, otherwise indexed_registry hands back the registry client unchanged.
+'''
+
+from collections import defaultdict
+from itertools import count
+import time
+
+from gevent.coros import RLock
+
+from pyon.public import CFG, PRED, Container, log
+from pyon.event.event import EventSubscriber
+
+OUT = 'out' # Follow associations from subject to object
+IN  = 'in'  # Follow associations from object to subject
+
+
+class AssociationIndex(object):
+    '''
+    Adjacency index of (subject, predicate, object) with the subject and object types, keyed both ways.
+    '''
+    def __init__(self, resource_registry, max_age=0):
+        self.RR = resource_registry
+        self.max_age = max_age # Seconds before the index is rebuilt, 0 to rely on events only
+        self.loaded_at = None
+        self._assocs = {}
+        self._by_subject = defaultdict(dict)
+        self._by_object = defaultdict(dict)
+        self._sequence = count()
+        self._lock = RLock()
+        self.subscriber = None
+
+    #--------------------------------------------------------------------------------
+    # Maintenance
+    #--------------------------------------------------------------------------------
+
+    def start(self):
+        self.subscriber = EventSubscriber(event_type="ResourceModifiedEvent", callback=self._resource_modified_callback)
+        self.subscriber.activate()
+
+    def stop(self):
+        if self.subscriber is not None:
+            self.subscriber.deactivate()
+            self.subscriber = None
+
+    def _resource_modified_callback(self, event, *args, **kwargs):
+        self.refresh(event.origin)
+
+    def build(self):
+        '''
+        Loads every association in the registry, one query per predicate
+        '''
+        with self._lock:
+            self._assocs.clear()
+            self._by_subject.clear()
+            self._by_object.clear()
+            for predicate in PRED.values():
+                for assoc in self.RR.find_associations(predicate=predicate, id_only=False):
+                    self._add(assoc)
+            self.loaded_at = time.time()
+            log.debug('Association index loaded %d associations', len(self._assocs))
+
+    def _ensure_loaded(self):
+        if self.loaded_at is None or (self.max_age and time.time() - self.loaded_at > self.max_age):
+            self.build()
+
+    def refresh(self, resource_id):
+        '''
+        Reloads the associations of a resource, a resource which no longer exists is dropped
+        '''
+        with self._lock:
+            if self.loaded_at is None:
+                return
+            self.remove_resource(resource_id)
+            for assoc in self.RR.find_associations(subject=resource_id, id_only=False):
+                self._add(assoc)
+            for assoc in self.RR.find_associations(object=resource_id, id_only=False):
+                self._add(assoc)
+
+    def add_association(self, assoc):
+        with self._lock:
+            if self.loaded_at is not None:
+                self._add(assoc)
+
+    def remove_association(self, assoc_id):
+        with self._lock:
+            assoc = self._assocs.pop(assoc_id, None)
+            if assoc is not None:
+                self._by_subject.get(assoc.s, {}).pop(assoc_id, None)
+                self._by_object.get(assoc.o, {}).pop(assoc_id, None)
+
+    def remove_resource(self, resource_id):
+        with self._lock:
+            for assoc_id in self._by_subject.pop(resource_id, {}).keys() + self._by_object.pop(resource_id, {}).keys():
+                self.remove_association(assoc_id)
+
+    def _add(self, assoc):
+        self._assocs[assoc._id] = assoc
+        # Keyed by association id, the sequence number keeps the lookups in registry order
+        sequence = self._sequence.next()
+        self._by_subject[assoc.s][assoc._id] = sequence
+        self._by_object[assoc.o][assoc._id] = sequence
+
+    #--------------------------------------------------------------------------------
+    # Lookups
+    #--------------------------------------------------------------------------------
+
+    def _edges(self, table, resource_id):
+        edges = table.get(resource_id, {})
+        return [self._assocs[assoc_id] for assoc_id in sorted(edges, key=edges.get)]
+
+    def find_objects(self, subject, predicate=None, object_type=None):
+        '''
+        @return tuple of the object ids and the associations followed
+        '''
+        with self._lock:
+            self._ensure_loaded()
+            assocs = [a for a in self._edges(self._by_subject, subject)
+                      if (not predicate or a.p == predicate) and (not object_type or a.ot == object_type)]
+        return [a.o for a in assocs], assocs
+
+    def find_subjects(self, subject_type, predicate, object):
+        '''
+        @return tuple of the subject ids and the associations followed
+        '''
+        with self._lock:
+            self._ensure_loaded()
+            assocs = [a for a in self._edges(self._by_object, object)
+                      if (not predicate or a.p == predicate) and (not subject_type or a.st == subject_type)]
+        return [a.s for a in assocs], assocs
+
+    def find_path(self, resource_id, steps):
+        '''
+        Multi hop lookup, each step is a tuple (OUT or IN, predicate, resource type of the next hop)
+        @return list of the resource ids reached after the last step
+        '''
+        current = [resource_id]
+        for direction, predicate, resource_type in steps:
+            reached = []
+            for rid in current:
+                if direction == OUT:
+                    ids, _ = self.find_objects(rid, predicate, resource_type)
+                else:
+                    ids, _ = self.find_subjects(resource_type, predicate, rid)
+                reached.extend(i for i in ids if i not in reached)
+            current = reached
+        return current
+
+
+class IndexedResourceRegistry(object):
+    '''
+    Resource registry client answering find_objects and find_subjects from an AssociationIndex. Association
+    writes made through it update the index, every other call goes to the registry client.
+    '''
+    def __init__(self, resource_registry, index):
+        self._rr = resource_registry
+        self.index = index
+
+    def __getattr__(self, name):
+        return getattr(self._rr, name)
+
+    @staticmethod
+    def _id(resource):
+        return resource if isinstance(resource, basestring) else resource._id
+
+    def find_objects(self, subject="", predicate="", object_type="", id_only=False):
+        ids, assocs = self.index.find_objects(self._id(subject), predicate, object_type)
+        if id_only:
+            return ids, assocs
+        return (self._rr.read_mult(ids) if ids else []), assocs
+
+    def find_subjects(self, subject_type="", predicate="", object="", id_only=False):
+        ids, assocs = self.index.find_subjects(subject_type, predicate, self._id(object))
+        if id_only:
+            return ids, assocs
+        return (self._rr.read_mult(ids) if ids else []), assocs
+
+    def create_association(self, subject=None, predicate=None, object=None, assoc_type=None):
+        retval = self._rr.create_association(subject=subject, predicate=predicate, object=object, assoc_type=assoc_type)
+        self.index.refresh(self._id(subject))
+        return retval
+
+    def delete_association(self, association=''):
+        retval = self._rr.delete_association(association=association)
+        self.index.remove_association(self._id(association))
+        return retval
+
+    def delete(self, object_id=''):
+        retval = self._rr.delete(object_id=object_id)
+        self.index.remove_resource(object_id)
+        return retval
+
+
+def indexed_registry(resource_registry):
+    '''
+    @brief Wraps a resource registry client with the association index of the container
+    @return IndexedResourceRegistry, or the client itself when the index is disabled or there is no container
+    '''
+    if not CFG.get_safe('container.association_index.enabled', False):
+        return resource_registry
+    container = Container.instance
+    if container is None:
+        return resource_registry
+
+    index = getattr(container, 'association_index', None)
+    if index is None:
+        index = AssociationIndex(container.resource_registry, max_age=CFG.get_safe('container.association_index.max_age', 0))
+        index.start()
+        container.association_index = index
+        _stop_with_container(container, index)
+    return IndexedResourceRegistry(resource_registry, index)
+
+
+def _stop_with_container(container, index):
+    '''
+    @brief Stops the index, and its event subscriber, before the container stops
+    '''
+    container_stop = container.stop
+    def stop(*args, **kwargs):
+        index.stop()
+        container.association_index = None
+        return container_stop(*args, **kwargs)
+    container.stop = stop
@@ -10,6 +10,7 @@ from pyon.core.exception import  Inconsistent, NotFound, BadRequest
 from pyon.ion.directory import Directory
 from pyon.event.event import EventPublisher
 from pyon.util.containers import is_basic_identifier
+from ion.services.coi.association_index import indexed_registry
 from pyon.util.log import log
 from pyon.core.governance.negotiate_request import NegotiateRequest, NegotiateRequestFactory
 
@@ -738,7 +739,7 @@ class OrgManagementService(BaseOrgManagementService):
         if user is None:
             raise BadRequest("The user parameter is missing")
 
-        role_list,_ = self.clients.resource_registry.find_objects(user, PRED.hasRole, RT.UserRole)
+        role_list,_ = indexed_registry(self.clients.resource_registry).find_objects(user, PRED.hasRole, RT.UserRole)
 
         #Iterate the list of roles associated with user and filter by the org_id. TODO - replace this when
         #better indexing/views are available in couch
@@ -5,6 +5,9 @@
 __author__ = 'Stephen P. Henrie'
 __license__ = 'Apache 2.0'
 
+from collections import defaultdict
+import time
+
 from interface.services.coi.ipolicy_management_service import BasePolicyManagementService
 from pyon.core.exception import NotFound, BadRequest
 from pyon.public import PRED, RT, Container
@@ -16,21 +19,91 @@ MANAGER_ROLE = 'ORG_MANAGER'  # Can only act upon resource within the specific O
 MEMBER_ROLE = 'ORG_MEMBER'    # Can only access resources within the specific Org
 ION_MANAGER = 'ION_MANAGER'   # Can act upon resources across all Orgs - like a Super User access
 
+DEFAULT_POLICY_RULES_CACHE_TTL = 300
+
+
+class PolicyRulesCache(object):
+    """
+    The active policy rules generated for resources and services. Each entry holds the revisions of the policies it
+    was generated from and is only returned while they are current, so a lost event can not serve stale rules. An
+    entry is also evicted when one of the resources or policies it was generated from is modified, and expires after
+    ttl seconds.
+    """
+    def __init__(self, ttl=DEFAULT_POLICY_RULES_CACHE_TTL):
+        self.ttl = ttl
+        self.generation = 0 # incremented by each eviction
+        self._entries = {} # key -> (expires, policy rules, policy revisions, resource and policy ids)
+        self._dependents = defaultdict(set) # resource or policy id -> keys
+
+    def get(self, key, revisions):
+        """
+        @param revisions the current (policy id, revision) of the policies the rules are generated from
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() >= entry[0] or entry[2] != revisions:
+            self._remove(key)
+            return None
+        return entry[1]
+
+    def put(self, key, policy_rules, revisions, dependencies, generation):
+        """
+        @param generation the generation before the resources and policies were read, the rules are not cached
+                          if something was evicted since then
+        """
+        if generation != self.generation:
+            return
+        self._remove(key)
+        self._entries[key] = (time.time() + self.ttl, policy_rules, revisions, dependencies)
+        for dependency in dependencies:
+            self._dependents[dependency].add(key)
+
+    def evict(self, dependency):
+        self.generation += 1
+        for key in self._dependents.pop(dependency, ()):
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for dependency in entry[3]:
+            keys = self._dependents.get(dependency)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._dependents[dependency]
+
 
 class PolicyManagementService(BasePolicyManagementService):
 
+    rules_cache = None
 
     def on_init(self):
         self.event_pub = EventPublisher()
 
+        self.rules_cache = PolicyRulesCache(self.CFG.get_safe('service.policy_management.rules_cache_ttl', DEFAULT_POLICY_RULES_CACHE_TTL))
+
         self.policy_event_subscriber = EventSubscriber(event_type="ResourceModifiedEvent", origin_type="Policy", callback=self.policy_event_callback)
         self.policy_event_subscriber.activate()
 
+        #Policy associations may be changed by other instances of this service
+        self.resource_policy_event_subscriber = EventSubscriber(event_type="ResourcePolicyEvent", callback=self.resource_policy_event_callback)
+        self.resource_policy_event_subscriber.activate()
+
     def on_quit(self):
 
         if self.policy_event_subscriber is not None:
             self.policy_event_subscriber.deactivate()
 
+        if self.resource_policy_event_subscriber is not None:
+            self.resource_policy_event_subscriber.deactivate()
+
+    def _evict_policy_rules(self, resource_or_policy_id):
+        if self.rules_cache is not None:
+            self.rules_cache.evict(resource_or_policy_id)
+
 
     """
     Provides the interface to define and manage policy and a repository to store and retrieve policy and templates for
@@ -66,6 +139,7 @@ class PolicyManagementService(BasePolicyManagementService):
             raise BadRequest("The policy name '%s' can only contain alphanumeric and underscore characters" % policy.name)
 
         self.clients.resource_registry.update(policy)
+        self._evict_policy_rules(policy._id)
 
     def read_policy(self, policy_id=''):
         """Returns the Policy object for the specified policy id.
@@ -98,6 +172,7 @@ class PolicyManagementService(BasePolicyManagementService):
         if not policy:
             raise NotFound("Policy %s does not exist" % policy_id)
         self.clients.resource_registry.delete(policy_id)
+        self._evict_policy_rules(policy_id)
 
 
     def enable_policy(self, policy_id=''):
@@ -130,6 +205,8 @@ class PolicyManagementService(BasePolicyManagementService):
         policy_id = policy_event.origin
         log.debug("Policy modified: %s" % policy_id)
 
+        self._evict_policy_rules(policy_id)
+
         try:
             policy = self.clients.resource_registry.read(policy_id)
             if policy:
@@ -144,6 +221,14 @@ class PolicyManagementService(BasePolicyManagementService):
                 log.error(e)
 
 
+    def resource_policy_event_callback(self, *args, **kwargs):
+        """
+        This method is a callback function for receiving Resource Policy Events.
+        """
+        resource_policy_event = args[0]
+        self._evict_policy_rules(resource_policy_event.resource_id)
+
+
     def add_resource_policy(self, resource_id='', policy_id=''):
         """Associates a policy rule to a specific resource
 
@@ -171,6 +256,8 @@ class PolicyManagementService(BasePolicyManagementService):
         if not aid:
             return False
 
+        self._evict_policy_rules(resource_id)
+
         #Publish an event that the resource policy has changed
         self._publish_resource_policy_event(policy, resource)
 
@@ -204,6 +291,7 @@ class PolicyManagementService(BasePolicyManagementService):
             raise NotFound("The association between the specified Resource %s and Policy %s was not found" % (resource_id, policy_id))
 
         self.clients.resource_registry.delete_association(aid)
+        self._evict_policy_rules(resource_id)
 
         #Publish an event that the resource policy has changed
         self._publish_resource_policy_event(policy, resource)
@@ -242,6 +330,20 @@ class PolicyManagementService(BasePolicyManagementService):
 
         return policy_list
 
+    def _find_policies(self, resource_id):
+        """Finds the policies associated with a resource, without reading the resource
+
+        @param resource_id    str
+        @retval policy_list    list
+        """
+        policy_list,_ = self.clients.resource_registry.find_objects(resource_id, PRED.hasPolicy, RT.Policy)
+
+        return policy_list
+
+    @staticmethod
+    def _policy_revisions(policy_set):
+        return tuple((p._id, p._rev) for p in policy_set)
+
     def _find_resources_for_policy(self, policy_id=''):
         """Finds all resources associated with a specific policy
 
@@ -295,22 +397,31 @@ class PolicyManagementService(BasePolicyManagementService):
         if not resource_id:
             raise BadRequest("The resource_id parameter is missing")
 
+        generation = self.rules_cache.generation if self.rules_cache is not None else None
         resource = self.clients.resource_registry.read(resource_id)
         if not resource:
             raise NotFound("Resource %s does not exist" % resource_id)
 
+        policy_set = self._find_policies(resource_id)
+
+        cache_key = ('resource', resource_id)
+        revisions = self._policy_revisions(policy_set)
+        policy_rules = self.rules_cache.get(cache_key, revisions) if self.rules_cache is not None else None
+        if policy_rules is not None:
+            return policy_rules
+
         policy = self._get_policy_template()
 
-        #TODO - investigate better ways to optimize this
         rules = ""
-        policy_set = self.find_resource_policies(resource_id)
-
         for p in policy_set:
             if p.enabled:
                 rules += p.rule
 
         policy_rules = policy % ('', resource_id, rules)
 
+        if self.rules_cache is not None:
+            self.rules_cache.put(cache_key, policy_rules, revisions, [resource_id] + [p._id for p in policy_set], generation)
+
         return policy_rules
 
     def add_service_policy(self, service_name='', policy_id=''):
@@ -369,6 +480,7 @@ class PolicyManagementService(BasePolicyManagementService):
         if not org_id:
             raise BadRequest("The org_id parameter is missing")
 
+        generation = self.rules_cache.generation if self.rules_cache is not None else None
         org = self.clients.resource_registry.read(org_id)
         if not org:
             raise NotFound("Org %s does not exist" % org_id)
@@ -376,26 +488,36 @@ class PolicyManagementService(BasePolicyManagementService):
         if not service_name:
             raise BadRequest("The name parameter is missing")
 
-        policy = self._get_policy_template()
+        service_resource = self._find_service_resource_by_name(service_name)
+        org_policy_set = self._find_policies(org_id)
+        service_policy_set = self._find_policies(service_resource._id)
 
-        #TODO - investigate better ways to optimize this
+        cache_key = ('service', org_id, service_name)
+        revisions = self._policy_revisions(org_policy_set + service_policy_set)
+        policy_rules = self.rules_cache.get(cache_key, revisions) if self.rules_cache is not None else None
+        if policy_rules is not None:
+            return policy_rules
+
+        policy = self._get_policy_template()
 
         rules = ""
         #First get any global Org rules
-        policy_set = self.find_resource_policies(org_id)
-        for p in policy_set:
+        for p in org_policy_set:
             if p.enabled:
                 rules += p.rule
 
         #Next get service specific rules
-        policy_set = self.find_service_policies(service_name)
-        for p in policy_set:
+        for p in service_policy_set:
             if p.enabled:
                 rules += p.rule
 
 
         policy_rules = policy % (org.name, service_name, rules)
 
+        if self.rules_cache is not None:
+            dependencies = [org_id, service_resource._id] + [p._id for p in org_policy_set + service_policy_set]
+            self.rules_cache.put(cache_key, policy_rules, revisions, dependencies, generation)
+
         return policy_rules
 
 
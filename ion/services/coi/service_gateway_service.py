@@ -3,12 +3,14 @@
 __author__ = 'Stephen P. Henrie'
 __license__ = 'Apache 2.0'
 
-import inspect, collections, ast, simplejson, json, sys, time, traceback
+import inspect, collections, ast, simplejson, json, sys, time, traceback, zlib, itertools
 from flask import Flask, request, abort
-from gevent.wsgi import WSGIServer
+import gevent
+from gevent.pywsgi import WSGIServer
+from gevent.pool import Pool
 
 from pyon.public import IonObject, Container, ProcessRPCClient
-from pyon.core.exception import NotFound, Inconsistent, BadRequest, Unauthorized
+from pyon.core.exception import NotFound, Inconsistent, BadRequest, Unauthorized, Timeout
 from pyon.core.registry import get_message_class_in_parm_type, getextends, is_ion_object_dict
 from pyon.event.event import EventSubscriber
 from interface.services.coi.iservice_gateway_service import BaseServiceGatewayService
@@ -17,8 +19,8 @@ from interface.services.coi.iidentity_management_service import IdentityManageme
 from interface.services.coi.iorg_management_service import OrgManagementServiceProcessClient
 from interface.services.ans.ivisualization_service import VisualizationServiceProcessClient
 from pyon.util.log import log
-from pyon.util.lru_cache import LRUCache
 from pyon.util.containers import current_time_millis
+from ion.services.coi.user_role_cache import UserRoleCache, DEFAULT_TTL, DEFAULT_NEGATIVE_TTL
 
 from pyon.agent.agent import ResourceAgentClient
 from interface.services.iresource_agent import ResourceAgentProcessClient
@@ -32,6 +34,9 @@ service_gateway_instance = None
 DEFAULT_WEB_SERVER_HOSTNAME = ""
 DEFAULT_WEB_SERVER_PORT = 5000
 DEFAULT_USER_CACHE_SIZE = 2000
+DEFAULT_BATCH_MAX_REQUESTS = 50
+DEFAULT_BATCH_CONCURRENCY = 10
+DEFAULT_BATCH_TIMEOUT = 30
 
 GATEWAY_RESPONSE = 'GatewayResponse'
 GATEWAY_ERROR = 'GatewayError'
@@ -46,6 +51,20 @@ DEFAULT_EXPIRY = '0'
 RETURN_FORMAT_PARAM = 'return_format'
 RETURN_FORMAT_RAW_JSON = 'raw_json'
 
+#Query string parameter to indent the JSON responses, i.e. ?pretty=true
+PRETTY_PARAM = 'pretty'
+
+#JSON responses are streamed in chunks of about this many bytes
+STREAM_CHUNK_SIZE = 65536
+
+#Nesting depth of the lists and dicts that are streamed element by element, enough for the response envelope
+#and the (resources, associations) tuples of the find operations
+STREAM_DEPTH = 4
+
+#Content encodings for the Accept-Encoding negotiation, in order of preference
+COMPRESSION_ENCODINGS = ['gzip', 'deflate']
+COMPRESSION_LEVEL = 6
+
 
 #This class is used to manage the WSGI/Flask server as an ION process - and as a process endpoint for ION RPC calls
 class ServiceGatewayService(BaseServiceGatewayService):
@@ -62,6 +81,9 @@ class ServiceGatewayService(BaseServiceGatewayService):
         global service_gateway_instance
         service_gateway_instance = self
 
+        #The cached operations hold clients of the previous instance
+        clear_gateway_operations()
+
         self.server_hostname = self.CFG.get_safe('container.service_gateway.web_server.hostname', DEFAULT_WEB_SERVER_HOSTNAME)
         self.server_port = self.CFG.get_safe('container.service_gateway.web_server.port', DEFAULT_WEB_SERVER_PORT)
         self.web_server_enabled = self.CFG.get_safe('container.service_gateway.web_server.enabled', True)
@@ -76,6 +98,19 @@ class ServiceGatewayService(BaseServiceGatewayService):
         #Get the user_cache_size
         self.user_cache_size = self.CFG.get_safe('container.service_gateway.user_cache_size', DEFAULT_USER_CACHE_SIZE)
 
+        #Cache the identity check and the roles of the requesting users for performance reasons
+        #user_cache_ttl = seconds to keep the roles of a user
+        #user_cache_negative_ttl = seconds to keep an unknown user or a user without roles
+        self.user_role_cache = UserRoleCache(find_user_roles, self.user_cache_size,
+            ttl=self.CFG.get_safe('container.service_gateway.user_cache_ttl', DEFAULT_TTL),
+            negative_ttl=self.CFG.get_safe('container.service_gateway.user_cache_negative_ttl', DEFAULT_NEGATIVE_TTL))
+
+        #Limits for the batch requests; the pool is shared by all batches so at most batch.concurrency service
+        #requests from batches are outstanding at any time, each one waits at most batch.timeout seconds.
+        self.batch_max_requests = self.CFG.get_safe('container.service_gateway.batch.max_requests', DEFAULT_BATCH_MAX_REQUESTS)
+        self.batch_timeout = self.CFG.get_safe('container.service_gateway.batch.timeout', DEFAULT_BATCH_TIMEOUT)
+        self.batch_pool = Pool(self.CFG.get_safe('container.service_gateway.batch.concurrency', DEFAULT_BATCH_CONCURRENCY))
+
 
         #Start the gevent web server unless disabled
         if self.web_server_enabled:
@@ -86,17 +121,14 @@ class ServiceGatewayService(BaseServiceGatewayService):
             callback=self.user_role_event_callback)
         self.user_role_event_subscriber.activate()
 
-        #Initialize an LRU Cache to keep user roles cached for performance reasons
-        #maxSize = maximum number of elements to keep in cache
-        #maxAgeMs = oldest entry to keep
-        self.user_data_cache = LRUCache(self.user_cache_size,0,0)
-
     def on_quit(self):
         self.stop_service()
 
         if self.user_role_event_subscriber is not None:
             self.user_role_event_subscriber.deactivate()
 
+        self.user_role_cache.stop()
+
 
     def start_service(self, hostname=DEFAULT_WEB_SERVER_HOSTNAME, port=DEFAULT_WEB_SERVER_PORT):
         """Responsible for starting the gevent based web server."""
@@ -136,10 +168,9 @@ class ServiceGatewayService(BaseServiceGatewayService):
         role_name = user_role_event.role_name
         log.debug("User Role modified: %s %s %s" % (org_id, user_id, role_name))
 
-        #Evict the user and their roles from the cache so that it gets updated with the next call.
-        if service_gateway_instance.user_data_cache.has_key(user_id):
-            log.debug('Evicting user from the user_data_cache: %s' % user_id)
-            service_gateway_instance.user_data_cache.evict(user_id)
+        #Evict the user and their roles from the cache, they are reloaded in the background.
+        log.debug('Evicting user from the user_role_cache: %s' % user_id)
+        service_gateway_instance.user_role_cache.invalidate(user_id)
 
 
 
@@ -179,23 +210,10 @@ def process_gateway_request(service_name, operation):
         if not service_name:
             raise BadRequest("Target service name not found in the URL")
 
-        #Retrieve service definition
-        from pyon.core.bootstrap import get_service_registry
-        # MM: Note: service_registry can do more now
-        target_service = get_service_registry().get_service_by_name(service_name)
-
-        if not target_service:
-            raise BadRequest("The requested service (%s) is not available" % service_name)
-
         if operation == '':
             raise BadRequest("Service operation not specified in the URL")
 
-
-        #Find the concrete client class for making the RPC calls.
-        if not target_service.client:
-            raise Inconsistent("Cannot find a client class for the specified service: %s" % service_name )
-
-        target_client = target_service.client
+        gateway_op = get_service_operation(service_name, operation)
 
         #Retrieve json data from HTTP Post payload
         json_params = None
@@ -214,13 +232,13 @@ def process_gateway_request(service_name, operation):
             if not json_params['serviceRequest'].has_key('serviceOp'):
                 raise Inconsistent("The JSON request is missing the 'serviceOp' key in the request")
 
-            if json_params['serviceRequest']['serviceName'] != target_service.name:
-                raise Inconsistent("Target service name in the JSON request (%s) does not match service name in URL (%s)" % (str(json_params['serviceRequest']['serviceName']), target_service.name ) )
+            if json_params['serviceRequest']['serviceName'] != gateway_op.service_def.name:
+                raise Inconsistent("Target service name in the JSON request (%s) does not match service name in URL (%s)" % (str(json_params['serviceRequest']['serviceName']), gateway_op.service_def.name ) )
 
             if json_params['serviceRequest']['serviceOp'] != operation:
                 raise Inconsistent("Target service operation in the JSON request (%s) does not match service name in URL (%s)" % ( str(json_params['serviceRequest']['serviceOp']), operation ) )
 
-        param_list = create_parameter_list('serviceRequest', service_name, target_client,operation, json_params)
+        param_list = gateway_op.create_parameter_list('serviceRequest', json_params)
 
 
         #Validate requesting user and expiry and add governance headers
@@ -228,8 +246,7 @@ def process_gateway_request(service_name, operation):
         ion_actor_id, expiry = validate_request(ion_actor_id, expiry)
         param_list['headers'] = build_message_headers(ion_actor_id, expiry)
 
-        client = target_client(node=Container.instance.node, process=service_gateway_instance)
-        methodToCall = getattr(client, operation)
+        methodToCall = gateway_op.get_method()
         result = methodToCall(**param_list)
 
         return gateway_json_response(result)
@@ -239,6 +256,76 @@ def process_gateway_request(service_name, operation):
         return build_error_response(e)
 
 
+# This service method makes several service requests in one HTTP request. The service requests are made concurrently
+# under the governance headers of the batch and the response holds the result or the error of each one, in the
+# order of the requests; like this:
+# curl -d 'payload={"batchRequest": { "requester": "...", "serviceRequests": [
+# { "serviceName": "resource_registry", "serviceOp": "read", "params": { "object_id": "c1b6fa6aadbd4eb696a9407a39adbdc8" } },
+# { "serviceName": "resource_registry", "serviceOp": "find_resources", "params": { "restype": "DataProduct", "id_only": true } } ] } }'
+# http://localhost:5000/ion-service/batch
+@app.route('/ion-service/batch', methods=['POST'])
+def process_gateway_batch_request():
+
+    try:
+
+        payload = request.form['payload']
+        json_params = json.loads(payload)
+
+        if not json_params.has_key('batchRequest'):
+            raise Inconsistent("The JSON request is missing the 'batchRequest' key in the request")
+
+        if not isinstance(json_params['batchRequest'].get('serviceRequests'), list):
+            raise Inconsistent("The JSON request is missing the 'serviceRequests' list in the request")
+
+        service_requests = json_params['batchRequest']['serviceRequests']
+        if len(service_requests) > service_gateway_instance.batch_max_requests:
+            raise BadRequest("The batch request has %d service requests, the limit is %d" % (len(service_requests), service_gateway_instance.batch_max_requests))
+
+        #Validate requesting user and expiry once for all of the service requests
+        ion_actor_id, expiry = get_governance_info_from_request('batchRequest', json_params)
+        ion_actor_id, expiry = validate_request(ion_actor_id, expiry)
+        headers = build_message_headers(ion_actor_id, expiry)
+
+        #Spawning blocks while the pool is full
+        greenlets = [service_gateway_instance.batch_pool.spawn(process_batch_service_request, service_request, headers)
+                     for service_request in service_requests]
+        gevent.joinall(greenlets)
+
+        return gateway_json_response([greenlet.value for greenlet in greenlets])
+
+    except Exception, e:
+        return build_error_response(e)
+
+#Makes one service request of a batch, this runs in a greenlet of the batch pool, outside of the Flask request context
+def process_batch_service_request(service_request, headers):
+
+    try:
+
+        if not isinstance(service_request, dict):
+            raise Inconsistent("The service requests of a batch must be JSON objects")
+
+        service_name = service_request.get('serviceName')
+        if not service_name:
+            raise Inconsistent("The JSON request is missing the 'serviceName' key in the request")
+
+        operation = service_request.get('serviceOp')
+        if not operation:
+            raise Inconsistent("The JSON request is missing the 'serviceOp' key in the request")
+
+        gateway_op = get_service_operation(convert_unicode(service_name), convert_unicode(operation))
+        param_list = gateway_op.create_parameter_list('serviceRequest', {'serviceRequest': {'params': service_request.get('params', {})}})
+        param_list['headers'] = dict(headers)
+
+        timeout = service_gateway_instance.batch_timeout
+        with gevent.Timeout(timeout, Timeout("The service request %s.%s did not complete within %s seconds" % (service_name, operation, timeout))):
+            result = gateway_op.get_method()(**param_list)
+
+        return {GATEWAY_RESPONSE: result}
+
+    except Exception, e:
+        return {GATEWAY_ERROR: build_error_result(e)}
+
+
 #This service method is used to communicate with a resource agent within the system from an
 #external entity using HTTP requests. A resource_id of a running agent is required as is the operation
 #that is being called and a JSON request block which specifies the data being sent to the agent.
@@ -299,11 +386,77 @@ def process_gateway_agent_request(resource_id, operation):
         return build_error_response(e)
 
 
-#Private implementation of standard flask jsonify to specify the use of an encoder to walk ION objects
+#Private implementation of standard flask jsonify to specify the use of an encoder to walk ION objects.
+#The JSON is streamed and compressed if the client accepts it, the request context is not available while streaming.
+#The first chunk is encoded before the response is returned, so an encoding error in it, or anywhere in a response
+#smaller than STREAM_CHUNK_SIZE, raises here and the caller returns an error response. An error in a later chunk
+#comes after the 200 status was sent: the server closes the connection before the end of the chunked body, which
+#the client sees as an incomplete response rather than a complete one.
 def json_response(response_data):
 
-    return app.response_class(simplejson.dumps(response_data, default=ion_object_encoder,
-        indent=None if request.is_xhr else 2), mimetype='application/json')
+    if request.args.get(PRETTY_PARAM, '').lower() in ('true', '1'):
+        chunks = [simplejson.dumps(response_data, default=ion_object_encoder, indent=2)]
+    else:
+        chunks = iter_json_chunks(response_data, simplejson.JSONEncoder(default=ion_object_encoder))
+        chunks = itertools.chain([next(chunks, '')], chunks)
+
+    encoding = request.accept_encodings.best_match(COMPRESSION_ENCODINGS)
+    if encoding:
+        chunks = iter_compressed(chunks, encoding)
+
+    response = app.response_class(chunks, mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+#Groups the pieces of the JSON document into chunks of STREAM_CHUNK_SIZE
+def iter_json_chunks(response_data, encoder):
+    pieces = []
+    size = 0
+    for piece in iter_json(response_data, encoder, STREAM_DEPTH):
+        pieces.append(piece)
+        size += len(piece)
+        if size >= STREAM_CHUNK_SIZE:
+            yield ''.join(pieces)
+            pieces = []
+            size = 0
+    if pieces:
+        yield ''.join(pieces)
+
+#Encodes lists and dicts element by element down to depth, so only one element of a large result
+#is held as a JSON string at a time. The elements are encoded whole by the (C accelerated) encoder.
+def iter_json(data, encoder, depth):
+    if depth and isinstance(data, (list, tuple)):
+        yield '['
+        for i, item in enumerate(data):
+            if i:
+                yield ', '
+            for piece in iter_json(item, encoder, depth - 1):
+                yield piece
+        yield ']'
+    elif depth and type(data) is dict and all(isinstance(key, basestring) for key in data):
+        yield '{'
+        for i, (key, value) in enumerate(data.iteritems()):
+            if i:
+                yield ', '
+            yield encoder.encode(key)
+            yield ': '
+            for piece in iter_json(value, encoder, depth - 1):
+                yield piece
+        yield '}'
+    else:
+        yield encoder.encode(data)
+
+def iter_compressed(chunks, encoding):
+    #gzip needs the gzip header and trailer, deflate is the zlib format
+    wbits = 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, wbits)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
 
 def gateway_json_response(response_data):
 
@@ -315,15 +468,19 @@ def gateway_json_response(response_data):
 
     return json_response({'data':{ GATEWAY_RESPONSE: response_data} } )
 
-def build_error_response(e):
+def build_error_result(e):
 
     exc_type, exc_obj, exc_tb = sys.exc_info()
-    result = {
+    return {
         GATEWAY_ERROR_EXCEPTION : exc_type.__name__,
         GATEWAY_ERROR_MESSAGE : str(e.message),
         GATEWAY_ERROR_TRACE : traceback.format_exception(*sys.exc_info())
     }
 
+def build_error_response(e):
+
+    result = build_error_result(e)
+
     if request.args.has_key(RETURN_FORMAT_PARAM):
         return_format = convert_unicode(request.args[RETURN_FORMAT_PARAM])
         if return_format == RETURN_FORMAT_RAW_JSON:
@@ -360,11 +517,7 @@ def validate_request(ion_actor_id, expiry):
         expiry = DEFAULT_EXPIRY  #Since this is now an anonymous request, there really is no expiry associated with it
         return ion_actor_id, expiry
 
-    idm_client = IdentityManagementServiceProcessClient(node=Container.instance.node, process=service_gateway_instance)
-
-    try:
-        user = idm_client.read_actor_identity(user_id=ion_actor_id, headers={"ion-actor-id": service_gateway_instance.name, 'expiry': DEFAULT_EXPIRY })
-    except NotFound, e:
+    if service_gateway_instance.user_role_cache.get(ion_actor_id) is None:
         ion_actor_id = DEFAULT_ACTOR_ID  # If the user isn't found default to anonymous
         expiry = DEFAULT_EXPIRY  #Since this is now an anonymous request, there really is no expiry associated with it
         return ion_actor_id, expiry
@@ -396,29 +549,34 @@ def build_message_headers( ion_actor_id, expiry):
         return headers
 
     try:
-        #Check to see if the user's roles are cached already - keyed by user id
-        if service_gateway_instance.user_data_cache.has_key(ion_actor_id):
-            role_header = service_gateway_instance.user_data_cache.get(ion_actor_id)
-            if role_header is not None:
-                headers['ion-actor-roles'] = role_header
-                return headers
+        #The user's roles are cached by user id, validate_request has already looked them up and counted the hit
+        role_header = service_gateway_instance.user_role_cache.get(ion_actor_id, count=False)
+    except Exception, e:
+        role_header = None
 
+    headers['ion-actor-roles'] = role_header or dict()  # Default to empty dict if there is a problem finding roles for the user
 
-        #The user's roles were not cached so hit the datastore to find it.
-        org_client = OrgManagementServiceProcessClient(node=Container.instance.node, process=service_gateway_instance)
-        org_roles = org_client.find_all_roles_by_user(ion_actor_id, headers={"ion-actor-id": service_gateway_instance.name, 'expiry': DEFAULT_EXPIRY })
+    return headers
 
-        role_header = get_role_message_headers(org_roles)
+#Looks up the roles of a user for the user_role_cache, returns None if the user is not found
+def find_user_roles(ion_actor_id):
 
-        #Cache the roles by user id
-        service_gateway_instance.user_data_cache.put(ion_actor_id, role_header)
+    idm_client = IdentityManagementServiceProcessClient(node=Container.instance.node, process=service_gateway_instance)
 
-    except Exception, e:
-        role_header = dict()  # Default to empty dict if there is a problem finding roles for the user
+    try:
+        idm_client.read_actor_identity(user_id=ion_actor_id, headers={"ion-actor-id": service_gateway_instance.name, 'expiry': DEFAULT_EXPIRY })
+    except NotFound, e:
+        return None
 
-    headers['ion-actor-roles'] = role_header
+    try:
+        org_client = OrgManagementServiceProcessClient(node=Container.instance.node, process=service_gateway_instance)
+        org_roles = org_client.find_all_roles_by_user(ion_actor_id, headers={"ion-actor-id": service_gateway_instance.name, 'expiry': DEFAULT_EXPIRY })
+    except Exception, e:
+        #Cached as a user without roles, which expires after user_cache_negative_ttl
+        log.warning('Unable to find the roles of user %s: %s', ion_actor_id, e)
+        return dict()
 
-    return headers
+    return get_role_message_headers(org_roles)
 
 #Iterate the Org(s) that the user belongs to and create a header that lists only the role names per Org assigned
 #to the user; i.e. {'ION': ['Member', 'Operator'], 'Org2': ['Member']}
@@ -431,33 +589,104 @@ def get_role_message_headers(org_roles):
             role_header[org].append(role.name)
     return role_header
 
+#Argument binding of a service operation, built on the first request for it and kept in gateway_operations
+#so that the client method is not inspected on every request.
+class GatewayOperation(object):
+
+    def __init__(self, service_name, operation, client_class, service_def=None):
+        self.service_name = service_name
+        self.operation = operation
+        self.client_class = client_class
+        self.service_def = service_def
+
+        method_args = inspect.getargspec(getattr(client_class, operation))
+        self.arg_names = [arg for arg in method_args[0] if arg != 'self' and arg != 'headers'] # skip self and headers from being set
+        self._query_decoders = {}
+        self._method = None
+
+    #Returns the function converting a query string value for the argument, based on its declared parameter type
+    def get_query_decoder(self, arg):
+        decoder = self._query_decoders.get(arg)
+        if decoder is None:
+            param_type = get_message_class_in_parm_type(self.service_name, self.operation, arg)
+            if param_type == 'str':
+                decoder = convert_unicode
+            else:
+                decoder = decode_literal
+            self._query_decoders[arg] = decoder
+        return decoder
+
+    #Build parameter list from the query string or the JSON request
+    def create_parameter_list(self, request_type, json_params):
+        param_list = {}
+        if not json_params:
+            for arg in self.arg_names:
+                if request.args.has_key(arg):
+                    param_list[arg] = self.get_query_decoder(arg)(request.args[arg])
+        else:
+            params = json_params[request_type]['params']
+            for arg in self.arg_names:
+                if params.has_key(arg):
+                    param_list[arg] = decode_json_param(params[arg])
+
+        return param_list
+
+    #Returns the operation of a client of the service, the client is created once and reused for all requests
+    def get_method(self):
+        if self._method is None:
+            client = self.client_class(node=Container.instance.node, process=service_gateway_instance)
+            self._method = getattr(client, self.operation)
+        return self._method
+
+#Returns the GatewayOperation of a service operation from the service registry
+def get_service_operation(service_name, operation):
+
+    #Retrieve service definition
+    from pyon.core.bootstrap import get_service_registry
+    # MM: Note: service_registry can do more now
+    target_service = get_service_registry().get_service_by_name(service_name)
+
+    if not target_service:
+        raise BadRequest("The requested service (%s) is not available" % service_name)
+
+    #Find the concrete client class for making the RPC calls.
+    if not target_service.client:
+        raise Inconsistent("Cannot find a client class for the specified service: %s" % service_name )
+
+    return get_gateway_operation(service_name, operation, target_service.client, target_service)
+
+#Dispatch table of the service operations called through the gateway, keyed by (service name, operation)
+gateway_operations = {}
+
+def get_gateway_operation(service_name, operation, client_class, service_def=None):
+    gateway_op = gateway_operations.get((service_name, operation))
+
+    #Rebuild the entry when the service definitions have been reloaded since it was created
+    if gateway_op is None or gateway_op.service_def is not service_def or gateway_op.client_class is not client_class:
+        gateway_op = GatewayOperation(service_name, operation, client_class, service_def)
+        gateway_operations[(service_name, operation)] = gateway_op
+
+    return gateway_op
+
+def clear_gateway_operations():
+    gateway_operations.clear()
+
 #Build parameter list dynamically from
 def create_parameter_list(request_type, service_name, target_client,operation, json_params):
-    param_list = {}
-    method_args = inspect.getargspec(getattr(target_client,operation))
-    for arg in method_args[0]:
-        if arg == 'self' or arg == 'headers': continue # skip self and headers from being set
+    return get_gateway_operation(service_name, operation, target_client).create_parameter_list(request_type, json_params)
 
-        if not json_params:
-            if request.args.has_key(arg):
-                param_type = get_message_class_in_parm_type(service_name, operation, arg)
-                if param_type == 'str':
-                    param_list[arg] = convert_unicode(request.args[arg])
-                else:
-                    param_list[arg] = ast.literal_eval(convert_unicode(request.args[arg]))
-        else:
-            if json_params[request_type]['params'].has_key(arg):
+def decode_literal(value):
+    return ast.literal_eval(convert_unicode(value))
 
-                #TODO - Potentially remove these conversions whenever ION objects support unicode
-                # UNICODE strings are not supported with ION objects
-                object_params = convert_unicode(json_params[request_type]['params'][arg])
-                if is_ion_object_dict(object_params):
-                    param_list[arg] = create_ion_object(object_params)
-                else:
-                    #Not an ION object so handle as a simple type then.
-                    param_list[arg] = convert_unicode(json_params[request_type]['params'][arg])
+def decode_json_param(value):
+    #TODO - Potentially remove these conversions whenever ION objects support unicode
+    # UNICODE strings are not supported with ION objects
+    object_params = convert_unicode(value)
+    if is_ion_object_dict(object_params):
+        return create_ion_object(object_params)
 
-    return param_list
+    #Not an ION object so handle as a simple type then.
+    return object_params
 
 #Helper function for creating and initializing an ION object from a dictionary of parameters.
 def create_ion_object(object_params):
@@ -612,6 +841,14 @@ def list_resources_by_type(resource_type):
 
 #Gateway specific services are below
 
+#Returns the hit, miss and lookup latency counters of the user role cache
+@app.route('/ion-service/user_role_cache_stats')
+def get_user_role_cache_stats():
+    try:
+        return gateway_json_response(service_gateway_instance.user_role_cache.get_stats())
+    except Exception, e:
+        return build_error_response(e)
+
 # Get image for a specific data product
 @app.route('/ion-viz-products/image/<data_product_id>/<img_name>', methods=['GET','POST'])
 def get_viz_image(data_product_id, img_name):
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+__license__ = 'Apache 2.0'
+
+from mock import Mock, patch
+from pyon.util.unit_test import PyonTestCase
+from pyon.util.containers import DotDict
+from nose.plugins.attrib import attr
+
+from pyon.public import PRED, RT
+from ion.services.coi.association_index import AssociationIndex, IndexedResourceRegistry, indexed_registry, OUT, IN
+
+
+def make_assoc(assoc_id, s, st, p, o, ot):
+    return DotDict(_id=assoc_id, s=s, st=st, p=p, o=o, ot=ot)
+
+
+@attr('UNIT', group='coi')
+class TestAssociationIndex(PyonTestCase):
+
+    def setUp(self):
+        self.assocs = [
+            make_assoc('a1', 'dev', RT.InstrumentDevice, PRED.hasModel, 'model', RT.InstrumentModel),
+            make_assoc('a2', 'agent', RT.InstrumentAgent, PRED.hasModel, 'model', RT.InstrumentModel),
+            make_assoc('a3', 'agent', RT.InstrumentAgent, PRED.hasProcessDefinition, 'pd', RT.ProcessDefinition),
+            make_assoc('a4', 'dev', RT.InstrumentDevice, PRED.hasOutputProduct, 'dp', RT.DataProduct),
+        ]
+        self.rr = Mock()
+        def find_associations(subject=None, predicate=None, object=None, id_only=False):
+            return [a for a in self.assocs
+                    if (not subject or a.s == subject) and (not predicate or a.p == predicate) and (not object or a.o == object)]
+        self.rr.find_associations.side_effect = find_associations
+        self.index = AssociationIndex(self.rr)
+
+    def test_lookups(self):
+        ids, assocs = self.index.find_objects('dev', PRED.hasModel, RT.InstrumentModel)
+        self.assertEquals(ids, ['model'])
+        self.assertEquals(assocs[0]._id, 'a1')
+
+        ids, _ = self.index.find_objects('dev')
+        self.assertEquals(ids, ['model', 'dp'])
+
+        ids, _ = self.index.find_subjects(RT.InstrumentAgent, PRED.hasModel, 'model')
+        self.assertEquals(ids, ['agent'])
+
+        ids = self.index.find_path('dev', [(OUT, PRED.hasModel, RT.InstrumentModel),
+                                           (IN, PRED.hasModel, RT.InstrumentAgent),
+                                           (OUT, PRED.hasProcessDefinition, RT.ProcessDefinition)])
+        self.assertEquals(ids, ['pd'])
+
+        # Loaded once, one query per predicate
+        calls = self.rr.find_associations.call_count
+        self.index.find_objects('agent')
+        self.assertEquals(self.rr.find_associations.call_count, calls)
+
+    def test_refresh(self):
+        self.index.build()
+
+        self.assocs.append(make_assoc('a5', 'dev', RT.InstrumentDevice, PRED.hasOutputProduct, 'dp2', RT.DataProduct))
+        self.index.refresh('dev')
+        self.assertEquals(self.index.find_objects('dev', PRED.hasOutputProduct)[0], ['dp', 'dp2'])
+
+        del self.assocs[:]
+        self.index.refresh('model')
+        self.assertEquals(self.index.find_objects('dev', PRED.hasModel)[0], [])
+        self.assertEquals(self.index.find_objects('agent', PRED.hasModel)[0], [])
+        self.assertEquals(self.index.find_objects('agent', PRED.hasProcessDefinition)[0], ['pd'])
+
+        self.index._resource_modified_callback(DotDict(origin='agent'))
+        self.assertEquals(self.index.find_objects('agent')[0], [])
+
+    def test_indexed_registry(self):
+        registry = IndexedResourceRegistry(self.rr, self.index)
+        self.rr.read_mult.return_value = ['model_obj']
+
+        objs, _ = registry.find_objects('dev', PRED.hasModel, RT.InstrumentModel, False)
+        self.assertEquals(objs, ['model_obj'])
+        self.rr.read_mult.assert_called_once_with(['model'])
+
+        registry.delete_association('a4')
+        self.rr.delete_association.assert_called_once_with(association='a4')
+        self.assertEquals(registry.find_objects('dev', id_only=True)[0], ['model'])
+
+        # Everything else goes to the registry
+        registry.read('dev')
+        self.rr.read.assert_called_once_with('dev')
+
+    @patch('ion.services.coi.association_index.CFG')
+    def test_disabled(self, cfg):
+        cfg.get_safe.return_value = False
+        self.assertTrue(indexed_registry(self.rr) is self.rr)
+
+    @patch('ion.services.coi.association_index.EventSubscriber')
+    @patch('ion.services.coi.association_index.Container')
+    @patch('ion.services.coi.association_index.CFG')
+    def test_stopped_with_container(self, cfg, container_class, subscriber_class):
+        cfg.get_safe.side_effect = lambda key, default=None: True if key.endswith('enabled') else default
+        container = container_class.instance
+        container.association_index = None
+        container_stop = container.stop
+
+        registry = indexed_registry(self.rr)
+        self.assertTrue(registry.index is container.association_index)
+        self.assertTrue(indexed_registry(self.rr).index is registry.index)
+        subscriber_class.return_value.activate.assert_called_once_with()
+
+        container.stop()
+        subscriber_class.return_value.deactivate.assert_called_once_with()
+        container_stop.assert_called_once_with()
+        self.assertIsNone(container.association_index)
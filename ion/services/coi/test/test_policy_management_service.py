@@ -11,7 +11,7 @@ from nose.plugins.attrib import attr
 
 from pyon.core.exception import BadRequest, Conflict, Inconsistent, NotFound
 from pyon.public import PRED, RT, IonObject
-from ion.services.coi.policy_management_service import PolicyManagementService
+from ion.services.coi.policy_management_service import PolicyManagementService, PolicyRulesCache
 from interface.services.coi.ipolicy_management_service import PolicyManagementServiceClient
 
 @attr('UNIT', group='coi')
@@ -153,6 +153,56 @@ class TestPolicyManagementService(PyonTestCase):
         self.assertEqual(ex.message, 'Role bad role does not exist')
         self.mock_read.assert_called_once_with('bad role', '')
 
+    def test_active_policy_rules_cache(self):
+        self.policy_management_service.rules_cache = PolicyRulesCache()
+
+        resource = Mock(_id='resource_id')
+        org = Mock(_id='org_id')
+        org.name = 'ION'
+        service_resource = Mock(_id='service_id')
+        self.mock_read.side_effect = lambda resource_id, rev='': {'resource_id': resource, 'org_id': org, 'service_id': service_resource}.get(resource_id)
+        self.mock_find_resources.return_value = ([service_resource], None)
+        self.mock_find_subjects.return_value = ([], None)
+
+        policy = Mock(_id='policy_id', _rev='1', enabled=True, rule='<Rule RuleId="resource_rule"/>')
+        org_policy = Mock(_id='org_policy_id', _rev='1', enabled=True, rule='<Rule RuleId="org_rule"/>')
+        policies = {'resource_id': [policy], 'org_id': [org_policy], 'service_id': []}
+        self.mock_find_objects.side_effect = lambda subject, predicate, object_type: (policies[subject], None)
+
+        self.policy_management_service._get_policy_template = Mock(wraps=self.policy_management_service._get_policy_template)
+        policy_rules = self.policy_management_service.get_active_resource_policy_rules('resource_id')
+        self.assertIn('resource_rule', policy_rules)
+        self.assertIs(self.policy_management_service.get_active_resource_policy_rules('resource_id'), policy_rules)
+
+        service_rules = self.policy_management_service.get_active_service_policy_rules('org_id', 'service')
+        self.assertIn('org_rule', service_rules)
+        self.assertIs(self.policy_management_service.get_active_service_policy_rules('org_id', 'service'), service_rules)
+
+        # The resource and org are checked on every request, the rules are only generated again on a miss
+        self.assertEqual(self.mock_read.call_count, 4)
+        self.assertEqual(self.policy_management_service._get_policy_template.call_count, 2)
+
+        # A modified policy evicts the rules generated from it
+        policy.enabled = False
+        policy._rev = '2'
+        self.policy_management_service.policy_event_callback(Mock(origin='policy_id'))
+        self.assertNotIn('resource_rule', self.policy_management_service.get_active_resource_policy_rules('resource_id'))
+        self.assertIs(self.policy_management_service.get_active_service_policy_rules('org_id', 'service'), service_rules)
+
+        # So does a policy added to a service by another instance of the service
+        policies['service_id'] = [policy]
+        policy.enabled = True
+        policy._rev = '3'
+        self.policy_management_service.resource_policy_event_callback(Mock(resource_id='service_id'))
+        service_rules = self.policy_management_service.get_active_service_policy_rules('org_id', 'service')
+        self.assertIn('resource_rule', service_rules)
+
+        # Without the event, the new revision of the policy is not served from the cache
+        policy.enabled = False
+        policy._rev = '4'
+        self.assertNotIn('resource_rule', self.policy_management_service.get_active_service_policy_rules('org_id', 'service'))
+        self.assertNotIn('resource_rule', self.policy_management_service.get_active_resource_policy_rules('resource_id'))
+
 
 @attr('INT', group='coi')
 class TestPolicyManagementServiceInt(IonIntegrationTestCase):
@@ -6,14 +6,21 @@
 __author__ = 'Stephen P. Henrie'
 __license__ = 'Apache 2.0'
 
-import simplejson, json
+import simplejson, json, time, zlib, resource
+import gevent
+import gevent.socket
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+from mock import Mock, patch
 from pyon.util.int_test import IonIntegrationTestCase
+from pyon.util.unit_test import PyonTestCase
 from nose.plugins.attrib import attr
 from webtest import TestApp
 
 from pyon.core.registry import get_message_class_in_parm_type, getextends
 from ion.services.coi.service_gateway_service import ServiceGatewayService, app, convert_unicode, GATEWAY_RESPONSE, \
-            GATEWAY_ERROR, GATEWAY_ERROR_MESSAGE, GATEWAY_ERROR_EXCEPTION, GATEWAY_ERROR_TRACE
+            GATEWAY_ERROR, GATEWAY_ERROR_MESSAGE, GATEWAY_ERROR_EXCEPTION, GATEWAY_ERROR_TRACE, \
+            get_gateway_operation, clear_gateway_operations, gateway_operations
 
 from interface.services.coi.iservice_gateway_service import ServiceGatewayServiceClient
 from pyon.util.containers import DictDiffer
@@ -22,6 +29,201 @@ from pyon.util.log import log
 import unittest
 import os
 
+
+#Client of a service with an operation that does nothing, for exercising the gateway without a container
+class NoopServiceClient(object):
+    def __init__(self, node=None, process=None):
+        pass
+
+    def noop(self, name='', count=0, headers=None):
+        return count
+
+    def sleep(self, seconds=0, headers=None):
+        gevent.sleep(seconds)
+        return headers['ion-actor-id']
+
+    def list_resources(self, count=0, headers=None):
+        return [GatewayTestResource(i) for i in xrange(count)]
+
+    def list_unencodable(self, headers=None):
+        return [object()]
+
+
+class GatewayTestResource(object):
+    def __init__(self, i):
+        self._id = 'resource_%d' % i
+        self.type_ = 'DataProduct'
+        self.name = u'Data product %d' % i
+        self.description = 'A test data product'
+        self.lcstate = 'DEPLOYED_AVAILABLE'
+        self.ts_created = '1350000000000'
+        self.contact = {'name': 'Test User', 'city': 'San Diego'}
+
+
+class NoopServiceGatewayTestCase(PyonTestCase):
+
+    def setUp(self):
+        clear_gateway_operations()
+        self.addCleanup(clear_gateway_operations)
+
+        self.service_def = Mock(client=NoopServiceClient)
+        self.service_def.name = 'noop_service'
+        service_registry = Mock()
+        service_registry.get_service_by_name.side_effect = lambda name: self.service_def if name == 'noop_service' else None
+
+        self.gateway = Mock(batch_max_requests=4, batch_timeout=0.5, batch_pool=Pool(2))
+
+        for target, value in (('pyon.core.bootstrap.get_service_registry', Mock(return_value=service_registry)),
+                              ('ion.services.coi.service_gateway_service.service_gateway_instance', self.gateway),
+                              ('ion.services.coi.service_gateway_service.Container', Mock()),
+                              ('ion.services.coi.service_gateway_service.get_message_class_in_parm_type', Mock(side_effect=lambda service_name, operation, arg: 'str' if arg == 'name' else 'int'))):
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.test_app = TestApp(app)
+
+
+@attr('UNIT', group='coi-sgs')
+class TestServiceGatewayOperations(NoopServiceGatewayTestCase):
+
+    def test_operation_binding(self):
+        response = self.test_app.get('/ion-service/noop_service/noop?count=3&other=1')
+        self.assertEqual(response.json['data'][GATEWAY_RESPONSE], 3)
+
+        gateway_op = gateway_operations[('noop_service', 'noop')]
+        self.assertEqual(gateway_op.arg_names, ['name', 'count'])
+
+        #The binding is reused by later requests
+        response = self.test_app.get('/ion-service/noop_service/noop?count=4')
+        self.assertEqual(response.json['data'][GATEWAY_RESPONSE], 4)
+        self.assertIs(gateway_operations[('noop_service', 'noop')], gateway_op)
+        self.assertIs(get_gateway_operation('noop_service', 'noop', NoopServiceClient, self.service_def), gateway_op)
+
+        #A reloaded service definition replaces it
+        reloaded_op = get_gateway_operation('noop_service', 'noop', NoopServiceClient, Mock())
+        self.assertIsNot(reloaded_op, gateway_op)
+
+    def post_batch(self, service_requests):
+        batch_request = {'batchRequest': {'serviceRequests': service_requests}}
+        response = self.test_app.post('/ion-service/batch', {'payload': json.dumps(batch_request)})
+        return response.json['data']
+
+    def test_batch_request(self):
+        response_data = self.post_batch([
+            {'serviceName': 'noop_service', 'serviceOp': 'sleep', 'params': {'seconds': 0.2}},
+            {'serviceName': 'noop_service', 'serviceOp': 'noop', 'params': {'count': 2}},
+            {'serviceName': 'missing_service', 'serviceOp': 'noop'},
+            {'serviceName': 'noop_service', 'serviceOp': 'sleep', 'params': {'seconds': 2}}])
+
+        results = response_data[GATEWAY_RESPONSE]
+        self.assertEqual(len(results), 4)
+        self.assertEqual(results[0], {GATEWAY_RESPONSE: 'anonymous'})
+        self.assertEqual(results[1], {GATEWAY_RESPONSE: 2})
+        self.assertEqual(results[2][GATEWAY_ERROR][GATEWAY_ERROR_EXCEPTION], 'BadRequest')
+        self.assertEqual(results[3][GATEWAY_ERROR][GATEWAY_ERROR_EXCEPTION], 'Timeout')
+
+        #The service requests were made in at most two greenlets
+        self.assertEqual(self.gateway.batch_pool.free_count(), 2)
+
+        response_data = self.post_batch([{'serviceName': 'noop_service', 'serviceOp': 'noop'}] * 5)
+        self.assertEqual(response_data[GATEWAY_ERROR][GATEWAY_ERROR_EXCEPTION], 'BadRequest')
+
+    def test_streamed_response(self):
+        url = '/ion-service/noop_service/list_resources?count=2000'
+        expected = {'data': {GATEWAY_RESPONSE: [resource.__dict__ for resource in NoopServiceClient().list_resources(2000)]}}
+
+        response = self.test_app.get(url)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.json, expected)
+        self.assertNotIn('\n', response.body)
+
+        response = self.test_app.get(url + '&pretty=true')
+        self.assertEqual(response.json, expected)
+        self.assertIn('\n', response.body)
+
+        #TestApp decompresses the responses itself
+        client = app.test_client()
+        response = client.get(url, headers={'Accept-Encoding': 'gzip;q=0.5, deflate'})
+        self.assertEqual(response.headers['Content-Encoding'], 'deflate')
+        self.assertEqual(json.loads(zlib.decompress(response.data)), expected)
+
+        response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(zlib.decompress(response.data, 16 + zlib.MAX_WBITS)), expected)
+
+        #An encoding error in the first chunk is returned as an error response
+        response = self.test_app.get('/ion-service/noop_service/list_unencodable')
+        self.assertEqual(response.json['data'][GATEWAY_ERROR][GATEWAY_ERROR_EXCEPTION], 'AttributeError')
+
+
+@attr('LOAD', group='coi-sgs')
+class TestServiceGatewayThroughput(NoopServiceGatewayTestCase):
+
+    def test_noop_requests_per_second(self):
+        requests = 2000
+
+        start = time.time()
+        for i in xrange(requests):
+            clear_gateway_operations()
+            self.test_app.get('/ion-service/noop_service/noop?name=test&count=%d' % i)
+        uncached_time = time.time() - start
+
+        start = time.time()
+        for i in xrange(requests):
+            response = self.test_app.get('/ion-service/noop_service/noop?name=test&count=%d' % i)
+        cached_time = time.time() - start
+        self.assertEqual(response.json['data'][GATEWAY_RESPONSE], requests - 1)
+
+        log.info('Gateway without the operation cache: %.1f requests/s', requests / uncached_time)
+        log.info('Gateway with the operation cache: %.1f requests/s', requests / cached_time)
+
+    def fetch(self, port, path, accept_encoding=''):
+        '''
+        @return (status line, seconds to the first body byte, total seconds, body bytes read) of a request made
+        through the gateway web server
+        '''
+        sock = gevent.socket.create_connection(('127.0.0.1', port))
+        start = time.time()
+        sock.sendall('GET %s HTTP/1.1\r\nHost: localhost\r\nAccept-Encoding: %s\r\nConnection: close\r\n\r\n' % (path, accept_encoding))
+        data = ''
+        while '\r\n\r\n' not in data:
+            data += sock.recv(65536)
+        head, body = data.split('\r\n\r\n', 1)
+        while not body:
+            body = sock.recv(65536)
+        first_byte_time = time.time() - start
+        body_size = len(body)
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            body_size += len(chunk)
+        sock.close()
+        return head.split('\r\n')[0], first_byte_time, time.time() - start, body_size
+
+    def test_large_listing(self):
+        '''
+        Compares the streamed response for a 50k resource listing with encoding the whole response at once,
+        served by the gateway's gevent.pywsgi server
+        '''
+        server = WSGIServer(('127.0.0.1', 0), app, log=None)
+        server.start()
+        self.addCleanup(server.stop)
+        path = '/ion-service/noop_service/list_resources?count=50000'
+
+        #The first request allocates the resources of the listing, the later ones reuse their memory
+        self.fetch(server.server_port, path)
+
+        #The whole, indented response is run last since the peak RSS of the process only grows
+        for label, query, accept_encoding in (('Streamed', '', ''), ('Streamed', '', 'gzip'), ('Whole response', '&pretty=true', '')):
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            status, first_byte_time, total_time, body_size = self.fetch(server.server_port, path + query, accept_encoding)
+            self.assertIn('200', status)
+            log.info('%s (Accept-Encoding: %s): first byte %.3fs, total %.3fs, %d bytes, max RSS grew %d kB',
+                label, accept_encoding, first_byte_time, total_time, body_size,
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - maxrss)
+
 @attr('LOCOINT', 'INT', group='coi-sgs')
 @unittest.skipIf(os.getenv('CEI_LAUNCH_TEST', False), 'Skip test while in CEI LAUNCH mode')
 class TestServiceGatewayServiceInt(IonIntegrationTestCase):
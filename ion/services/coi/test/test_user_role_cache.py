@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+__license__ = 'Apache 2.0'
+
+import gevent
+from mock import Mock
+from pyon.util.unit_test import PyonTestCase
+from nose.plugins.attrib import attr
+
+from ion.services.coi.user_role_cache import UserRoleCache
+
+
+@attr('UNIT', group='coi')
+class TestUserRoleCache(PyonTestCase):
+
+    def setUp(self):
+        self.roles = {'user': {'ION': ['ORG_MEMBER']}}
+        self.lookup = Mock(side_effect=lambda actor_id: self.roles.get(actor_id))
+        self.cache = UserRoleCache(self.lookup, 10, ttl=0.4, negative_ttl=0.1)
+        self.addCleanup(self.cache.stop)
+
+    def test_hits_and_negative_entries(self):
+        self.assertEquals(self.cache.get('user'), {'ION': ['ORG_MEMBER']})
+        self.assertEquals(self.cache.get('user'), {'ION': ['ORG_MEMBER']})
+        self.assertIsNone(self.cache.get('unknown'))
+        self.assertIsNone(self.cache.get('unknown'))
+        self.assertEquals(self.lookup.call_count, 2)
+
+        # The negative entry expires first
+        gevent.sleep(0.15)
+        self.roles['unknown'] = {'ION': ['ORG_MEMBER']}
+        self.assertEquals(self.cache.get('unknown'), {'ION': ['ORG_MEMBER']})
+
+        stats = self.cache.get_stats()
+        self.assertEquals((stats['hits'], stats['negative_hits'], stats['misses'], stats['lookups']), (1, 1, 3, 3))
+
+    def test_refresh_ahead(self):
+        self.cache.get('user')
+        gevent.sleep(0.32)
+
+        # Served from the cache while the roles are reloaded in the background
+        self.roles['user'] = {'ION': ['ORG_MANAGER']}
+        self.assertEquals(self.cache.get('user'), {'ION': ['ORG_MEMBER']})
+        gevent.sleep(0)
+        self.assertEquals(self.cache.get('user'), {'ION': ['ORG_MANAGER']})
+        self.assertEquals(self.lookup.call_count, 2)
+        self.assertEquals(self.cache.get_stats()['misses'], 1)
+
+    def test_one_refresh(self):
+        self.cache.get('user')
+        gevent.sleep(0.32)
+
+        # The gets made before the refresh runs do not start another one
+        for i in xrange(3):
+            self.assertEquals(self.cache.get('user'), {'ION': ['ORG_MEMBER']})
+        gevent.sleep(0)
+        self.assertEquals(self.lookup.call_count, 2)
+        self.assertEquals(self.cache.get_stats()['refreshes'], 1)
+
+    def test_uncounted_get(self):
+        self.cache.get('user')
+        self.assertEquals(self.cache.get('user', count=False), {'ION': ['ORG_MEMBER']})
+        self.assertEquals(self.cache.get_stats()['hits'], 0)
+
+        gevent.sleep(0.32)
+        self.cache.get('user', count=False)
+        gevent.sleep(0)
+        self.assertEquals(self.lookup.call_count, 1)
+
+    def test_invalidate(self):
+        def slow_lookup(actor_id):
+            roles = self.roles.get(actor_id)
+            gevent.sleep(0.05)
+            return roles
+        self.lookup.side_effect = slow_lookup
+
+        # Concurrent misses share one lookup
+        first, second = gevent.spawn(self.cache.get, 'user'), gevent.spawn(self.cache.get, 'user')
+        gevent.sleep(0.01)
+
+        # The lookup in progress read the roles before they changed, it is not cached
+        self.roles['user'] = {'ION': ['ORG_MANAGER']}
+        self.cache.invalidate('user')
+        gevent.joinall([first, second])
+        self.assertEquals(first.value, {'ION': ['ORG_MEMBER']})
+        self.assertEquals(second.value, {'ION': ['ORG_MEMBER']})
+        self.assertEquals(self.lookup.call_count, 1)
+
+        self.assertEquals(self.cache.get('user'), {'ION': ['ORG_MANAGER']})
+
+        # A cached user is reloaded after the event
+        self.roles['user'] = {'ION': ['ORG_MEMBER']}
+        self.cache.invalidate('user')
+        gevent.sleep(0.1)
+        self.assertEquals(self.cache.get('user'), {'ION': ['ORG_MEMBER']})
+        self.assertEquals(self.lookup.call_count, 3)
+        self.assertEquals(self.cache.get_stats()['hits'], 1)
+
+    def test_lookup_error(self):
+        self.lookup.side_effect = Exception('idm is down')
+        self.assertRaises(Exception, self.cache.get, 'user')
+
+        self.lookup.side_effect = lambda actor_id: self.roles.get(actor_id)
+        self.assertEquals(self.cache.get('user'), {'ION': ['ORG_MEMBER']})
+        self.assertEquals(self.cache.get_stats()['errors'], 1)
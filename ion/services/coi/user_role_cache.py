@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+'''
+Cache of the org roles of the actors making requests through the service gateway.
+
+Entries expire after a TTL. Actors that are unknown or have no roles are cached as negative entries with a shorter
+TTL. An entry that is used after most of its TTL has passed is refreshed in the background, so actors making
+repeated requests do not wait for the role lookup. UserRoleModifiedEvents evict the actor and reload it in the
+background. Concurrent misses for the same actor share one lookup.
+'''
+
+import time
+
+from gevent.event import AsyncResult
+from gevent.pool import Group
+
+from pyon.util.log import log
+from pyon.util.lru_cache import LRUCache
+
+DEFAULT_TTL = 300
+DEFAULT_NEGATIVE_TTL = 30
+
+#Fraction of the TTL after which a used entry is refreshed in the background
+REFRESH_AHEAD = 0.75
+
+
+class UserRoleCache(object):
+
+    def __init__(self, lookup, size, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        '''
+        @param lookup function of an actor id returning its role header, None when the actor is unknown
+        '''
+        self.lookup = lookup
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = LRUCache(size, 0, 0) # actor id -> (expires, refresh_at, role header)
+        self._pending = {} # actor id -> AsyncResult of the lookup in progress
+        self._stale = set() # lookups in progress for actors invalidated since they started
+        self._refreshes = Group()
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.invalidations = 0
+        self.errors = 0
+        self.lookups = 0
+        self.lookup_time = 0.
+        self.max_lookup_time = 0.
+
+    def get(self, actor_id, count=True):
+        '''
+        @param count False for a repeated get of the same request, which is not counted as a hit and does not
+        start a refresh
+        @return the role header of the actor, None when the actor is unknown
+        '''
+        if self._entries.has_key(actor_id):
+            entry = self._entries.get(actor_id)
+            if entry is not None:
+                expires, refresh_at, role_header = entry
+                now = time.time()
+                if now < expires:
+                    if not count:
+                        return role_header
+                    if role_header:
+                        self.hits += 1
+                    else:
+                        self.negative_hits += 1
+                    if now >= refresh_at and actor_id not in self._pending:
+                        self.refreshes += 1
+                        self._spawn_refresh(actor_id)
+                    return role_header
+
+        self.misses += 1
+        pending = self._pending.get(actor_id)
+        if pending is not None:
+            return pending.get()
+        return self._load(actor_id)
+
+    def invalidate(self, actor_id):
+        '''
+        @brief Evicts the actor, its roles are reloaded in the background
+        '''
+        self.invalidations += 1
+        # A lookup in progress may have read the roles before they changed
+        pending = self._pending.pop(actor_id, None)
+        if pending is not None:
+            self._stale.add(pending)
+        if self._entries.has_key(actor_id):
+            self._entries.evict(actor_id)
+            self._spawn_refresh(actor_id)
+
+    def stop(self):
+        self._refreshes.kill()
+
+    def _spawn_refresh(self, actor_id):
+        # Pending before the refresh runs, so the gets until then neither start another lookup nor refresh
+        result = AsyncResult()
+        self._pending[actor_id] = result
+        self._refreshes.spawn(self._refresh, actor_id, result)
+
+    def _refresh(self, actor_id, result=None):
+        try:
+            self._load(actor_id, result)
+        except Exception:
+            # The entry is kept until it expires
+            log.warning('Failed to refresh the roles of %s', actor_id, exc_info=True)
+
+    def _load(self, actor_id, result=None):
+        '''
+        @param result the AsyncResult the actor was marked pending with, a new one when None
+        '''
+        if result is None:
+            result = AsyncResult()
+            self._pending[actor_id] = result
+        start = time.time()
+        try:
+            role_header = self.lookup(actor_id)
+        except Exception, e:
+            self.errors += 1
+            self._stale.discard(result)
+            result.set_exception(e)
+            raise
+        finally:
+            if self._pending.get(actor_id) is result:
+                del self._pending[actor_id]
+            self._record_lookup(time.time() - start)
+
+        if result in self._stale:
+            self._stale.discard(result)
+        else:
+            now = time.time()
+            ttl = self.ttl if role_header else self.negative_ttl
+            self._entries.put(actor_id, (now + ttl, now + ttl * REFRESH_AHEAD, role_header))
+        result.set(role_header)
+        return role_header
+
+    def _record_lookup(self, duration):
+        self.lookups += 1
+        self.lookup_time += duration
+        self.max_lookup_time = max(self.max_lookup_time, duration)
+
+    def get_stats(self):
+        return {
+            'hits' : self.hits,
+            'negative_hits' : self.negative_hits,
+            'misses' : self.misses,
+            'refreshes' : self.refreshes,
+            'invalidations' : self.invalidations,
+            'errors' : self.errors,
+            'lookups' : self.lookups,
+            'mean_lookup_ms' : 1000 * self.lookup_time / self.lookups if self.lookups else 0.,
+            'max_lookup_ms' : 1000 * self.max_lookup_time,
+        }
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+'''
+@file ion/services/dm/ingestion/test/test_ingestion_worker.py
+@test ion.processes.data.ingestion.ingestion_worker batching unit tests
+'''
+
+from gevent.coros import RLock
+from gevent.pool import Pool
+from mock import Mock
+from nose.plugins.attrib import attr
+
+from pyon.util.containers import DotDict
+from pyon.util.unit_test import PyonTestCase
+from ion.processes.data.ingestion.ingestion_worker import IngestionWorker, IngestionWorkerException
+
+
+@attr('UNIT', group='dm')
+class IngestionWorkerBatchTest(PyonTestCase):
+
+    def setUp(self):
+        self.worker = IngestionWorker()
+        self.worker.batch_size = 2
+        self.worker.batch = []
+        self.worker.batch_lock = RLock()
+        self.worker.writer_pool = Pool(2)
+        self.worker.event_pub = Mock()
+        self.worker.persist_immutable_mult = Mock()
+        self.worker.persist_immutable_mult.side_effect = lambda objs: [True] * len(objs)
+        self.worker.write_cache = Mock()
+
+        self.time_bounds = [[0,9],[10,19]]
+        def prepare_stream(packet, dset_config):
+            attributes = {'variables':['temperature'], 'number_of_records':10, 'updated_metadata':True, 'updated_data':True,
+                          'bounds':{'time_bounds':self.time_bounds.pop(0)}}
+            return attributes, True, ('filename', 'values', 'sha1', 'hdf5')
+        self.worker.prepare_stream = Mock()
+        self.worker.prepare_stream.side_effect = prepare_stream
+
+        self.dset_config = DotDict()
+        self.dset_config.dataset_id = 'dataset_id'
+        self.dset_config.stream_id = 'stream_id'
+
+    def test_batch_flush(self):
+        self.worker.batch_granule('packet1', self.dset_config)
+
+        self.assertEquals(len(self.worker.batch), 1)
+        self.assertFalse(self.worker.persist_immutable_mult.called)
+
+        self.worker.batch_granule('packet2', self.dset_config)
+
+        self.assertEquals(self.worker.batch, [])
+        self.worker.persist_immutable_mult.assert_called_once_with(['packet1','packet2'])
+        self.assertEquals(self.worker.write_cache.call_count, 2)
+
+        # One aggregated event for the dataset
+        self.assertEquals(self.worker.event_pub.publish_event.call_count, 1)
+        kwargs = self.worker.event_pub.publish_event.call_args[1]
+        self.assertEquals(kwargs['origin'], 'dataset_id')
+        self.assertEquals(kwargs['ingest_attributes']['number_of_records'], 20)
+        self.assertEquals(kwargs['ingest_attributes']['number_of_granules'], 2)
+        self.assertEquals(kwargs['ingest_attributes']['variables'], ['temperature'])
+        self.assertEquals(kwargs['ingest_attributes']['bounds'], {'time_bounds':[0,19]})
+
+    def test_flush_empty(self):
+        self.worker.flush()
+        self.assertFalse(self.worker.persist_immutable_mult.called)
+        self.assertFalse(self.worker.event_pub.publish_event.called)
+
+    def test_flush_write_failure(self):
+        def write_cache(packet, *args):
+            if packet == 'packet1':
+                raise IOError('disk full')
+        self.worker.write_cache.side_effect = write_cache
+        self.worker.batch = [('packet1', self.dset_config), ('packet2', self.dset_config)]
+
+        self.assertRaises(IngestionWorkerException, self.worker.flush)
+
+        # The rest of the batch is still ingested
+        self.worker.persist_immutable_mult.assert_called_once_with(['packet2'])
+        kwargs = self.worker.event_pub.publish_event.call_args[1]
+        self.assertEquals(kwargs['ingest_attributes']['number_of_granules'], 1)
+        self.assertEquals(kwargs['ingest_attributes']['bounds'], {'time_bounds':[10,19]})
+
+    def test_flush_document_failure(self):
+        self.worker.persist_immutable_mult.side_effect = lambda objs: [True, False]
+        self.worker.batch = [('packet1', self.dset_config), ('packet2', self.dset_config)]
+
+        self.assertRaises(IngestionWorkerException, self.worker.flush)
+
+        kwargs = self.worker.event_pub.publish_event.call_args[1]
+        self.assertEquals(kwargs['ingest_attributes']['number_of_granules'], 1)
+        self.assertEquals(kwargs['ingest_attributes']['bounds'], {'time_bounds':[0,9]})
+
+    def test_flush_prepare_failure(self):
+        def prepare_stream(packet, dset_config):
+            if packet == 'packet1':
+                raise IngestionWorkerException('sha1 mismatch')
+            return {'variables':['temperature'], 'number_of_records':10, 'updated_metadata':True, 'updated_data':True,
+                    'bounds':{'time_bounds':[10,19]}}, True, ('filename', 'values', 'sha1', 'hdf5')
+        self.worker.prepare_stream.side_effect = prepare_stream
+        self.worker.batch = [('packet1', self.dset_config), ('packet2', self.dset_config)]
+
+        self.assertRaises(IngestionWorkerException, self.worker.flush)
+
+        # The rest of the batch is still ingested
+        self.worker.persist_immutable_mult.assert_called_once_with(['packet2'])
+        kwargs = self.worker.event_pub.publish_event.call_args[1]
+        self.assertEquals(kwargs['ingest_attributes']['number_of_granules'], 1)
+
+    def test_stop_batching_failure(self):
+        self.worker.flush_gl = None
+        self.worker.persist_immutable_mult.side_effect = lambda objs: [False] * len(objs)
+        self.worker.batch = [('packet1', self.dset_config)]
+
+        # The shutdown goes on
+        self.worker._stop_batching()
+        self.assertEquals(self.worker.batch, [])
+
+    def test_persist_immutable_mult(self):
+        worker = IngestionWorker()
+        worker.db = Mock()
+        worker.db._ion_object_to_persistence_dict.side_effect = lambda obj: {'value':obj}
+        worker.db.create_doc_mult.return_value = [(True, 'a', '1-a'), (False, 'b', Exception('conflict')), (False, 'c', Exception('forbidden'))]
+
+        self.assertEquals(worker.persist_immutable_mult(['a','b','c']), [True, True, False])
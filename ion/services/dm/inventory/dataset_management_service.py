@@ -8,19 +8,43 @@ __license__ = 'Apache 2.0'
 
 
 from interface.services.dm.idataset_management_service import BaseDatasetManagementService
-from interface.objects import DataSet
+from interface.objects import DataSet, Coverage, StreamDefinitionContainer
 from pyon.datastore.datastore import DataStore
+from pyon.event.event import EventSubscriber
+from pyon.public import log
+from pyon.util.containers import get_ion_ts
+import copy
 
 class DatasetManagementService(BaseDatasetManagementService):
     def __init__(self, *args, **kwargs):
         super(DatasetManagementService, self).__init__(*args,**kwargs)
         self.logging_name = '(DatasetManagementService %s)' % (self.name or self.id)
+        # dataset_id -> {'bounds':{}, 'metadata':{}}, kept current from GranuleIngestedEvents
+        self.dataset_cache = {}
+        # dataset_id -> lists of the GranuleIngestedEvents received while the cache entry is loaded, one per loader
+        self.loading = {}
+        self.ingest_event_subscriber = None
+        self.dataset_event_subscriber = None
 
     def on_start(self):
         super(DatasetManagementService,self).on_start()
         self.datastore_name = self.CFG.get('process',{}).get('datastore_name','scidata')
         self.db = self.container.datastore_manager.get_datastore(self.datastore_name,DataStore.DS_PROFILE.SCIDATA)
 
+        self.ingest_event_subscriber = EventSubscriber(event_type="GranuleIngestedEvent", callback=self.granule_ingested_event_callback)
+        self.ingest_event_subscriber.activate()
+
+        # Datasets may be updated or deleted through other instances of this service
+        self.dataset_event_subscriber = EventSubscriber(event_type="ResourceModifiedEvent", origin_type="DataSet", callback=self.dataset_modified_event_callback)
+        self.dataset_event_subscriber.activate()
+
+    def on_quit(self):
+        if self.ingest_event_subscriber is not None:
+            self.ingest_event_subscriber.deactivate()
+        if self.dataset_event_subscriber is not None:
+            self.dataset_event_subscriber.deactivate()
+        super(DatasetManagementService,self).on_quit()
+
     """
     class docstring
     """
@@ -83,16 +107,20 @@ class DatasetManagementService(BaseDatasetManagementService):
         @throws NotFound if resource does not exist.
         """
         self.clients.resource_registry.delete(dataset_id)
+        self.dataset_cache.pop(dataset_id, None)
 
     def get_dataset_bounds(self, dataset_id=''):
-        """@brief Get the bounding coordinates of the dataset using a couch map/reduce query
+        """@brief Get the bounding coordinates of the dataset, loaded with a couch map/reduce query on first use and
+        maintained from GranuleIngestedEvents afterwards
         @param dataset_id
         @result bounds is a dictionary containing spatial and temporal bounds of the dataset in standard units
 
         @param dataset_id    str
         @retval bounds    Unknown
         """
-        dataset = self.read_dataset(dataset_id=dataset_id)
+        return copy.deepcopy(self._get_cache_entry(dataset_id)['bounds'])
+
+    def _query_bounds(self, dataset):
         key = dataset.primary_view_key # stream_id
         ar = gevent.event.AsyncResult()
         def ar_timeout(db):
@@ -114,16 +142,108 @@ class DatasetManagementService(BaseDatasetManagementService):
         return bounds
 
     def get_dataset_metadata(self, dataset_id=''):
-        """@brief Get the metadata for the dataset using a couch map/reduce query
+        """@brief Get the metadata for the dataset from the same cache as the bounds
         @param dataset_id
         @result the aggregated available metadata for the specified dataset
 
         @param dataset_id    str
         @retval metadata    Unknown
         """
-        dataset = self.read_dataset(dataset_id=dataset_id)
-        #@todo: Perform Query
-        return ''
+        return copy.deepcopy(self._get_cache_entry(dataset_id)['metadata'])
+
+    def _query_variables(self, dataset):
+        """
+        Lists the coverages of the stream definition stored with the dataset, they are the variables of its granules
+        """
+        db = self.container.datastore_manager.get_datastore(dataset.datastore_name)
+        opts = {'key':[dataset.primary_view_key,0], 'include_docs':True}
+        results = db.query_view('datasets/dataset_by_id',opts=opts)
+        if not results or not isinstance(results[0]['doc'], StreamDefinitionContainer):
+            return []
+        definition = results[0]['doc']
+        return sorted(key for key, value in definition.identifiables.iteritems() if isinstance(value, Coverage))
+
+    def _get_cache_entry(self, dataset_id):
+        """
+        Loads the bounds and metadata of a dataset on first use, afterwards they are maintained from ingestion events.
+        Events received while the datastore is queried are folded in once it returns, folding a granule that the query
+        already included does not change the entry.
+        """
+        entry = self.dataset_cache.get(dataset_id)
+        if entry is not None:
+            return entry
+
+        events = []
+        self.loading.setdefault(dataset_id, []).append(events)
+        try:
+            dataset = self.read_dataset(dataset_id=dataset_id)
+            entry = {
+                'bounds' : self._query_bounds(dataset),
+                'metadata' : {
+                    'dataset_id'     : dataset_id,
+                    'name'           : dataset.name,
+                    'description'    : dataset.description,
+                    'stream_id'      : dataset.primary_view_key,
+                    'datastore_name' : dataset.datastore_name,
+                    'variables'      : self._query_variables(dataset),
+                    'last_update'    : None
+                }
+            }
+        finally:
+            loaders = self.loading[dataset_id]
+            loaders.remove(events)
+            if not loaders:
+                del self.loading[dataset_id]
+
+        cached = True
+        for event in events:
+            cached = self._fold_event(entry, event) and cached
+        if cached:
+            self.dataset_cache[dataset_id] = entry
+        return entry
+
+    def granule_ingested_event_callback(self, event, headers):
+        """
+        Folds the bounds of a newly ingested granule into the cached bounds of its dataset
+        """
+        for events in self.loading.get(event.origin, []):
+            events.append(event)
+
+        entry = self.dataset_cache.get(event.origin)
+        if entry is None:
+            return # Loaded from the datastore, including this granule, when first requested
+
+        if not self._fold_event(entry, event):
+            # The ingestion worker did not report bounds, reload on the next request
+            log.debug('%s: invalidating cached bounds for %s', self.logging_name, event.origin)
+            self.dataset_cache.pop(event.origin, None)
+
+    def _fold_event(self, entry, event):
+        """
+        @return False when the event does not carry the bounds and the entry can not be kept up to date
+        """
+        attributes = event.ingest_attributes or {}
+        if not attributes.has_key('bounds'):
+            return False
+
+        bounds = entry['bounds']
+        for key, value_pair in attributes['bounds'].iteritems():
+            if key in bounds:
+                value_pair = [min(bounds[key][0], value_pair[0]), max(bounds[key][1], value_pair[1])]
+            bounds[key] = value_pair
+
+        metadata = entry['metadata']
+        for variable in attributes.get('variables', []):
+            if variable not in metadata['variables']:
+                metadata['variables'].append(variable)
+        metadata['last_update'] = get_ion_ts()
+        return True
+
+    def dataset_modified_event_callback(self, event, headers):
+        """
+        Evicts a dataset which was updated or deleted, possibly by another instance of this service
+        """
+        self.dataset_cache.pop(event.origin, None)
 
 
     def find_datasets(self, filters=None):
@@ -10,6 +10,7 @@ from ion.services.dm.inventory.dataset_management_service import DatasetManageme
 from prototype.sci_data.stream_defs import ctd_stream_packet
 from pyon.datastore.datastore import DataStore
 from pyon.util.containers import DotDict
+from mock import Mock
 from pyon.util.int_test import IonIntegrationTestCase
 from pyon.util.unit_test import PyonTestCase
 from nose.plugins.attrib import attr
@@ -61,6 +62,54 @@ class DatasetManagementTest(PyonTestCase):
         # assertions
         self.mock_rr_delete.assert_called_with('123')
 
+    def test_dataset_bounds_cache(self):
+        # mocks
+        mock_dataset = DotDict({'_id':'dataset_id', 'name':'dataset', 'description':'', 'primary_view_key':'stream_id', 'datastore_name':'scidata'})
+        self.mock_rr_read.return_value = mock_dataset
+        self.dataset_management._query_bounds = Mock()
+        self.dataset_management._query_bounds.return_value = {'time_bounds':[0,10]}
+        self.dataset_management._query_variables = Mock()
+        self.dataset_management._query_variables.return_value = ['pressure']
+
+        # execution
+        bounds = self.dataset_management.get_dataset_bounds('dataset_id')
+        event = DotDict({'origin':'dataset_id', 'ingest_attributes':{'variables':['temperature'], 'bounds':{'time_bounds':[5,20]}}})
+        self.dataset_management.granule_ingested_event_callback(event, {})
+        updated = self.dataset_management.get_dataset_bounds('dataset_id')
+        metadata = self.dataset_management.get_dataset_metadata('dataset_id')
+
+        # assertions
+        self.assertEquals(bounds, {'time_bounds':[0,10]})
+        self.assertEquals(updated, {'time_bounds':[0,20]})
+        self.assertEquals(metadata['variables'], ['pressure', 'temperature'])
+        self.assertEquals(metadata['stream_id'], 'stream_id')
+        self.assertEquals(self.dataset_management._query_bounds.call_count, 1)
+
+        # Deleting the dataset drops its cache entry
+        self.dataset_management.delete_dataset('dataset_id')
+        self.assertFalse(self.dataset_management.dataset_cache.has_key('dataset_id'))
+
+    def test_dataset_cache_events(self):
+        mock_dataset = DotDict({'_id':'dataset_id', 'name':'dataset', 'description':'', 'primary_view_key':'stream_id', 'datastore_name':'scidata'})
+        self.mock_rr_read.return_value = mock_dataset
+        self.dataset_management._query_variables = Mock()
+        self.dataset_management._query_variables.return_value = []
+
+        # A granule is ingested while the bounds are queried
+        event = DotDict({'origin':'dataset_id', 'ingest_attributes':{'variables':['temperature'], 'bounds':{'time_bounds':[5,20]}}})
+        def query_bounds(dataset):
+            self.dataset_management.granule_ingested_event_callback(event, {})
+            return {'time_bounds':[0,10]}
+        self.dataset_management._query_bounds = Mock()
+        self.dataset_management._query_bounds.side_effect = query_bounds
+
+        self.assertEquals(self.dataset_management.get_dataset_bounds('dataset_id'), {'time_bounds':[0,20]})
+        self.assertEquals(self.dataset_management.loading, {})
+
+        # Another instance of the service updated the dataset
+        self.dataset_management.dataset_modified_event_callback(DotDict({'origin':'dataset_id'}), {})
+        self.assertFalse(self.dataset_management.dataset_cache.has_key('dataset_id'))
+
 
 @attr('INT', group='dm')
 class DatasetManagementIntTest(IonIntegrationTestCase):
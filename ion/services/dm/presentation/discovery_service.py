@@ -16,24 +16,30 @@ from pyon.event.event import EventPublisher
 from pyon.core.bootstrap import get_obj_registry
 from pyon.core.object import IonObjectDeserializer
 from ion.services.dm.inventory.index_management_service import IndexManagementService
-from collections import deque
 from ion.services.dm.utility.query_language import QueryLanguage
+from ion.services.dm.utility.query_planner import QueryPlanner, ElasticSearchPool
+from ion.services.dm.utility.local_search import LocalSearchBackend
 
 import elasticpy as ep
 import heapq
 
 SEARCH_BUFFER_SIZE=1024
+TRAVERSAL_BATCH_SIZE=512 # Subjects per find_associations_mult call
 
 class DiscoveryService(BaseDiscoveryService):
 
     """
     class docstring
     """
+    local_search = None # In memory search backend used when ElasticSearch is disabled
 
     def on_start(self): # pragma: no cover
         super(DiscoveryService,self).on_start()
 
         self.use_es = CFG.get_safe('system.elasticsearch',False)
+        if not self.use_es and CFG.get_safe('system.local_search', False):
+            self.local_search = LocalSearchBackend(self.clients.resource_registry)
+            self.local_search.start()
 
         self.elasticsearch_host = CFG.get_safe('server.elasticsearch.host','localhost')
         self.elasticsearch_port = CFG.get_safe('server.elasticsearch.port','9200')
@@ -41,6 +47,11 @@ class DiscoveryService(BaseDiscoveryService):
         self.ep = EventPublisher(event_type = 'SearchBufferExceededEvent')
         self.heuristic_cutoff = 4
 
+    def on_quit(self): # pragma: no cover
+        if self.local_search is not None:
+            self.local_search.stop()
+        super(DiscoveryService,self).on_quit()
+
     #===================================================================
     # Views
     #===================================================================
@@ -167,60 +178,52 @@ class DiscoveryService(BaseDiscoveryService):
 #
 #        return db.query_view(view_name,opts=opts)
 
-    def traverse(self, resource_id=''):
+    def traverse(self, resource_id='', depth=0, limit=0, include_edges=False):
         """Breadth-first traversal of the association graph for a specified resource.
 
+        Each round queries the associations of the frontier only, the resources found for the first time
+        become the next frontier.
+
         @param resource_id    str
-        @retval resources    list
+        @param depth    int, number of hops to follow, 0 for the whole graph
+        @param limit    int, maximum number of resources to return, 0 for no limit
+        @param include_edges    bool, also return the (subject, predicate, object) of every association followed
+        @retval resources    list, or tuple of resources and edges when include_edges is set
         """
-        
-        def edges(resource_ids=[]):
-            return self.clients.resource_registry.find_associations_mult(subjects=resource_ids,id_only=True)[0]
-            
-        visited_resources = deque(edges([resource_id]))
-        traversal_queue = deque()
-        done = False
-        t = None
-        while not done:
-            t = traversal_queue or deque(visited_resources)
-            traversal_queue = deque()
-            for e in edges(t):
-                if not e in visited_resources:
-                    visited_resources.append(e)
-                    traversal_queue.append(e)
-            if not len(traversal_queue): done = True
-
-
-
-        return list(visited_resources)
+        visited = set()
+        resources = []
+        edges = []
+        frontier = [resource_id]
+        hops = 0
+        while frontier and (not depth or hops < depth):
+            next_frontier = []
+            for subjects in self._batches(frontier, TRAVERSAL_BATCH_SIZE):
+                object_ids, assocs = self.clients.resource_registry.find_associations_mult(subjects=subjects,id_only=True)
+                for object_id, assoc in zip(object_ids, assocs):
+                    if include_edges:
+                        edges.append((assoc.s, assoc.p, object_id))
+                    if object_id in visited:
+                        continue
+                    visited.add(object_id)
+                    resources.append(object_id)
+                    next_frontier.append(object_id)
+                    if limit and len(resources) >= limit:
+                        return (resources, edges) if include_edges else resources
+            frontier = next_frontier
+            hops += 1
+
+        return (resources, edges) if include_edges else resources
 
     def iterative_traverse(self, resource_id='', limit=-1):
         '''
-        Iterative breadth first traversal of the resource associations
+        Iterative breadth first traversal of the resource associations, limit is the number of hops past the first
         '''
-        #--------------------------------------------------------------------------------
-        # Retrieve edges for this resource
-        #--------------------------------------------------------------------------------
-        def edges(resource_ids=[]):
-            return self.clients.resource_registry.find_associations_mult(subjects=resource_ids,id_only=True)[0]
-            
-        gathered = deque()
-        visited_resources = deque(edges([resource_id]))
-        while limit>0:
-            t = gathered or deque(visited_resources)
-            for e in edges(t):
-                if not e in visited_resources:
-                    visited_resources.append(e)
-                    gathered.append(e)
-            if not len(gathered): break
-
-            t = deque(gathered)
-            gathered = deque()
-            limit -= 1
-
-        return list(visited_resources)
-            
+        return self.traverse(resource_id, depth=max(limit, 0) + 1)
 
+    @staticmethod
+    def _batches(ids, size):
+        for i in xrange(0, len(ids), size):
+            yield ids[i:i+size]
 
     def intersect(self, left=[], right=[]):
         """The intersection between two sets of resources.
@@ -274,6 +277,8 @@ class DiscoveryService(BaseDiscoveryService):
             )
             if query.get('depth'):
                 kwargs['depth'] = query['depth']
+            if limit:
+                kwargs['limit'] = limit
             return self.query_association(**kwargs)
         
         #---------------------------------------------
@@ -382,15 +387,14 @@ class DiscoveryService(BaseDiscoveryService):
         Elasticsearch Query against an index
         > discovery.query_index('indexID', 'name', '*', order={'name':'asc'}, limit=20, id_only=False)
         '''
-        if not self.use_es:
-            raise BadRequest('Can not make queries without ElasticSearch, enable system.elasticsearch to make queries.')
-
         validate_true(source_id, 'Unspecified source_id')
         validate_true(field, 'Unspecified field')
         validate_true(value, 'Unspecified value')
 
-
-        es = ep.ElasticSearch(host=self.elasticsearch_host, port=self.elasticsearch_port)
+        if not self.use_es:
+            if self.local_search is None:
+                raise BadRequest('Can not make queries without ElasticSearch, enable system.elasticsearch or system.local_search to make queries.')
+            return self.local_search.query_term(source_id, field, value, order=order, limit=limit, offset=offset, id_only=id_only)
 
         source = self.clients.resource_registry.read(source_id)
 
@@ -406,37 +410,22 @@ class DiscoveryService(BaseDiscoveryService):
         validate_is_instance(index, ElasticSearchIndex, '%s does not refer to a valid index.' % index)
         if order: 
             validate_is_instance(order,dict, 'Order is incorrect.')
-            es.sort(**order)
-
-        if limit:
-            es.size(limit)
-
-        if offset:
-            es.from_offset(offset)
-
-        if field == '*':
-            field = '_all'
-
-        query = ep.ElasticQuery().wildcard(field=field, value=value)
-        response = IndexManagementService._es_call(es.search_index_advanced,index.index_name,query)
-
-        IndexManagementService._check_response(response)
 
-        return self._results_from_response(response, id_only)
+        query = QueryPlanner.term(field, value)
+        return self._es_search(index.index_name, QueryPlanner.body(query, order=order, limit=limit, offset=offset), id_only)
 
     def query_range(self, source_id='', field='', from_value=None, to_value=None, order=None, limit=0, offset=0, id_only=False):
         
-        if not self.use_es:
-            raise BadRequest('Can not make queries without ElasticSearch, enable in res/config/pyon.yml')
-
         validate_true(not from_value is None, 'from_value not specified')
         validate_true(isinstance(from_value,int) or isinstance(from_value,float), 'from_value is not a valid number')
         validate_true(not to_value is None, 'to_value not specified')
         validate_true(isinstance(to_value,int) or isinstance(to_value,float), 'to_value is not a valid number')
         validate_true(source_id, 'source_id not specified')
 
-        es = ep.ElasticSearch(host=self.elasticsearch_host, port=self.elasticsearch_port)
-
+        if not self.use_es:
+            if self.local_search is None:
+                raise BadRequest('Can not make queries without ElasticSearch, enable in res/config/pyon.yml')
+            return self.local_search.query_range(source_id, field, from_value, to_value, order=order, limit=limit, offset=offset, id_only=id_only)
 
         source = self.clients.resource_registry.read(source_id)
 
@@ -451,33 +440,14 @@ class DiscoveryService(BaseDiscoveryService):
         validate_is_instance(index,ElasticSearchIndex,'%s does not refer to a valid index.' % source_id)
         if order:
             validate_is_instance(order,dict,'Order is incorrect.')
-            es.sort(**order)
-
-        if limit:
-            es.size(limit)
-
-        if field == '*':
-            field = '_all'
 
-        query = ep.ElasticQuery().range(
-            field      = field,
-            from_value = from_value,
-            to_value   = to_value
-        )
+        query = QueryPlanner.range(field, from_value, to_value)
+        return self._es_search(index.index_name, QueryPlanner.body(query, order=order, limit=limit, offset=offset), id_only)
 
-        response = IndexManagementService._es_call(es.search_index_advanced,index.index_name,query)
-
-        IndexManagementService._check_response(response)
 
-        return self._results_from_response(response, id_only)
-
-
-    def query_association(self,resource_id='', depth=0, id_only=False):
+    def query_association(self,resource_id='', depth=0, id_only=False, limit=0):
         validate_true(resource_id, 'Unspecified resource')
-        if depth:
-            resource_ids = self.iterative_traverse(resource_id, depth-1)
-        else:
-            resource_ids = self.traverse(resource_id)
+        resource_ids = self.traverse(resource_id, depth=depth, limit=limit)
         if id_only:
             return resource_ids
 
@@ -499,50 +469,25 @@ class DiscoveryService(BaseDiscoveryService):
         validate_true(len(origin)==2, 'Origin is not of the right size: (2)')
 
         if not self.use_es:
-            raise BadRequest('Can not make queries without ElasticSearch, enable in res/config/pyon.yml')
+            if self.local_search is None:
+                raise BadRequest('Can not make queries without ElasticSearch, enable in res/config/pyon.yml')
+            return self.local_search.query_geo_distance(source_id, field, origin, distance, units, order=order, limit=limit, offset=offset, id_only=id_only)
 
-        es = ep.ElasticSearch(host=self.elasticsearch_host, port=self.elasticsearch_port)
         source = self.clients.resource_registry.read(source_id)
 
-        iterate = self._multi(self.query_geo_distance, source=source, field=field, origin=origin, distance=distance) 
+        iterate = self._multi(self.query_geo_distance, source=source, field=field, origin=origin, distance=distance, units=units, order=order, limit=limit, offset=offset, id_only=id_only)
         if iterate is not None:
             return iterate
 
         index = source
         validate_is_instance(index,ElasticSearchIndex, '%s does not refer to a valid index.' % index)
+        if not isinstance(order,dict):
+            order = None
 
-        sorts = ep.ElasticSort()
-        if order is not None and isinstance(order,dict):
-            sort_field = order.keys()[0]
-            value = order[sort_field]
-            sorts.sort(sort_field,value)
-            es.sorted(sorts)
-
-        if limit:
-            es.size(limit)
-
-        if offset:
-            es.from_offset(offset)
-
-        if field == '*':
-            field = '_all'
-
-
-        sorts.geo_distance(field, origin, units)
-
-        es.sorted(sorts)
-
-        filter = ep.ElasticFilter()
-        filter.geo_distance(field,origin, '%s%s' %(distance,units))
-
-        es.filtered(filter)
-
-        query = ep.ElasticQuery().match_all()
-
-        response = IndexManagementService._es_call(es.search_index_advanced,index.index_name,query)
-        IndexManagementService._check_response(response)
-
-        return self._results_from_response(response,id_only)
+        # Nearest first after any explicit ordering
+        sort = [{'_geo_distance' : {QueryPlanner._field(field) : list(origin), 'order' : 'asc', 'unit' : units}}]
+        query = QueryPlanner.filtered(QueryPlanner.geo_distance(field, origin, distance, units))
+        return self._es_search(index.index_name, QueryPlanner.body(query, order=order, limit=limit, offset=offset, sort=sort), id_only)
 
 
     def query_geo_bbox(self, source_id='', field='', top_left=None, bottom_right=None, order=None, limit=0, offset=0, id_only=False):
@@ -552,9 +497,10 @@ class DiscoveryService(BaseDiscoveryService):
         validate_true(len(bottom_right)==2, 'Bottom Right is not of the right size: (2)')
 
         if not self.use_es:
-            raise BadRequest('Can not make queries without ElasticSearch, enable in res/config/pyon.yml')
+            if self.local_search is None:
+                raise BadRequest('Can not make queries without ElasticSearch, enable in res/config/pyon.yml')
+            return self.local_search.query_geo_bbox(source_id, field, top_left, bottom_right, order=order, limit=limit, offset=offset, id_only=id_only)
 
-        es = ep.ElasticSearch(host=self.elasticsearch_host, port=self.elasticsearch_port)
         source = self.clients.resource_registry.read(source_id)
 
         iterate = self._multi(self.query_geo_bbox, source=source, field=field, top_left=top_left, bottom_right=bottom_right, order=order, limit=limit, offset=offset, id_only=id_only)
@@ -563,35 +509,20 @@ class DiscoveryService(BaseDiscoveryService):
 
         index = source
         validate_is_instance(index,ElasticSearchIndex, '%s does not refer to a valid index.' % index)
+        if not isinstance(order,dict):
+            order = None
 
-        sorts = ep.ElasticSort()
-        if order is not None and isinstance(order,dict):
-            sort_field = order.keys()[0]
-            value = order[sort_field]
-            sorts.sort(sort_field,value)
-            es.sorted(sorts)
-
-        if limit:
-            es.size(limit)
+        query = QueryPlanner.filtered(QueryPlanner.geo_bbox(field, top_left, bottom_right))
+        return self._es_search(index.index_name, QueryPlanner.body(query, order=order, limit=limit, offset=offset), id_only)
 
-        if offset:
-            es.from_offset(offset)
-
-        if field == '*':
-            field = '_all'
-
-
-        filter = ep.ElasticFilter()
-        filter.geo_bounding_box(field, top_left, bottom_right)
-
-        es.filtered(filter)
-
-        query = ep.ElasticQuery().match_all()
-
-        response = IndexManagementService._es_call(es.search_index_advanced,index.index_name,query)
+    def _es_search(self, index_name, body, id_only):
+        '''
+        Runs a search body against an index over the pooled connection to the ElasticSearch host
+        '''
+        es = ElasticSearchPool.get(self.elasticsearch_host, self.elasticsearch_port)
+        response = IndexManagementService._es_call(es.search, index_name, body)
         IndexManagementService._check_response(response)
-
-        return self._results_from_response(response,id_only)
+        return self._results_from_response(response, id_only)
 
         
 
@@ -628,8 +559,6 @@ class DiscoveryService(BaseDiscoveryService):
         if not (query.has_key('query') and query.has_key('and') and query.has_key('or')):
             raise BadRequest('Improper query request: %s' % query)
 
-        query_queue = list()
-
         query = DotDict(query)
         #================================================
         # Tier-1 Query
@@ -638,13 +567,69 @@ class DiscoveryService(BaseDiscoveryService):
         if not (query['or'] or query['and']): # Tier-1
             return self.query_request(query.query)
 
-        #@todo: bulk requests against ES
-        #@todo: filters
-
         #================================================
         # Tier-2 Query
         #================================================
-        
+        clauses = [query.query] + list(query['and'])
+        search_and = [q for q in clauses if QueryPlanner.is_search_clause(q)]
+        search_or = [q for q in query['or'] if QueryPlanner.is_search_clause(q)]
+        other_and = [q for q in clauses if not QueryPlanner.is_search_clause(q)]
+        other_or = [q for q in query['or'] if not QueryPlanner.is_search_clause(q)]
+
+        index_name = self._common_index(search_and + search_or)
+        if index_name is None:
+            return self._request_sets(query, id_only)
+
+        #------------------------------------------------
+        # Everything is in one index: a single bool query
+        #------------------------------------------------
+        if not (other_and or other_or):
+            paging = QueryPlanner.paging(query.query)
+            paging.setdefault('limit', SEARCH_BUFFER_SIZE)
+            body = QueryPlanner.body(QueryPlanner.compile_bool(search_and, search_or), **paging)
+            return self._es_search(index_name, body, id_only)
+
+        #------------------------------------------------
+        # Association and collection clauses are resolved
+        # with set operations against the compiled queries
+        #------------------------------------------------
+        results = None
+        if search_and:
+            results = self._es_search(index_name, QueryPlanner.body(QueryPlanner.compile_bool(search_and), limit=SEARCH_BUFFER_SIZE), True)
+        for q in other_and:
+            resource_ids = self.query_request(q, limit=SEARCH_BUFFER_SIZE, id_only=True)
+            results = resource_ids if results is None else self.intersect(results, resource_ids)
+        if search_or:
+            results = self.union(results, self._es_search(index_name, QueryPlanner.body(QueryPlanner.compile_bool(should=search_or), limit=SEARCH_BUFFER_SIZE), True))
+        for q in other_or:
+            results = self.union(results, self.query_request(q, limit=SEARCH_BUFFER_SIZE, id_only=True))
+
+        if id_only:
+            return results
+
+        return self.clients.resource_registry.read_mult(results)
+
+    def _common_index(self, clauses):
+        '''
+        Name of the ElasticSearch index every clause searches, None if they span views, catalogs or several indexes
+        '''
+        if not (self.use_es and clauses):
+            return None
+        index_names = set()
+        for source_name in set(q['index'] for q in clauses):
+            source = self.clients.resource_registry.read(self._match_query_sources(source_name) or source_name)
+            if not isinstance(source, ElasticSearchIndex):
+                return None
+            index_names.add(source.index_name)
+        if len(index_names) != 1:
+            return None
+        return index_names.pop()
+
+    def _request_sets(self, query, id_only):
+        '''
+        Runs every clause of the request separately and combines the results client side
+        '''
+        query_queue = list()
         query_queue.append(self.query_request(query.query,limit=SEARCH_BUFFER_SIZE, id_only=True))
         
         #==================
@@ -671,9 +656,6 @@ class DiscoveryService(BaseDiscoveryService):
         objects = self.clients.resource_registry.read_mult(query_queue[0])
         return objects
 
-
-
-
     def raise_search_buffer_exceeded(self):
         self.ep.publish_event(origin='Discovery Service', description='Search buffer was exceeded, results may not contain all the possible results.')
 
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/presentation/mail_delivery.py
+@description Outbound mail for the UserNotificationService
+
+Event callbacks hand their messages to a MailQueue and return, worker greenlets send them over a bounded pool of
+SMTP connections which are kept open between messages and reconnected when the server drops them. Messages for a
+digest are held per key, one email holding all of them is queued when the digest period ends.
+'''
+
+from email.mime.text import MIMEText
+import smtplib
+import socket
+import string
+
+import gevent
+from gevent.coros import BoundedSemaphore
+from gevent.queue import Queue
+
+from pyon.public import CFG
+from pyon.util.log import log
+
+# the default smtp server
+ION_SMTP_SERVER = 'mail.oceanobservatories.org'
+
+
+class fake_smtplib(object):
+    '''
+    Stands in for smtplib when system.smtp is off, the mail sent is kept in the sentmail queue of the connection.
+    '''
+    def __init__(self,host,sentmail=None):
+        self.host = host
+        self.sentmail = Queue() if sentmail is None else sentmail
+
+    @classmethod
+    def SMTP(cls,host,port=None):
+        log.info("In fake_smptplib.SMTP method call. class: %s, host: %s" % (str(cls), str(host)))
+        return cls(host)
+
+    @classmethod
+    def mailbox(cls):
+        '''
+        @return a fake_smtplib whose connections all keep their mail in one new sentmail queue, one per mail queue
+        '''
+        sentmail = Queue()
+        class mailbox(cls):
+            def __init__(self, host):
+                super(mailbox, self).__init__(host, sentmail)
+        return mailbox
+
+    def sendmail(self, msg_sender, msg_recipient, msg):
+        log.info('Sending fake message from: %s, to: "%s"' % (msg_sender,  msg_recipient))
+        self.sentmail.put((msg_sender, msg_recipient, msg))
+
+    def ehlo(self):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def compose(msg_sender, msg_recipient, msg_subject, msg_body):
+    msg = MIMEText(msg_body)
+    msg['Subject'] = msg_subject
+    msg['From'] = msg_sender
+    msg['To'] = msg_recipient
+    return msg.as_string()
+
+
+class SMTPConnectionPool(object):
+    '''
+    At most size connections to one SMTP server, idle connections are reused.
+    '''
+    def __init__(self, host, port=25, sender=None, password=None, starttls=False, size=2, smtp=smtplib):
+        '''
+        @param smtp the module providing SMTP, smtplib or fake_smtplib
+        '''
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.password = password
+        self.starttls = starttls
+        self.smtp = smtp
+        self._idle = []
+        self._slots = BoundedSemaphore(size)
+
+    def _connect(self):
+        client = self.smtp.SMTP(self.host, self.port)
+        if self.starttls:
+            client.ehlo()
+            client.starttls()
+            client.ehlo()
+        if self.password:
+            client.login(self.sender, self.password)
+        return client
+
+    @staticmethod
+    def _close(client):
+        try:
+            client.quit()
+        except (smtplib.SMTPException, socket.error):
+            client.close()
+
+    def sendmail(self, msg_sender, msg_recipient, msg):
+        with self._slots:
+            if self._idle:
+                client, reused = self._idle.pop(), True
+            else:
+                client, reused = self._connect(), False
+            try:
+                client.sendmail(msg_sender, msg_recipient, msg)
+            except (smtplib.SMTPServerDisconnected, socket.error):
+                client.close()
+                if not reused:
+                    raise
+                # The server dropped the idle connection
+                log.debug('Reconnecting to the SMTP server %s', self.host)
+                client = self._connect()
+                try:
+                    client.sendmail(msg_sender, msg_recipient, msg)
+                except:
+                    client.close()
+                    raise
+            except:
+                client.close()
+                raise
+            self._idle.append(client)
+
+    def close(self):
+        while self._idle:
+            self._close(self._idle.pop())
+
+
+class MailQueue(object):
+    '''
+    Asynchronous delivery of emails through an SMTPConnectionPool.
+    '''
+    def __init__(self, pool, workers=2):
+        self.pool = pool
+        self.workers = workers
+        self._queue = Queue()
+        self._greenlets = []
+        self._digests = {}
+
+    @classmethod
+    def from_config(cls):
+        smtp_host = CFG.get_safe('server.smtp.host', ION_SMTP_SERVER)
+        smtp_port = CFG.get_safe('server.smtp.port', 25)
+
+        log.info('smtp_host: %s' % str(smtp_host))
+        log.info('smtp_port: %s' % str(smtp_port))
+
+        if CFG.get_safe('system.smtp',False): #Default is False - use the fake_smtp
+            log.warning('Using the real SMTP library to send email notifications!')
+            smtp = smtplib
+        else:
+            # Keep this as a warning
+            log.warning('Using a fake SMTP library to simulate email notifications!')
+            smtp = fake_smtplib.mailbox()
+
+        # Turn starttls off to send to a local test server, e.g. python -m smtpd -n -c DebuggingServer localhost:1025
+        pool = SMTPConnectionPool(smtp_host, smtp_port,
+            sender=CFG.get_safe('server.smtp.sender'),
+            password=CFG.get_safe('server.smtp.password'),
+            starttls=CFG.get_safe('server.smtp.starttls', smtp is smtplib),
+            size=CFG.get_safe('server.smtp.pool_size', 2),
+            smtp=smtp)
+        return cls(pool, workers=CFG.get_safe('server.smtp.workers', 2))
+
+    def start(self):
+        self._greenlets = [gevent.spawn(self._work) for i in xrange(self.workers)]
+
+    def stop(self, timeout=10):
+        '''
+        @brief Sends the pending digests and queued mail, then stops the workers
+        '''
+        for key in self._digests.keys():
+            self.flush(key)
+        for greenlet in self._greenlets:
+            self._queue.put(StopIteration)
+        gevent.joinall(self._greenlets, timeout=timeout)
+        gevent.killall(self._greenlets)
+        self._greenlets = []
+        self.pool.close()
+
+    def _work(self):
+        for msg_sender, msg_recipient, msg in self._queue:
+            try:
+                self.pool.sendmail(msg_sender, msg_recipient, msg)
+            except Exception:
+                log.exception('Failed to send email to %s', msg_recipient)
+
+    def send(self, msg_sender, msg_recipient, msg_subject, msg_body, envelope_sender=None):
+        '''
+        @param envelope_sender the SMTP sender if different from the From header
+        '''
+        self._queue.put((envelope_sender or msg_sender, msg_recipient, compose(msg_sender, msg_recipient, msg_subject, msg_body)))
+
+    def digest(self, key, period, msg_sender, msg_recipient, msg_subject, msg_body, envelope_sender=None):
+        '''
+        @brief Holds the message in the digest for key, the digest is sent period seconds after its first message
+        '''
+        if key not in self._digests:
+            timer = gevent.spawn_later(period, self.flush, key)
+            self._digests[key] = (timer, envelope_sender or msg_sender, msg_sender, msg_recipient, [])
+        self._digests[key][4].append((msg_subject, msg_body))
+
+    def flush(self, key):
+        entry = self._digests.pop(key, None)
+        if entry is None:
+            return
+        timer, envelope_sender, msg_sender, msg_recipient, messages = entry
+        if timer is not gevent.getcurrent():
+            timer.kill(block=False)
+
+        if len(messages) == 1:
+            msg_subject, msg_body = messages[0]
+        else:
+            msg_subject = "ION notification digest: %d events" % len(messages)
+            msg_body = string.join([subject + "\r\n\r\n" + body for subject, body in messages], "\r\n\r\n" + "-" * 40 + "\r\n\r\n")
+        self._queue.put((envelope_sender, msg_recipient, compose(msg_sender, msg_recipient, msg_subject, msg_body)))
@@ -113,13 +113,13 @@ class DiscoveryUnitTest(PyonTestCase):
         self.assertTrue(retval[0] == 'test')
 
 
-    @patch('ion.services.dm.presentation.discovery_service.ep.ElasticSearch')
+    @patch('ion.services.dm.presentation.discovery_service.ElasticSearchPool')
     def test_query_index(self, es_mock):
         mock_index = ElasticSearchIndex(content_type=IndexManagementService.ELASTICSEARCH_INDEX)
         self.rr_read.return_value = mock_index
         self.discovery.elasticsearch_host = 'fakehost'
         self.discovery.elasticsearch_port = 'fakeport'
-        es_mock().search_index_advanced.return_value = {'hits':{'hits':[{'_id':'success'}]}}
+        es_mock.get().search.return_value = {'hits':{'hits':[{'_id':'success'}]}}
 
         retval = self.discovery.query_term('mock_index', 'field', 'value', order={'name':'asc'}, limit=20, offset=20)
 
@@ -134,21 +134,44 @@ class DiscoveryUnitTest(PyonTestCase):
         pass
         
 
-    @skip('Needs to be adjusted for new traversal')
+    def _mock_graph(self, graph):
+        calls = []
+        def find_associations_mult(subjects=None, id_only=False):
+            calls.append(list(subjects))
+            object_ids, assocs = [], []
+            for subject in subjects:
+                for predicate, object_id in graph.get(subject, []):
+                    object_ids.append(object_id)
+                    assocs.append(DotDict(s=subject, p=predicate, o=object_id))
+            return object_ids, assocs
+        self.rr_find_assocs_mult.side_effect = find_associations_mult
+        return calls
+
     def test_traverse(self):
-        edge_list = ['B','C','D']
-        callers = []
-        def pop_edge(*args, **kwargs):
-            callers.append(args[0])
-            if len(edge_list):
-                val = edge_list.pop(0)
-                return [val], 'blah'
-            return [], 'blah'
-        self.rr_find_obj.side_effect = pop_edge
+        calls = self._mock_graph({
+            'A' : [('hasB', 'B'), ('hasC', 'C')],
+            'B' : [('hasD', 'D')],
+            'C' : [('hasD', 'D'), ('hasA', 'A')],
+            'D' : [('hasB', 'B')],
+        })
 
         retval = self.discovery.traverse('A')
-        retval.sort()
-        self.assertTrue(retval == ['B','C','D'], '%s' % retval)
+        self.assertEquals(retval, ['B','C','D','A'])
+        # Only the frontier is queried each round
+        self.assertEquals(calls, [['A'], ['B','C'], ['D','A']])
+
+        retval = self.discovery.traverse('A', depth=1)
+        self.assertEquals(retval, ['B','C'])
+
+        retval = self.discovery.traverse('A', limit=3)
+        self.assertEquals(retval, ['B','C','D'])
+
+        retval, edges = self.discovery.traverse('A', depth=2, include_edges=True)
+        self.assertEquals(retval, ['B','C','D','A'])
+        self.assertEquals(edges, [('A','hasB','B'), ('A','hasC','C'), ('B','hasD','D'), ('C','hasD','D'), ('C','hasA','A')])
+
+        self.assertEquals(self.discovery.iterative_traverse('A'), ['B','C'])
+        self.assertEquals(self.discovery.iterative_traverse('A', 1), ['B','C','D','A'])
 
     def test_intersect(self):
         test_vals = [0,1,2,3]
@@ -222,18 +245,18 @@ class DiscoveryUnitTest(PyonTestCase):
         with self.assertRaises(BadRequest):
             self.discovery.query_request(query)
     
-    @patch('ion.services.dm.presentation.discovery_service.ep.ElasticSearch')
+    @patch('ion.services.dm.presentation.discovery_service.ElasticSearchPool')
     def test_query_range(self, mock_es):
         mock_index = ElasticSearchIndex(name='index', index_name='index')
         self.discovery.elasticsearch_host = 'fakehost'
         self.discovery.elasticsearch_port = 'fakeport'
         self.rr_read.return_value = mock_index
         hits = [{'_id':'a'},{'_id':'b'}]
-        mock_es().search_index_advanced.return_value = {'hits':{'hits':hits}}
+        mock_es.get().search.return_value = {'hits':{'hits':hits}}
 
         retval = self.discovery.query_range('index_id','field',0,100,id_only=False)
 
-        mock_es().search_index_advanced.assert_called_once_with('index',ep.ElasticQuery().range(field='field', from_value=0, to_value=100))
+        mock_es.get().search.assert_called_once_with('index',{'query':{'range':{'field':{'from':0, 'to':100}}}})
         retval.sort()
         self.assertTrue(retval==hits, '%s' % retval)
         
@@ -241,6 +264,46 @@ class DiscoveryUnitTest(PyonTestCase):
         retval.sort()
         self.assertTrue(retval==['a','b'])
 
+    @patch('ion.services.dm.presentation.discovery_service.ElasticSearchPool')
+    def test_request_single_query(self, mock_es):
+        self.rr_read.return_value = ElasticSearchIndex(name='index', index_name='index')
+        self.discovery._match_query_sources = Mock(return_value=None)
+        mock_es.get().search.return_value = {'hits':{'hits':[{'_id':'a'}]}}
+
+        query = {
+            'query' : {'index':'index', 'field':'name', 'value':'ctd*', 'limit':5, 'order':{'name':'asc'}},
+            'and'   : [{'index':'index', 'field':'temp', 'range':{'from':0, 'to':10}}],
+            'or'    : [{'index':'index', 'field':'name', 'value':'glider*'}],
+        }
+        retval = self.discovery.request(query)
+        self.assertEquals(retval, ['a'])
+
+        body = {
+            'query' : {'bool' : {'should' : [
+                {'bool' : {'must' : [{'wildcard':{'name':'ctd*'}}, {'range':{'temp':{'from':0, 'to':10}}}]}},
+                {'wildcard':{'name':'glider*'}}],
+                'minimum_number_should_match' : 1}},
+            'sort'  : [{'name':{'order':'asc'}}],
+            'size'  : 5,
+        }
+        mock_es.get().search.assert_called_once_with('index', body)
+
+    @patch('ion.services.dm.presentation.discovery_service.ElasticSearchPool')
+    def test_request_association_clause(self, mock_es):
+        self.rr_read.return_value = ElasticSearchIndex(name='index', index_name='index')
+        self.discovery._match_query_sources = Mock(return_value=None)
+        mock_es.get().search.return_value = {'hits':{'hits':[{'_id':'a'}, {'_id':'b'}]}}
+        self.discovery.query_association = Mock(return_value=['b', 'c'])
+
+        query = {
+            'query' : {'index':'index', 'field':'name', 'value':'ctd*'},
+            'and'   : [{'association':'resource_id'}],
+            'or'    : [],
+        }
+        retval = self.discovery.request(query)
+        self.assertEquals(retval, ['b'])
+        self.assertEquals(mock_es.get().search.call_count, 1)
+
     @skip('Needs to be adjusted for changes in association traversal')
     def test_query_association(self):
         self.discovery.traverse = Mock()
@@ -317,7 +380,7 @@ class DiscoveryUnitTest(PyonTestCase):
             with self.assertRaises(BadRequest):
                 self.discovery.request(req)
 
-    @patch('ion.services.dm.presentation.discovery_service.ep.ElasticSearch')
+    @patch('ion.services.dm.presentation.discovery_service.ElasticSearchPool')
     def test_view_request(self, mock_es):
         self.call_count = 0
         def cb(*args, **kwargs):
@@ -354,7 +417,7 @@ class DiscoveryUnitTest(PyonTestCase):
         retval = self.discovery.query_term('blah', 'field', 'value')
         self.assertTrue(retval == 'test')
 
-    @patch('ion.services.dm.presentation.discovery_service.ep.ElasticSearch')
+    @patch('ion.services.dm.presentation.discovery_service.ElasticSearchPool')
     def test_query_geo_distance(self, mock_es):
         self.rr_read.return_value = ElasticSearchIndex(name='test')
         self.discovery.elasticsearch_host = ''
@@ -362,13 +425,13 @@ class DiscoveryUnitTest(PyonTestCase):
         self.discovery._multi = Mock()
         self.discovery._multi.return_value = None
         response = {'ok':True, 'status':200, 'hits':{'hits':['hi']}}
-        mock_es().search_index_advanced.return_value = response
+        mock_es.get().search.return_value = response
 
         retval = self.discovery.query_geo_distance('abc13', 'blah', [0,0], 20)
 
         self.assertTrue(retval == ['hi'])
 
-    @patch('ion.services.dm.presentation.discovery_service.ep.ElasticSearch')
+    @patch('ion.services.dm.presentation.discovery_service.ElasticSearchPool')
     def test_query_geo_bbox(self, mock_es):
         self.rr_read.return_value = ElasticSearchIndex(name='test')
         self.discovery.elasticsearch_host = ''
@@ -376,7 +439,7 @@ class DiscoveryUnitTest(PyonTestCase):
         self.discovery._multi = Mock()
         self.discovery._multi.return_value = None
         response = {'ok':True, 'status':200, 'hits':{'hits':['hi']}}
-        mock_es().search_index_advanced.return_value = response
+        mock_es.get().search.return_value = response
 
         retval = self.discovery.query_geo_bbox('abc123', 'blah', [0,10], [10,0])
 
@@ -0,0 +1,77 @@
+'''
+@file ion/services/dm/presentation/test/mail_delivery_test.py
+@description Unit tests for the SMTP connection pool and mail queue of the UserNotificationService
+'''
+import smtplib
+
+from mock import Mock
+from nose.plugins.attrib import attr
+
+from pyon.util.unit_test import PyonTestCase
+from ion.services.dm.presentation.mail_delivery import SMTPConnectionPool, MailQueue, fake_smtplib
+
+
+@attr('UNIT',group='dm')
+class MailDeliveryTest(PyonTestCase):
+
+    def setUp(self):
+        smtp = fake_smtplib.mailbox()
+        self.pool = SMTPConnectionPool('smtp_server', smtp=smtp)
+        self.sentmail = smtp.SMTP('smtp_server').sentmail
+
+    def test_pool_reconnect(self):
+        smtp = Mock()
+        stale, fresh = Mock(), Mock()
+        stale.sendmail.side_effect = smtplib.SMTPServerDisconnected()
+        smtp.SMTP.return_value = fresh
+
+        pool = SMTPConnectionPool('host', sender='sender', password='password', starttls=True, smtp=smtp)
+        pool._idle.append(stale)
+        pool.sendmail('from', 'to', 'msg')
+
+        fresh.starttls.assert_called_once_with()
+        fresh.login.assert_called_once_with('sender', 'password')
+        fresh.sendmail.assert_called_once_with('from', 'to', 'msg')
+        self.assertEquals(pool._idle, [fresh])
+
+        # The connection is reused
+        pool.sendmail('from', 'to', 'msg2')
+        self.assertEquals(fresh.sendmail.call_count, 2)
+        self.assertEquals(smtp.SMTP.call_count, 1)
+
+    def test_queue(self):
+        queue = MailQueue(self.pool)
+        queue.start()
+        queue.send('from', 'to', 'subject', 'body', envelope_sender='envelope')
+
+        msg_sender, msg_recipient, msg = self.sentmail.get(timeout=2)
+        self.assertEquals((msg_sender, msg_recipient), ('envelope', 'to'))
+        self.assertIn('Subject: subject', msg)
+        queue.stop()
+
+    def test_digest(self):
+        queue = MailQueue(self.pool)
+        queue.start()
+        queue.digest('user', 0.1, 'from', 'to', 'first', 'first body')
+        queue.digest('user', 0.1, 'from', 'to', 'second', 'second body')
+        queue.digest('other', 0.1, 'from', 'other', 'third', 'third body')
+
+        sent = dict((msg_recipient, msg) for _, msg_recipient, msg in (self.sentmail.get(timeout=2), self.sentmail.get(timeout=2)))
+        self.assertIn('Subject: ION notification digest: 2 events', sent['to'])
+        self.assertIn('second body', sent['to'])
+        self.assertIn('Subject: third', sent['other'])
+
+        # Pending digests are sent on stop
+        queue.digest('user', 100, 'from', 'to', 'fourth', 'fourth body')
+        queue.stop()
+        self.assertIn('Subject: fourth', self.sentmail.get(timeout=2)[2])
+        self.assertTrue(self.sentmail.empty())
+
+    def test_mailbox_per_queue(self):
+        other = SMTPConnectionPool('smtp_server', smtp=fake_smtplib.mailbox())
+        other.sendmail('sender', 'other', 'msg')
+        self.pool.sendmail('sender', 'recipient', 'msg')
+
+        self.assertEquals(self.sentmail.get(timeout=2)[1], 'recipient')
+        self.assertTrue(self.sentmail.empty())
+        self.assertEquals(other.smtp.SMTP('smtp_server').sentmail.get(timeout=2)[1], 'other')
@@ -8,7 +8,7 @@
 from interface.services.coi.iidentity_management_service import IdentityManagementServiceClient
 from interface.services.coi.iresource_registry_service import ResourceRegistryServiceClient
 from interface.services.dm.iuser_notification_service import UserNotificationServiceClient
-from ion.services.dm.presentation.user_notification_service import UserNotificationService
+from ion.services.dm.presentation.user_notification_service import UserNotificationService, NotificationSubscriptions, DetectionEventProcessor
 from interface.objects import DeliveryMode, UserInfo, DeliveryConfig, DetectionFilterConfig
 from pyon.util.int_test import IonIntegrationTestCase
 from pyon.util.unit_test import PyonTestCase
@@ -19,7 +19,7 @@ import unittest
 from pyon.util.log import log
 from pyon.event.event import EventPublisher
 import gevent
-from mock import Mock, mocksignature
+from mock import Mock, mocksignature, patch
 from interface.objects import NotificationRequest, NotificationType, ExampleDetectableEvent
 from ion.services.dm.presentation.discovery_service import QueryLanguage
 from ion.services.dm.utility.query_language import QueryLanguage
@@ -446,6 +446,62 @@ class UserNotificationTest(PyonTestCase):
 
         self.assertEquals(res, notification_id)
 
+    @patch('ion.services.dm.presentation.user_notification_service.EventSubscriber')
+    def test_shared_subscriptions(self, subscriber_class):
+
+        subscriber_class.side_effect = lambda **kwargs: Mock()
+        subscriptions = NotificationSubscriptions()
+
+        def make_request(origin, event_subtype=None):
+            return NotificationRequest(origin=origin, origin_type='origin_type', event_type='ExampleDetectableEvent', event_subtype=event_subtype)
+
+        def make_processor(request):
+            processor = Mock()
+            processor.notification._res_obj = request
+            return processor
+
+        #------------------------------------------------------------------------------------------------------
+        # Notifications on the same event type and origin share one subscriber
+        #------------------------------------------------------------------------------------------------------
+
+        request_1, request_2, request_3 = make_request('origin'), make_request('origin', 'sub_type'), make_request('other')
+        processor_1, processor_2, processor_3 = make_processor(request_1), make_processor(request_2), make_processor(request_3)
+        subscriptions.add(processor_1, request_1)
+        subscriptions.add(processor_2, request_2)
+        subscriptions.add(processor_3, request_3)
+        self.assertEquals(subscriber_class.call_count, 2)
+
+        detector = DetectionEventProcessor.__new__(DetectionEventProcessor)
+        detector.notification = Mock()
+        detector.notification._res_obj = request_1
+        detector.generate_event = Mock()
+        detector.query_dict = QueryLanguage().parse("SEARCH 'voltage' VALUES FROM 5 TO 10 FROM 'index'")
+        subscriptions.add(detector, request_1)
+        self.assertEquals(subscriber_class.call_count, 2)
+
+        #------------------------------------------------------------------------------------------------------
+        # An event goes to the processors on its subscriber which want its sub type
+        #------------------------------------------------------------------------------------------------------
+
+        event = ExampleDetectableEvent('TestEvent', voltage=6)
+        subscriptions._dispatch(('ExampleDetectableEvent', 'origin', 'origin_type'), event, {})
+        processor_1.subscription_callback.assert_called_once_with(event, {})
+        self.assertFalse(processor_2.subscription_callback.called)
+        self.assertFalse(processor_3.subscription_callback.called)
+        detector.generate_event.assert_called_once_with(event)
+
+        #------------------------------------------------------------------------------------------------------
+        # The subscriber is deactivated with its last notification
+        #------------------------------------------------------------------------------------------------------
+
+        subscriber = subscriptions.subscribers[('ExampleDetectableEvent', 'origin', 'origin_type')]
+        subscriptions.remove(processor_1, request_1)
+        subscriptions.remove(processor_2, request_2)
+        self.assertFalse(subscriber.deactivate.called)
+        subscriptions.remove(detector, request_1)
+        self.assertTrue(subscriber.deactivate.called)
+        self.assertEquals(subscriptions.subscribers.keys(), [('ExampleDetectableEvent', 'other', 'origin_type')])
+
     def test_update_user_notification(self):
         pass
         #@todo implement test for update
@@ -15,40 +15,24 @@ from pyon.util.log import log
 from pyon.util.containers import DotDict
 from pyon.event.event import EventPublisher
 from ion.services.dm.utility.query_language import QueryLanguage
+from ion.services.dm.utility.query_dispatcher import QueryDispatcher
 
 import string
 import time
-import gevent
 from gevent.timeout import Timeout
 from datetime import datetime
-from email.mime.text import MIMEText
 from gevent import Greenlet
 
 import operator
 from sets import Set
+from collections import defaultdict
 
 from ion.services.dm.presentation.sms_providers import sms_providers
-from interface.objects import NotificationRequest, SMSDeliveryConfig, EmailDeliveryConfig, NotificationType
+from ion.services.dm.presentation.mail_delivery import MailQueue, fake_smtplib
+from interface.objects import NotificationRequest, SMSDeliveryConfig, EmailDeliveryConfig, NotificationType, DeliveryMode
 
 from interface.services.dm.iuser_notification_service import BaseUserNotificationService
 
-import smtplib
-
-class fake_smtplib(object):
-
-    def __init__(self,host):
-        self.host = host
-        self.sentmail = gevent.queue.Queue()
-
-    @classmethod
-    def SMTP(cls,host):
-        log.info("In fake_smptplib.SMTP method call. class: %s, host: %s" % (str(cls), str(host)))
-        return cls(host)
-
-    def sendmail(self, msg_sender, msg_recipient, msg):
-        log.info('Sending fake message from: %s, to: "%s"' % (msg_sender,  msg_recipient))
-        self.sentmail.put((msg_sender, msg_recipient, msg))
-
 """
 For every user that has existing notification requests (who has called
 create_notification()) the UNS will contain a local UserEventProcessor
@@ -88,11 +72,14 @@ class Notification(object):
         # origin/event.  This will require a list to hold all the subscribers so they can
         # be started and killed
 
-        self.subscriber = EventSubscriber(origin=notification_request.origin,
-                                            origin_type = notification_request.origin_type,
-                                            event_type=notification_request.event_type,
-                                            sub_type=notification_request.event_subtype,
-                                            callback=subscriber_callback)
+        # Without a callback the events are delivered by the service's NotificationSubscriptions
+        self.subscriber = None
+        if subscriber_callback is not None:
+            self.subscriber = EventSubscriber(origin=notification_request.origin,
+                                                origin_type = notification_request.origin_type,
+                                                event_type=notification_request.event_type,
+                                                sub_type=notification_request.event_subtype,
+                                                callback=subscriber_callback)
         self.notification_id = None
 
     def set_notification_id(self, id_=None):
@@ -106,13 +93,93 @@ class Notification(object):
         """
         Start subscribing
         """
-        self.subscriber.activate()
+        if self.subscriber is not None:
+            self.subscriber.activate()
 
     def deactivate(self):
         """
         Stop subscribing
         """
-        self.subscriber.deactivate()
+        if self.subscriber is not None:
+            self.subscriber.deactivate()
+
+
+class NotificationSubscriptions(object):
+    """
+    One event subscriber per distinct (event_type, origin, origin_type) of the notifications, shared by all the
+    event processors of those notifications. A received event is handed to the processors indexed under its
+    subscriber, the detection filters among them are matched at once through a QueryDispatcher.
+    """
+
+    def __init__(self):
+        self.subscribers = {}
+        self.processors = defaultdict(set)
+        self.detectors = defaultdict(QueryDispatcher)
+
+    @staticmethod
+    def _key(notification_request):
+        return notification_request.event_type, notification_request.origin, notification_request.origin_type
+
+    def add(self, processor, notification_request):
+        key = self._key(notification_request)
+        if isinstance(processor, DetectionEventProcessor):
+            self.detectors[key].add(processor, processor.query_dict)
+        else:
+            self.processors[key].add(processor)
+
+        if key not in self.subscribers:
+            event_type, origin, origin_type = key
+            subscriber = EventSubscriber(origin=origin,
+                                            origin_type=origin_type,
+                                            event_type=event_type,
+                                            callback=lambda message, headers: self._dispatch(key, message, headers))
+            self.subscribers[key] = subscriber
+            subscriber.activate()
+            log.debug("NotificationSubscriptions.add(): subscribed to %s" % str(key))
+
+    def remove(self, processor, notification_request):
+        key = self._key(notification_request)
+        self.processors[key].discard(processor)
+        self.detectors[key].remove(processor)
+
+        # The last notification on the subscriber is gone
+        if not self.processors[key] and not self.detectors[key]:
+            del self.processors[key]
+            del self.detectors[key]
+            subscriber = self.subscribers.pop(key, None)
+            if subscriber is not None:
+                subscriber.deactivate()
+                log.debug("NotificationSubscriptions.remove(): unsubscribed from %s" % str(key))
+
+    def stop(self):
+        for subscriber in self.subscribers.itervalues():
+            subscriber.deactivate()
+        self.subscribers.clear()
+        self.processors.clear()
+        self.detectors.clear()
+
+    @staticmethod
+    def _wants(processor, message):
+        sub_type = processor.notification._res_obj.event_subtype
+        return not sub_type or sub_type == getattr(message, 'sub_type', None)
+
+    def _dispatch(self, key, message, headers):
+        for processor in list(self.processors.get(key, ())):
+            if self._wants(processor, message):
+                try:
+                    processor.subscription_callback(message, headers)
+                except Exception:
+                    log.exception("Notification for user %s failed" % processor.user_id)
+
+        detectors = self.detectors.get(key)
+        if detectors:
+            for processor in detectors.match(message):
+                if self._wants(processor, message):
+                    try:
+                        processor.generate_event(message)
+                    except Exception:
+                        log.exception("Detection for user %s failed" % processor.user_id)
+
 
 class EventProcessor(object):
     """
@@ -125,8 +192,9 @@ class EventProcessor(object):
     Is that what we want? All resources already have an owner association!
     """
 
-    def __init__(self, notification_request, user_id):
+    def __init__(self, notification_request, user_id, subscriptions=None):
         self.user_id = user_id
+        self.subscriptions = subscriptions
         self.notification = self._add_notification(notification_request=notification_request)
         log.debug("UserEventProcessor.__init__():")
 
@@ -145,11 +213,16 @@ class EventProcessor(object):
         @retval notification object
         """
 
-        # create and save notification in notifications list
-        notification_obj = Notification(notification_request, self.subscription_callback)
+        if self.subscriptions is not None:
+            # the events come through the service's shared subscriber
+            notification_obj = Notification(notification_request)
+            self.subscriptions.add(self, notification_request)
+        else:
+            # create and save notification in notifications list
+            notification_obj = Notification(notification_request, self.subscription_callback)
 
-        # start the event subscriber listening
-        notification_obj.activate()
+            # start the event subscriber listening
+            notification_obj.activate()
         log.debug("UserEventProcessor.add_notification(): added notification " + str(notification_request) + " to user " + self.user_id)
         return notification_obj
 
@@ -160,7 +233,10 @@ class EventProcessor(object):
         @param notification_id
         @retval the number of notifications subscribed to by the user
         """
-        self.notification.deactivate()
+        if self.subscriptions is not None:
+            self.subscriptions.remove(self, self.notification._res_obj)
+        else:
+            self.notification.deactivate()
 
     def __str__(self):
         return str(self.__dict__)
@@ -168,47 +244,26 @@ class EventProcessor(object):
 
 # the 'from' email address for notification emails
 ION_NOTIFICATION_EMAIL_ADDRESS = 'ION_notifications-do-not-reply@oceanobservatories.org'
-ION_NOTIFICATION_EMAIL_ADDRESS = 'ION_notifications-do-not-reply@oceanobservatories.org'
-# the default smtp server
-ION_SMTP_SERVER = 'mail.oceanobservatories.org'
 
 
 class EmailEventProcessor(EventProcessor):
 
-    def __init__(self, notification_request, user_id):
-
-        super(EmailEventProcessor, self).__init__(notification_request,user_id)
-
-        smtp_host = CFG.get_safe('server.smtp.host', ION_SMTP_SERVER)
-        smtp_port = CFG.get_safe('server.smtp.port', 25)
-        self.smtp_sender = CFG.get_safe('server.smtp.sender')
-        smtp_password = CFG.get_safe('server.smtp.password')
-
-        log.info('smtp_host: %s' % str(smtp_host))
-        log.info('smtp_port: %s' % str(smtp_port))
+    def __init__(self, notification_request, user_id, mail_queue=None, subscriptions=None):
 
-        if CFG.get_safe('system.smtp',False): #Default is False - use the fake_smtp
-            log.warning('Using the real SMTP library to send email notifications!')
+        # The service shares one mail queue between its processors, otherwise the processor runs its own
+        self._owns_mail_queue = mail_queue is None
+        if mail_queue is None:
+            mail_queue = MailQueue.from_config()
+            mail_queue.start()
+        self.mail_queue = mail_queue
+        self.smtp_sender = mail_queue.pool.sender
 
-            #@todo - for now hard wire for gmail account
-            #msg_sender = 'ooici777@gmail.com'
-            #gmail_pwd = 'ooici777'
-
-
-
-            self.smtp_client = smtplib.SMTP(smtp_host)
-            self.smtp_client.ehlo()
-            self.smtp_client.starttls()
-            self.smtp_client.login(self.smtp_sender, smtp_password)
-
-            log.warning("Using smpt host: %s" % smtp_host)
-        else:
-            # Keep this as a warning
-            log.warning('Using a fake SMTP library to simulate email notifications!')
-
-            #@todo - what about port etc??? What is the correct interface to fake?
-            self.smtp_client = fake_smtplib.SMTP(smtp_host)
+        # The mailbox of the fake SMTP server, tests read the sent mail from it
+        self.smtp_client = None
+        if isinstance(mail_queue.pool.smtp, type) and issubclass(mail_queue.pool.smtp, fake_smtplib):
+            self.smtp_client = mail_queue.pool.smtp.SMTP(mail_queue.pool.host)
 
+        super(EmailEventProcessor, self).__init__(notification_request,user_id,subscriptions)
 
         log.debug("UserEventProcessor.__init__(): email for user %s " %self.user_id)
 
@@ -249,36 +304,37 @@ class EmailEventProcessor(EventProcessor):
         msg_sender = ION_NOTIFICATION_EMAIL_ADDRESS
 #        msg_recipient = self.user_email_addr
 
-        msg_recipient = self.notification._res_obj.delivery_config.delivery['email']
-
-        msg = MIMEText(msg_body)
-        msg['Subject'] = msg_subject
-        msg['From'] = msg_sender
-        msg['To'] = msg_recipient
-        log.debug("UserEventProcessor.subscription_callback(): sending email to %s"\
-        %msg_recipient)
+        delivery = self.notification._res_obj.delivery_config.delivery
+        msg_recipient = delivery['email']
 
-        self.smtp_client.sendmail(self.smtp_sender, msg_recipient, msg.as_string())
+        if delivery.get('mode') == DeliveryMode.DIGEST:
+            # One email per user and address for the events of the period
+            log.debug("UserEventProcessor.subscription_callback(): adding to the digest for %s" % msg_recipient)
+            self.mail_queue.digest((self.user_id, msg_recipient), delivery.get('period', 86400),
+                msg_sender, msg_recipient, msg_subject, msg_body, envelope_sender=self.smtp_sender)
+        else:
+            log.debug("UserEventProcessor.subscription_callback(): sending email to %s" % msg_recipient)
+            self.mail_queue.send(msg_sender, msg_recipient, msg_subject, msg_body, envelope_sender=self.smtp_sender)
 
     def remove_notification(self):
 
         super(EmailEventProcessor, self).remove_notification()
 
-        if CFG.get_safe('system.smtp',False):
-            self.smtp_client.close()
+        if self._owns_mail_queue:
+            self.mail_queue.stop()
 
 
 class SMSEventProcessor(EmailEventProcessor):
 
-    def __init__(self, notification_request, user_id):
-
-        super(SMSEventProcessor, self).__init__(notification_request,user_id)
+    def __init__(self, notification_request, user_id, mail_queue=None, subscriptions=None):
 
         provider = notification_request.delivery_config.delivery['provider']
 
         provider_email = sms_providers[provider] # self.notification.delivery_config.delivery['provider']
         self.msg_recipient = notification_request.delivery_config.delivery['phone_number'] + provider_email
 
+        super(SMSEventProcessor, self).__init__(notification_request,user_id,mail_queue,subscriptions)
+
 
     def subscription_callback(self, message, headers):
         #The message body should only contain the event description for now and a standard header: "ION Event SMS"...
@@ -292,8 +348,6 @@ class SMSEventProcessor(EmailEventProcessor):
         log.debug("event type = " + str(message._get_type()))
         log.debug('type of message: %s' % type(message))
 
-        time_stamp = str( datetime.fromtimestamp(time.mktime(time.gmtime(float(message.ts_created)/1000))))
-
         event = message.type_
         origin = message.origin
         description = message.description
@@ -306,13 +360,9 @@ class SMSEventProcessor(EmailEventProcessor):
         msg_subject = "(SysName: " + get_sys_name() + ") ION event " + event + " from " + origin
         msg_sender = ION_NOTIFICATION_EMAIL_ADDRESS
 
-        msg = MIMEText(msg_body)
-        msg['Subject'] = msg_subject
-        msg['From'] = msg_sender
-        msg['To'] = self.msg_recipient
         log.debug("UserEventProcessor.subscription_callback(): sending email to %s"\
         %self.msg_recipient)
-        self.smtp_client.sendmail(msg_sender, self.msg_recipient, msg.as_string())
+        self.mail_queue.send(msg_sender, self.msg_recipient, msg_subject, msg_body)
 
 
 class DetectionEventProcessor(EventProcessor):
@@ -321,14 +371,16 @@ class DetectionEventProcessor(EventProcessor):
 #                  "<":operator.lt,
 #                  "==":operator.eq}
 
-    def __init__(self, notification_request, user_id):
-
-        super(DetectionEventProcessor, self).__init__(notification_request,user_id)
+    def __init__(self, notification_request, user_id, subscriptions=None):
 
+        # The query is needed to index the processor in the shared subscriptions
         parser = QueryLanguage()
 
-        search_string = self.notification._res_obj.delivery_config.processing['search_string']
+        search_string = notification_request.delivery_config.processing['search_string']
         self.query_dict = parser.parse(search_string)
+        self.condition = QueryLanguage.compile_condition(self.query_dict)
+
+        super(DetectionEventProcessor, self).__init__(notification_request,user_id,subscriptions)
 
     def generate_event(self, msg):
         '''
@@ -351,18 +403,18 @@ class DetectionEventProcessor(EventProcessor):
 
     def subscription_callback(self, message, headers):
 
-        if QueryLanguage.evaluate_condition(message, self.query_dict):
+        if self.condition(message):
             self.generate_event(message) # pass in the event message so we can put some of the content in the new event.
 
-def create_event_processor(notification_request, user_id):
+def create_event_processor(notification_request, user_id, mail_queue=None, subscriptions=None):
     if notification_request.type == NotificationType.EMAIL:
-        return EmailEventProcessor(notification_request,user_id)
+        return EmailEventProcessor(notification_request,user_id,mail_queue,subscriptions)
 
     elif notification_request.type == NotificationType.SMS:
-        return SMSEventProcessor(notification_request,user_id)
+        return SMSEventProcessor(notification_request,user_id,mail_queue,subscriptions)
 
     elif notification_request.type == NotificationType.FILTER:
-        return DetectionEventProcessor(notification_request,user_id)
+        return DetectionEventProcessor(notification_request,user_id,subscriptions)
 
     else:
         raise BadRequest('Invalid Notification Request Type!')
@@ -372,10 +424,20 @@ class UserNotificationService(BaseUserNotificationService):
     A service that provides users with an API for CRUD methods for notifications.
     """
 
+    mail_queue = None
+    subscriptions = None
+
     def on_start(self):
 
         self.event_processors = {}
 
+        # One event subscriber per event type and origin, shared by the notifications on it
+        self.subscriptions = NotificationSubscriptions()
+
+        # Outbound mail of every email and sms notification
+        self.mail_queue = MailQueue.from_config()
+        self.mail_queue.start()
+
         # Get the event Repository
         self.event_repo = self.container.instance.event_repository
 
@@ -398,6 +460,12 @@ class UserNotificationService(BaseUserNotificationService):
 
             processor.remove_notification()
 
+        if self.subscriptions is not None:
+            self.subscriptions.stop()
+
+        if self.mail_queue is not None:
+            self.mail_queue.stop()
+
 
     def create_notification(self, notification=None, user_id=''):
         """
@@ -427,7 +495,7 @@ class UserNotificationService(BaseUserNotificationService):
 #        user_info = self.clients.resource_registry.read(user_id)
 
         # create event processor for user
-        self.event_processors[notification_id] = create_event_processor(notification_request=notification,user_id=user_id)
+        self.event_processors[notification_id] = create_event_processor(notification_request=notification,user_id=user_id,mail_queue=self.mail_queue,subscriptions=self.subscriptions)
         log.debug("UserNotificationService.create_notification(): added event processor " +  str(self.event_processors[notification_id]))
 
         return notification_id
@@ -489,7 +557,7 @@ class UserNotificationService(BaseUserNotificationService):
         """
         _event_processor = self.event_processors[notification_id]
         del self.event_processors[notification_id]
-        _event_processor.remove_notification(notification_id)
+        _event_processor.remove_notification()
         self.clients.resource_registry.delete(notification_id)
 
         #@todo clean up the association?
@@ -0,0 +1,95 @@
+'''
+@file ion/services/dm/test/test_dataset_store.py
+@description Unit Test for the append-only dataset store
+'''
+import fcntl
+import os
+import shutil
+import tempfile
+import uuid
+
+import gevent
+import numpy as np
+from mock import Mock, patch
+
+from pyon.util.unit_test import PyonTestCase
+from ion.services.dm.utility.dataset_store import DatasetStore
+from nose.plugins.attrib import attr
+
+@attr('UNIT',group='dm')
+class DatasetStoreUnitTest(PyonTestCase):
+    def setUp(self):
+        # The store is kept in a temporary directory instead of the container file system
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        patcher = patch('ion.services.dm.utility.dataset_store.FileSystem')
+        file_system = patcher.start()
+        self.addCleanup(patcher.stop)
+        file_system.get_hierarchical_url.side_effect = lambda root, name, ext: os.path.join(self.tmpdir, name + ext)
+
+        self.store = DatasetStore(uuid.uuid4().hex)
+
+    def test_coalesce(self):
+        self.assertEquals(DatasetStore.coalesce([(0,10),(10,5),(20,5),(25,1)]), [(0,15),(20,6)])
+        self.assertEquals(DatasetStore.coalesce([]), [])
+
+    def test_append_read(self):
+        self.store.append('A', {'/fields/time':np.arange(5.), '/fields/temp':np.ones(5)})
+        self.store.append('B', {'/fields/time':np.arange(5.,8.)})
+        # Duplicates are ignored
+        self.store.append('A', {'/fields/time':np.arange(5.), '/fields/temp':np.ones(5)})
+
+        self.assertEquals(self.store.spans(['A','B','C']), [(0,5),(5,3),None])
+
+        data = self.store.read(['/fields/time','/fields/temp'], ['A','B'])
+        np.testing.assert_array_equal(data['/fields/time'], np.arange(8.))
+        # B had no temperature
+        self.assertTrue(np.isnan(data['/fields/temp'][5:]).all())
+
+        data = self.store.read(['/fields/time'], ['B'])
+        np.testing.assert_array_equal(data['/fields/time'], np.arange(5.,8.))
+
+    def test_append_bytes(self):
+        self.store.append_bytes('A', 'hello')
+        self.store.append_bytes('B', 'world')
+        self.assertEquals(self.store.read_bytes('B'), 'world')
+        self.assertRaises(KeyError, self.store.read_bytes, 'C')
+
+    def test_index_in_memory(self):
+        self.store.append('A', {'/fields/time':np.arange(5.)})
+        self.store.append('B', {'/fields/time':np.arange(5.,8.)})
+
+        reader = DatasetStore(self.store.stream_id)
+        reader._add_span = Mock(wraps=reader._add_span)
+        self.assertTrue(reader.has('A'))
+        self.assertTrue(reader.has('B'))
+        self.assertFalse(reader.has('C'))
+        self.assertEquals(reader._add_span.call_count, 2)
+
+        # Only the granule appended since is read into the index
+        self.store.append('C', {'/fields/time':np.arange(8.,9.)})
+        self.assertEquals(reader.spans(['A','C']), [(0,5),(8,1)])
+        self.assertEquals(reader._add_span.call_count, 3)
+
+    def test_concurrent_writers(self):
+        # Appends of another writer are in the index before the next append
+        writer = DatasetStore(self.store.stream_id)
+        self.store.append('A', {'/fields/time':np.arange(5.)})
+        writer.append('B', {'/fields/time':np.arange(5.,8.)})
+        writer.append('A', {'/fields/time':np.arange(5.)})
+        self.store.append('C', {'/fields/time':np.arange(8.,9.)})
+
+        self.assertEquals(self.store.spans(['A','B','C']), [(0,5),(5,3),(8,1)])
+        data = writer.read(['/fields/time'], ['A','B','C'])
+        np.testing.assert_array_equal(data['/fields/time'], np.arange(9.))
+
+    def test_lock_does_not_block(self):
+        self.store.append('A', {'/fields/time':np.arange(5.)})
+        with open(self.store.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            reader = gevent.spawn(DatasetStore(self.store.stream_id).has, 'A')
+            # Other greenlets keep running while the reader waits for the lock
+            gevent.sleep(0.05)
+            self.assertFalse(reader.ready())
+            fcntl.flock(lock, fcntl.LOCK_UN)
+        self.assertTrue(reader.get(timeout=1))
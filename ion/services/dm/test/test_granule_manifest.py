@@ -0,0 +1,35 @@
+'''
+@file ion/services/dm/test/test_granule_manifest.py
+@description Unit Test for the granule manifest used by replay
+'''
+from pyon.util.unit_test import PyonTestCase
+from ion.services.dm.utility.granule_manifest import GranuleManifest
+from nose.plugins.attrib import attr
+
+@attr('UNIT',group='dm')
+class GranuleManifestUnitTest(PyonTestCase):
+    def setUp(self):
+        # Four granules of ten records each, one second per record
+        self.entries = [{'sha1':'%d' % i, 'encoding':'hdf5', 'first':i*10, 'last':i*10+9, 'records':10} for i in xrange(4)]
+
+    def test_in_time_range(self):
+        selected = GranuleManifest.in_time_range(self.entries, 15, 25)
+        self.assertEquals([entry['sha1'] for entry in selected], ['1','2'])
+
+        selected = GranuleManifest.in_time_range(self.entries, None, 9)
+        self.assertEquals([entry['sha1'] for entry in selected], ['0'])
+
+        selected = GranuleManifest.in_time_range(self.entries, 40, None)
+        self.assertEquals(selected, [])
+
+    def test_in_record_range(self):
+        selected, offset = GranuleManifest.in_record_range(self.entries, 12, 31)
+        self.assertEquals([entry['sha1'] for entry in selected], ['1','2','3'])
+        self.assertEquals(offset, 10)
+
+        selected, offset = GranuleManifest.in_record_range(self.entries, 20, 30)
+        self.assertEquals([entry['sha1'] for entry in selected], ['2'])
+        self.assertEquals(offset, 20)
+
+        selected, offset = GranuleManifest.in_record_range(self.entries, 50, 60)
+        self.assertEquals(selected, [])
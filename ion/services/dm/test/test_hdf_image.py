@@ -0,0 +1,78 @@
+'''
+@file ion/services/dm/test/test_hdf_image.py
+@description Unit Test and micro-benchmark for decoding HDF granules in memory
+'''
+import os
+import time
+
+import numpy as np
+
+from pyon.public import log
+from pyon.util.file_sys import FileSystem
+from pyon.util.unit_test import PyonTestCase
+from prototype.hdf.hdf_array_iterator import acquire_data
+from prototype.hdf.hdf_codec import HDFEncoder
+from ion.services.dm.utility.hdf_image import HDFImage, last_values
+from nose.plugins.attrib import attr
+
+
+def make_hdf_string(records):
+    codec = HDFEncoder()
+    codec.add_hdf_dataset('fields/time', np.arange(records, dtype='float64'))
+    codec.add_hdf_dataset('fields/temperature', np.random.random_sample(records))
+    return codec.encoder_close()
+
+
+@attr('UNIT',group='dm')
+class HDFImageUnitTest(PyonTestCase):
+    def test_values(self):
+        image = HDFImage(make_hdf_string(10))
+
+        np.testing.assert_array_equal(image.values('fields/time'), np.arange(10))
+        np.testing.assert_array_equal(image.values('/fields/time', slice(2,4)), np.array([2.,3.]))
+        self.assertEquals(HDFImage.bounds(image.values('fields/time')), (0., 9.))
+        self.assertEquals(image.temp_files, 0)
+
+    def test_last_values(self):
+        hdf_string = make_hdf_string(10)
+
+        retval = last_values(hdf_string, ['fields/time', '/fields/missing'])
+        self.assertEquals(retval, {'/fields/time' : 9.})
+
+        retval = last_values(hdf_string)
+        self.assertEquals(sorted(retval.keys()), ['/fields/temperature', '/fields/time'])
+        self.assertEquals(retval['/fields/time'], 9.)
+
+
+@attr('LOAD',group='dm')
+class HDFImageBenchmark(PyonTestCase):
+    def test_replay_slicing(self):
+        '''
+        A replay with fields and time in its delivery format decodes the merged dataset three times
+        (subset, time index and slice). Compares the temp file round trips against one in-memory image.
+        '''
+        hdf_string = make_hdf_string(100000)
+        passes = 3
+
+        start = time.time()
+        disk_bytes = 0
+        for i in xrange(passes):
+            f = FileSystem.mktemp()
+            f.write(hdf_string)
+            path = f.name
+            f.close()
+            disk_bytes += os.path.getsize(path)
+            acquire_data([path], ['time','temperature'], 100000).next()
+            FileSystem.unlink(path)
+        temp_file_time = time.time() - start
+
+        start = time.time()
+        image = HDFImage(hdf_string)
+        for i in xrange(passes):
+            image.values('fields/time')
+            image.values('fields/temperature')
+        image_time = time.time() - start
+
+        log.info('Temp files: %d bytes written, %.4fs', disk_bytes, temp_file_time)
+        log.info('In memory: %d temp files, %.4fs', image.temp_files, image_time)
+        self.assertEquals(image.temp_files, 0)
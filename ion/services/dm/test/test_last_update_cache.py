@@ -3,6 +3,7 @@
 @file ion/services/dm/test/test_last_update_cache.py
 @description Integration Test for Last Update mechanism
 '''
+import gevent
 from gevent.queue import Queue
 from gevent.queue import Empty
 import os
@@ -17,9 +18,83 @@ from pyon.datastore.datastore import DataStore
 from pyon.net.endpoint import Publisher
 from pyon.public import CFG
 from pyon.util.int_test import IonIntegrationTestCase
+from pyon.util.unit_test import PyonTestCase
 from nose.plugins.attrib import attr
-from ion.processes.data.last_update_cache import CACHE_DATASTORE_NAME
+from ion.processes.data.last_update_cache import CACHE_DATASTORE_NAME, LastUpdateTable, LastUpdateCache
+from pyon.util.log import log
+from mock import Mock
 import unittest
+import time
+
+
+@attr('UNIT',group='dm')
+class LastUpdateTableTest(PyonTestCase):
+    def setUp(self):
+        self.db = Mock()
+        self.db._ion_object_to_persistence_dict.side_effect = lambda obj : {'value' : obj}
+        self.db.read_doc_mult.return_value = [{'_id' : 'a', '_rev' : '1'}, None]
+        self.db.create_doc_mult.side_effect = lambda docs, allow_ids : [(True, doc['_id'], '2') for doc in docs]
+        self.table = LastUpdateTable(self.db)
+
+    def test_flush(self):
+        self.table.update('a', 1)
+        self.table.update('a', 2)
+        self.table.update('b', 3)
+        self.assertEquals(self.table.read('a'), 2)
+        self.assertFalse(self.db.create_doc_mult.called)
+
+        self.table.flush()
+        docs, = self.db.create_doc_mult.call_args[0]
+        self.assertEquals(sorted(docs, key=lambda doc : doc['_id']), [{'_id' : 'a', '_rev' : '1', 'value' : 2}, {'_id' : 'b', 'value' : 3}])
+
+        # Clean entries are not written again, the revisions are kept
+        self.table.flush()
+        self.assertEquals(self.db.create_doc_mult.call_count, 1)
+        self.table.update('b', 4)
+        self.table.flush()
+        docs, = self.db.create_doc_mult.call_args[0]
+        self.assertEquals(docs, [{'_id' : 'b', '_rev' : '2', 'value' : 4}])
+        self.assertEquals(self.db.read_doc_mult.call_count, 1)
+
+    def test_conflict(self):
+        self.db.create_doc_mult.side_effect = lambda docs, allow_ids : [(False, doc['_id'], 'conflict') for doc in docs]
+        self.table.update('a', 1)
+        self.table.flush()
+        self.assertEquals(self.table.dirty, set(['a']))
+        self.assertEquals(self.table.revisions, {})
+
+    def test_write_failure(self):
+        self.table.update('a', 1)
+        self.db.create_doc_mult.side_effect = Exception('couch is down')
+        self.assertRaises(Exception, self.table.flush)
+        self.assertEquals(self.table.dirty, set(['a']))
+
+        # Updated while the write was in progress
+        def create_doc_mult(docs, allow_ids):
+            self.table.update('b', 3)
+            self.table.update('a', 2)
+            return [(True, doc['_id'], '2') for doc in docs]
+        self.db.create_doc_mult.side_effect = create_doc_mult
+        self.table.flush()
+        self.assertEquals(self.table.dirty, set(['a', 'b']))
+
+    def test_stop_during_flush(self):
+        started = Queue()
+        def create_doc_mult(docs, allow_ids):
+            started.put(True)
+            gevent.sleep(10)
+        self.db.create_doc_mult.side_effect = create_doc_mult
+        self.table.interval = 0.01
+        self.table.start()
+        self.table.update('a', 1)
+        started.get(timeout=2)
+
+        self.db.create_doc_mult.side_effect = lambda docs, allow_ids : [(True, doc['_id'], '2') for doc in docs]
+        self.table.stop()
+        docs, = self.db.create_doc_mult.call_args[0]
+        self.assertEquals(docs, [{'_id' : 'a', '_rev' : '1', 'value' : 1}])
+        self.assertEquals(self.table.dirty, set())
+
 
 @attr('INT',group='dm')
 class LastUpdateCacheTest(IonIntegrationTestCase):
@@ -132,9 +207,57 @@ class LastUpdateCacheTest(IonIntegrationTestCase):
             except Empty:
                 self.assertTrue(False, 'Process never received the message.')
 
-            doc = self.db.read(stream_id)
-            ntime = doc.variables['time'].value
+            lu = self.container.last_update_table.read(stream_id)
+            ntime = lu.variables['time'].value
             self.assertTrue(ntime >= time, 'The documents did not sequentially get updated correctly.')
             time = ntime
 
+        # The last value reaches couch with the next flush
+        self.container.last_update_table.flush()
+        doc = self.db.read(stream_id)
+        self.assertEquals(doc.variables['time'].value, time)
+
+
+@attr('LOAD',group='dm')
+class LastUpdateCacheBenchmark(PyonTestCase):
+    def test_cpu_per_granule(self):
+        '''
+        Compares parsing the whole granule with reading the last record of each field
+        '''
+        from prototype.sci_data.constructor_apis import PointSupplementConstructor
+        import numpy as np
+
+        definition = SBE37_CDM_stream_definition()
+        stream_id = 'benchmark'
+        definition.stream_resource_id = stream_id
+        records = 1000
+        granules = 20
+
+        psc = PointSupplementConstructor(point_definition=definition, stream_id=stream_id)
+        for i in xrange(records):
+            point_id = psc.add_point(time=i, location=(0,0,0))
+            for field in ('temperature', 'pressure', 'conductivity'):
+                psc.add_scalar_point_coverage(point_id=point_id, coverage_id=field, value=np.random.random())
+        granule = psc.close_stream_granule()
+        granule.stream_resource_id = stream_id
+
+        cache = LastUpdateCache()
+        cache.def_cache[stream_id] = definition
+
+        start = time.clock()
+        for i in xrange(granules):
+            parsed = LastUpdateCache.parse_last_value(definition, granule)
+        parse_time = (time.clock() - start) / granules
+
+        start = time.clock()
+        for i in xrange(granules):
+            tail = cache.get_last_value(granule)
+        tail_time = (time.clock() - start) / granules
+
+        for field in parsed.variables:
+            self.assertEquals(tail.variables[field].value, parsed.variables[field].value)
+            self.assertEquals(tail.variables[field].units, parsed.variables[field].units)
 
+        log.info('Whole granule parse: %.2f ms CPU per granule', parse_time * 1000)
+        log.info('Last record read: %.2f ms CPU per granule', tail_time * 1000)
+        self.assertLess(tail_time, parse_time)
@@ -0,0 +1,93 @@
+'''
+@file ion/services/dm/test/test_local_search.py
+@description Unit Test for the in memory discovery search backend
+'''
+from mock import Mock, patch
+
+from pyon.core.exception import NotFound
+from pyon.util.containers import DotDict
+from pyon.util.unit_test import PyonTestCase
+from ion.services.dm.utility.local_search import LocalSearchBackend
+from nose.plugins.attrib import attr
+
+
+def make_resource(resource_id, name, depth, lat, lon, type_='InstrumentDevice'):
+    return DotDict(_id=resource_id, type_=type_, name=name, depth=depth, location={'lat':lat, 'lon':lon}, lcstate='DEPLOYED')
+
+
+@attr('UNIT',group='dm')
+class LocalSearchUnitTest(PyonTestCase):
+    def setUp(self):
+        self.rr = Mock()
+        self.rr.find_resources.return_value = ([], None)
+        self.backend = LocalSearchBackend(self.rr, indexes={'devices_index':['InstrumentDevice'], 'resources_index':None})
+        self.a = make_resource('a', 'CTD One', 10., 10.5, 20.5)
+        self.b = make_resource('b', 'Glider', 50, -10.5, -20.5)
+        self.c = make_resource('c', 'ctd two', 30, 10.6, 20.6)
+        self.site = make_resource('site', 'CTD site', 0, 0., 0., type_='Site')
+        for resource in (self.a, self.b, self.c, self.site):
+            self.backend.index_resource(resource)
+
+    def test_term(self):
+        retval = self.backend.query_term('devices_index', 'name', 'CTD*', id_only=True)
+        self.assertEquals(sorted(retval), ['a', 'c'])
+
+        retval = self.backend.query_term('resources_index', '*', 'ctd*', order={'name':'asc'}, id_only=True)
+        self.assertEquals(retval, ['a', 'site', 'c'])
+
+        retval = self.backend.query_term('devices_index', 'name', 'glider')
+        self.assertEquals(retval, [self.b])
+
+    def test_range(self):
+        retval = self.backend.query_range('devices_index', 'depth', 10, 30, id_only=True)
+        self.assertEquals(sorted(retval), ['a', 'c'])
+
+        retval = self.backend.query_range('devices_index', 'depth', 0, 100, order={'depth':'desc'}, limit=2, offset=1, id_only=True)
+        self.assertEquals(retval, ['c', 'a'])
+
+        # Ids at the upper bound are included whatever they sort as
+        self.backend.index_resource(make_resource(u'\uffff', 'Mooring', 30, 0., 0.))
+        retval = self.backend.query_range('devices_index', 'depth', 30, 30, id_only=True)
+        self.assertEquals(sorted(retval), ['c', u'\uffff'])
+
+    def test_geo(self):
+        retval = self.backend.query_geo_bbox('devices_index', 'location', [20, 11], [21, 10], id_only=True)
+        self.assertEquals(sorted(retval), ['a', 'c'])
+
+        retval = self.backend.query_geo_distance('devices_index', 'location', [20.5, 10.5], 20, 'km', id_only=True)
+        self.assertEquals(retval, ['a', 'c'])
+
+        retval = self.backend.query_geo_distance('devices_index', 'location', [20.5, 10.5], 5, 'km', id_only=True)
+        self.assertEquals(retval, ['a'])
+
+    def test_events(self):
+        self.rr.read.return_value = DotDict(self.a, name='Retired CTD', lcstate='RETIRED')
+        self.backend._resource_modified_callback(DotDict(origin='a'))
+        self.assertEquals(self.backend.query_term('devices_index', 'name', 'ctd*', id_only=True), ['c'])
+
+        self.rr.read.return_value = DotDict(self.c, name='renamed')
+        self.backend._resource_modified_callback(DotDict(origin='c'))
+        self.assertEquals(self.backend.query_term('devices_index', 'name', 'ctd*', id_only=True), [])
+        self.assertEquals(self.backend.query_term('devices_index', 'name', 'renamed', id_only=True), ['c'])
+
+        self.rr.read.side_effect = NotFound
+        self.backend._resource_modified_callback(DotDict(origin='b'))
+        self.assertEquals(self.backend.query_range('devices_index', 'depth', 0, 100, id_only=True), ['c'])
+
+    def test_unknown_index(self):
+        self.rr.read.side_effect = NotFound
+        with self.assertRaises(NotFound):
+            self.backend.query_term('unknown', 'name', '*')
+
+    @patch('ion.services.dm.utility.local_search.RT')
+    def test_load_on_first_query(self, rt):
+        rt.values.return_value = ['InstrumentDevice', 'Site']
+        backend = LocalSearchBackend(self.rr, indexes={'devices_index':['InstrumentDevice']})
+        self.rr.find_resources.side_effect = lambda restype, id_only: ([self.a, self.b] if restype == 'InstrumentDevice' else [], None)
+        self.assertFalse(self.rr.find_resources.called)
+
+        self.assertEquals(sorted(backend.query_term('devices_index', 'name', '*', id_only=True)), ['a', 'b'])
+        self.assertEquals(self.rr.find_resources.call_count, 2)
+
+        backend.query_range('devices_index', 'depth', 0, 100)
+        self.assertEquals(self.rr.find_resources.call_count, 2)
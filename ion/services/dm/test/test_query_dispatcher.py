@@ -0,0 +1,95 @@
+'''
+@file ion/services/dm/test/test_query_dispatcher.py
+@description Unit Test for the compiled event matching
+'''
+import random
+import time
+
+from pyon.util.containers import DotDict
+from pyon.util.log import log
+from pyon.util.unit_test import PyonTestCase
+from ion.services.dm.utility.query_language import QueryLanguage
+from ion.services.dm.utility.query_dispatcher import QueryDispatcher, IntervalTree
+from nose.plugins.attrib import attr
+
+
+@attr('UNIT',group='dm')
+class QueryDispatcherUnitTest(PyonTestCase):
+    def setUp(self):
+        self.parser = QueryLanguage()
+
+    def test_geo_match(self):
+        query = self.parser.parse("SEARCH 'location' GEO DISTANCE 100 km FROM LAT 40 LON -70 FROM 'index'")
+        self.assertTrue(QueryLanguage.match(DotDict(location={'lat':40.5, 'lon':-70.5}), query['query']))
+        self.assertFalse(QueryLanguage.match(DotDict(location={'lat':42, 'lon':-70}), query['query']))
+        self.assertFalse(QueryLanguage.match(DotDict(voltage=4), query['query']))
+
+        query = self.parser.parse("SEARCH 'location' GEO BOX TOP-LEFT LAT 40 LON 0 BOTTOM-RIGHT LAT 0 LON 40 FROM 'index'")
+        self.assertTrue(QueryLanguage.match(DotDict(location=[10, 20]), query['query']))
+        self.assertFalse(QueryLanguage.match(DotDict(location=[-10, 20]), query['query']))
+
+    def test_interval_tree(self):
+        intervals = [(0, 10, 'a'), (5, 15, 'b'), (20, 30, 'c'), (12, 12, 'd')]
+        tree = IntervalTree(intervals)
+        for value in (-1, 0, 5, 10, 12, 15, 17, 25, 31):
+            expected = set(key for low, high, key in intervals if low <= value <= high)
+            self.assertEquals(tree.stab(value, set()), expected)
+
+    def test_dispatch(self):
+        dispatcher = QueryDispatcher()
+        dispatcher.add('range', self.parser.parse("SEARCH 'voltage' VALUES FROM 5 TO 10 FROM 'index'"))
+        dispatcher.add('term', self.parser.parse("SEARCH 'voltage' IS '15' FROM 'index'"))
+        dispatcher.add('and', self.parser.parse("SEARCH 'voltage' VALUES FROM 0 TO 10 FROM 'index' AND SEARCH 'origin' IS 'a' FROM 'index'"))
+        dispatcher.add('geo', self.parser.parse("SEARCH 'location' GEO BOX TOP-LEFT LAT 40 LON 0 BOTTOM-RIGHT LAT 0 LON 40 FROM 'index'"))
+        dispatcher.add('or', self.parser.parse("SEARCH 'voltage' IS '1' FROM 'index' OR SEARCH 'voltage' VALUES FROM 20 TO 30 FROM 'index'"))
+
+        self.assertEquals(sorted(dispatcher.match(DotDict(voltage=6, origin='a'))), ['and', 'range'])
+        self.assertEquals(dispatcher.match(DotDict(voltage=6, origin='b')), ['range'])
+        self.assertEquals(dispatcher.match(DotDict(voltage=15)), ['term'])
+        self.assertEquals(dispatcher.match(DotDict(voltage=25)), ['or'])
+        self.assertEquals(dispatcher.match(DotDict(voltage=1)), ['or'])
+        self.assertEquals(dispatcher.match(DotDict(location=[10, 20])), ['geo'])
+
+        # Only the queries indexed under the event's values are evaluated
+        self.assertEquals(dispatcher.candidates(DotDict(voltage=15)), set(['term', 'geo']))
+
+        dispatcher.remove('range')
+        dispatcher.add('term', self.parser.parse("SEARCH 'voltage' IS '16' FROM 'index'"))
+        self.assertEquals(dispatcher.match(DotDict(voltage=6, origin='b')), [])
+        self.assertEquals(dispatcher.match(DotDict(voltage=16)), ['term'])
+        self.assertEquals(len(dispatcher), 4)
+
+
+@attr('LOAD',group='dm')
+class QueryDispatcherBenchmark(PyonTestCase):
+    def test_events_per_second(self):
+        '''
+        Compares evaluate_condition against every notification with the dispatcher at 10k notifications
+        '''
+        parser = QueryLanguage()
+        notifications = 10000
+        queries = []
+        for i in xrange(notifications):
+            if i % 2:
+                low = random.randint(0, 1000)
+                queries.append(parser.parse("SEARCH 'voltage' VALUES FROM %s TO %s FROM 'index'" % (low, low + 10)))
+            else:
+                queries.append(parser.parse("SEARCH 'origin' IS 'device_%s' FROM 'index'" % i))
+
+        dispatcher = QueryDispatcher()
+        for i, query in enumerate(queries):
+            dispatcher.add(i, query)
+
+        events = [DotDict(origin='device_%s' % random.randint(0, notifications), voltage=random.randint(0, 1000)) for i in xrange(100)]
+
+        start = time.time()
+        expected = [sorted(i for i, query in enumerate(queries) if QueryLanguage.evaluate_condition(event, query)) for event in events]
+        scan_time = time.time() - start
+
+        start = time.time()
+        matched = [sorted(dispatcher.match(event)) for event in events]
+        dispatch_time = time.time() - start
+
+        self.assertEquals(matched, expected)
+        log.info('evaluate_condition per notification: %.1f events/s', len(events) / scan_time)
+        log.info('QueryDispatcher: %.1f events/s', len(events) / dispatch_time)
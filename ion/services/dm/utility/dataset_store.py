@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/dataset_store.py
+@description Append-only HDF5 store holding every granule of a stream in one file
+
+Each variable of the granules is appended to an extensible, chunked dataset at the same values path it has in
+the granule. Encoded granules which are not HDF (msgpack) are appended as raw bytes to /bytes. The /index group
+records the sha1, offset and count of every granule so replay can read contiguous hyperslabs.
+
+HDF5 does not support concurrent writers so access is serialized with an flock on a sidecar lock file. The lock is
+polled so waiting for it does not block the other greenlets. Readers and writers keep the index in memory. The count
+index is written last by an append, so the length of /index/count is the number of granules in the store, only the
+granules appended since the index was read are read into it.
+'''
+from contextlib import contextmanager
+import errno
+import fcntl
+import os
+
+import gevent
+import h5py
+import numpy as np
+
+from pyon.util.file_sys import FS, FileSystem
+
+
+class DatasetStore(object):
+    '''
+    Per stream append-only store, selected with the 'dataset' storage backend of ingestion.
+    '''
+    BYTES = '/bytes'
+    INDEX_SHA1 = '/index/sha1'
+    INDEX_OFFSET = '/index/offset'
+    INDEX_COUNT = '/index/count'
+
+    def __init__(self, stream_id, chunk_size=1024):
+        self.stream_id = stream_id
+        self.chunk_size = chunk_size
+        self.path = FileSystem.get_hierarchical_url(FS.CACHE, '%s_store' % stream_id, '.hdf5')
+        self.lock_path = '%s.lock' % self.path
+        self._spans = {} # sha1 -> (offset, count) of every granule in the store
+        self._granules = 0 # number of granules read into _spans
+        self._records = 0 # number of records of those granules, the offset of the next granule
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    @contextmanager
+    def _open(self, mode):
+        with open(self.lock_path, 'a') as lock:
+            self._lock(lock, fcntl.LOCK_SH if mode == 'r' else fcntl.LOCK_EX)
+            try:
+                f = h5py.File(self.path, mode)
+                try:
+                    yield f
+                finally:
+                    f.close()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _lock(self, lock, operation, max_delay=0.1):
+        delay = 0.001
+        while True:
+            try:
+                fcntl.flock(lock, operation | fcntl.LOCK_NB)
+                return
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+            gevent.sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+    #--------------------------------------------------------------------------------
+    # Writing
+    #--------------------------------------------------------------------------------
+
+    def append(self, sha1, variables):
+        '''
+        @brief Appends the variables of a granule, granules already in the store are ignored
+        @param sha1 sha1 of the granule
+        @param variables dict of values path to numpy array, all with the same number of records
+        '''
+        count = len(variables.values()[0]) if variables else 0
+        with self._open('a') as f:
+            if sha1 in self._read_index(f):
+                return
+            offset, position = self._records, self._granules
+            for path, values in variables.iteritems():
+                self._extend(f, path, np.asarray(values), offset)
+            # The count is written last, an append which fails before it is overwritten by the next one
+            self._extend(f, self.INDEX_SHA1, np.array([sha1], dtype='S40'), position)
+            self._extend(f, self.INDEX_OFFSET, np.array([offset], dtype='int64'), position)
+            self._extend(f, self.INDEX_COUNT, np.array([count], dtype='int64'), position)
+            self._add_span(sha1, offset, count)
+
+    def append_bytes(self, sha1, byte_string):
+        '''
+        @brief Appends an encoded granule as raw bytes
+        '''
+        self.append(sha1, {self.BYTES: np.frombuffer(byte_string, dtype='uint8')})
+
+    def _extend(self, f, path, values, offset):
+        if path not in f:
+            fillvalue = np.nan if values.dtype.kind == 'f' else None
+            f.create_dataset(path, shape=(0,) + values.shape[1:], maxshape=(None,) + values.shape[1:],
+                dtype=values.dtype, chunks=(self.chunk_size,) + values.shape[1:], fillvalue=fillvalue)
+        dataset = f[path]
+        # Variables missing from earlier granules are left at the fill value
+        dataset.resize((offset + len(values),) + values.shape[1:])
+        dataset[offset:offset + len(values)] = values
+
+    #--------------------------------------------------------------------------------
+    # Index
+    #--------------------------------------------------------------------------------
+
+    def _read_index(self, f):
+        '''
+        @brief Reads the granules appended since the index was last read into memory
+        @return dict of sha1 to (offset, count)
+        '''
+        granules = f[self.INDEX_COUNT].shape[0] if self.INDEX_COUNT in f else 0
+        if granules < self._granules:
+            # The store was removed and started again
+            self._spans, self._granules, self._records = {}, 0, 0
+        if granules > self._granules:
+            sha1s = f[self.INDEX_SHA1][self._granules:granules]
+            offsets = f[self.INDEX_OFFSET][self._granules:granules]
+            counts = f[self.INDEX_COUNT][self._granules:granules]
+            for sha1, offset, count in zip(sha1s, offsets, counts):
+                self._add_span(sha1, int(offset), int(count))
+        return self._spans
+
+    def _add_span(self, sha1, offset, count):
+        self._spans[sha1] = (offset, count)
+        self._granules += 1
+        self._records = offset + count
+
+    def spans(self, sha1s):
+        '''
+        @brief Locates granules in the store
+        @param sha1s list of granule sha1s
+        @return list of (offset, count) in the same order, None for granules not in the store
+        '''
+        spans = self._load_index()
+        return [spans.get(sha1) for sha1 in sha1s]
+
+    def has(self, sha1):
+        return sha1 in self._load_index()
+
+    def _load_index(self):
+        '''
+        @return dict of sha1 to (offset, count), current with the file
+        '''
+        if not self.exists():
+            return {}
+        with self._open('r') as f:
+            return self._read_index(f)
+
+    #--------------------------------------------------------------------------------
+    # Reading
+    #--------------------------------------------------------------------------------
+
+    @staticmethod
+    def coalesce(spans):
+        '''
+        @brief Joins adjacent spans so each contiguous run is read as one hyperslab
+        '''
+        runs = []
+        for offset, count in spans:
+            if runs and runs[-1][0] + runs[-1][1] == offset:
+                runs[-1] = (runs[-1][0], runs[-1][1] + count)
+            else:
+                runs.append((offset, count))
+        return runs
+
+    def read(self, paths, sha1s):
+        '''
+        @brief Reads the records of the granules in the order given
+        @param paths values paths to read
+        @param sha1s granule sha1s, all must be in the store
+        @return dict of values path to numpy array
+        '''
+        if not self.exists():
+            raise KeyError('There is no store for %s' % self.stream_id)
+
+        retval = {}
+        with self._open('r') as f:
+            index = self._read_index(f)
+            spans = [index.get(sha1) for sha1 in sha1s]
+            if None in spans:
+                raise KeyError('Granule %s is not in the store for %s' % (sha1s[spans.index(None)], self.stream_id))
+            runs = self.coalesce(spans)
+            for path in paths:
+                dataset = f[path]
+                slabs = [self._slab(dataset, offset, count) for offset, count in runs]
+                retval[path] = np.concatenate(slabs) if slabs else dataset[0:0]
+        return retval
+
+    def _slab(self, dataset, offset, count):
+        slab = dataset[offset:offset + count]
+        if len(slab) < count:
+            # The variable is missing from the last granules appended
+            padding = np.empty((count - len(slab),) + dataset.shape[1:], dtype=dataset.dtype)
+            padding.fill(dataset.fillvalue)
+            slab = np.concatenate([slab, padding])
+        return slab
+
+    def read_bytes(self, sha1):
+        '''
+        @brief Reads an encoded granule appended with append_bytes
+        @return byte string
+        '''
+        return self.read([self.BYTES], [sha1])[self.BYTES].tostring()
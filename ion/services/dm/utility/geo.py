@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/geo.py
+@description Geospatial helpers shared by the local search backend and the event query predicates
+'''
+import math
+
+EARTH_RADIUS = {'km' : 6371.0, 'mi' : 3958.76}
+
+
+def geo_point(value):
+    '''
+    @return (lon, lat) for a GeospatialLocation, a {lat, lon} dict or a [lon, lat] pair, otherwise None
+    '''
+    if isinstance(value, (list, tuple)) and len(value) == 2 and all(isinstance(v, (int, float)) for v in value):
+        return float(value[0]), float(value[1])
+    for lat, lon in (('lat', 'lon'), ('latitude', 'longitude')):
+        if isinstance(value, dict):
+            if lat in value and lon in value:
+                return float(value[lon]), float(value[lat])
+        elif hasattr(value, lat) and hasattr(value, lon):
+            return float(getattr(value, lon)), float(getattr(value, lat))
+    return None
+
+
+def distance(origin, point, units='km'):
+    '''
+    @brief Great circle distance between two (lon, lat) points
+    '''
+    lon1, lat1, lon2, lat2 = map(math.radians, (origin[0], origin[1], point[0], point[1]))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS.get(units, EARTH_RADIUS['km']) * math.asin(min(1., math.sqrt(a)))
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/granule_manifest.py
+@description Time indexed manifest of the granules persisted for a stream
+
+The manifest is a sidecar file in the cache hierarchy, one JSON line per persisted granule:
+    {"sha1": ..., "encoding": ..., "first": t0, "last": tn, "records": n}
+Ingestion appends to it and replay bisects it to open only the files that overlap a window.
+'''
+from bisect import bisect_left, bisect_right
+import os
+import simplejson
+
+from pyon.public import log
+from pyon.util.file_sys import FS, FileSystem
+
+
+class GranuleManifest(object):
+    '''
+    Reads and appends the manifest entries for a single stream.
+    '''
+    def __init__(self, stream_id):
+        self.stream_id = stream_id
+        self.path = FileSystem.get_hierarchical_url(FS.CACHE, '%s_manifest' % stream_id, '.json')
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def append(self, sha1, encoding, first, last, records):
+        '''
+        @brief Appends an entry for a persisted granule
+        @param sha1 sha1 of the persisted file
+        @param encoding file extension the granule was persisted with
+        @param first first timestamp in the granule
+        @param last last timestamp in the granule
+        @param records number of records in the granule
+        '''
+        entry = {'sha1':sha1, 'encoding':encoding, 'first':first, 'last':last, 'records':records}
+        # Single line appends keep concurrent workers from interleaving entries
+        with open(self.path, mode='a') as f:
+            f.write(simplejson.dumps(entry) + '\n')
+
+    def entries(self):
+        '''
+        @brief Loads the manifest ordered by the first timestamp of each granule, duplicates are dropped
+        @return list of entry dictionaries
+        '''
+        if not self.exists():
+            return []
+        retval = {}
+        with open(self.path, mode='r') as f:
+            for line in f:
+                try:
+                    entry = simplejson.loads(line)
+                except ValueError:
+                    log.warn('Skipping malformed manifest entry for stream %s', self.stream_id)
+                    continue
+                retval[entry['sha1']] = entry
+        return sorted(retval.itervalues(), key=lambda entry: (entry['first'], entry['sha1']))
+
+    @staticmethod
+    def in_time_range(entries, lower, upper):
+        '''
+        @brief Selects the entries whose time span overlaps [lower, upper]
+        @param entries list of entries ordered by first timestamp
+        @param lower lower time bound or None
+        @param upper upper time bound or None
+        @return list of overlapping entries
+        '''
+        stop = len(entries)
+        if upper is not None:
+            stop = bisect_right([entry['first'] for entry in entries], upper)
+        if lower is None:
+            return entries[:stop]
+        return [entry for entry in entries[:stop] if entry['last'] >= lower]
+
+    @staticmethod
+    def in_record_range(entries, lower, upper):
+        '''
+        @brief Selects the entries which hold the records [lower, upper) of the dataset
+        @param entries list of entries or parsed granules with a record count, in the order their records are merged
+        @param lower index of the first record
+        @param upper index after the last record or None
+        @return tuple of the overlapping entries and the record index where the first of them begins
+        '''
+        offsets = []
+        total = 0
+        for entry in entries:
+            offsets.append(total)
+            total += entry['records']
+
+        if lower >= total:
+            return [], 0
+        start = max(bisect_right(offsets, lower) - 1, 0)
+        stop = len(entries) if upper is None else bisect_left(offsets, upper)
+        if start >= stop:
+            return [], 0
+        return entries[start:stop], offsets[start]
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/hdf_image.py
+@description Reads the datasets of an HDF5 file held in memory
+
+Granules carry their HDF5 file as a byte string. The image is opened with the HDF5 core driver so the
+bytes never touch the disk, older h5py builds without file image support fall back to one temp file.
+HDFImage decodes every dataset, last_values reads only the last record of each.
+'''
+from contextlib import contextmanager
+import hashlib
+
+import h5py
+import numpy as np
+
+from pyon.public import log
+from pyon.util.file_sys import FileSystem
+
+
+class HDFImage(object):
+    '''
+    Decodes every dataset in an HDF5 byte string once, keyed by its full values path.
+    '''
+    def __init__(self, hdf_string):
+        self.sha1 = hashlib.sha1(hdf_string).hexdigest().upper()
+        self.datasets = {}
+        self.temp_files = 0 # Number of temp files written to decode this image
+        self._load(hdf_string)
+
+    def _load(self, hdf_string):
+        with open_image(hdf_string, self.sha1) as f:
+            if f.temp_file:
+                self.temp_files += 1
+            f.visititems(self._visit)
+
+    def _visit(self, name, obj):
+        if isinstance(obj, h5py.Dataset):
+            self.datasets['/' + name.lstrip('/')] = obj[...]
+
+    def values(self, values_path, slice_=None):
+        '''
+        @brief Gets the values of a dataset
+        @param values_path full path of the dataset in the file
+        @param slice_ optional record slice
+        @return numpy array
+        '''
+        values = self.datasets['/' + values_path.lstrip('/')]
+        if slice_ is not None:
+            values = values[slice_]
+        return values
+
+    @staticmethod
+    def bounds(values):
+        '''
+        @brief Computes the range of a vector, ignoring nans
+        @return tuple (min, max)
+        '''
+        if not len(values):
+            return (np.nan, np.nan)
+        return (np.nanmin(values), np.nanmax(values))
+
+
+@contextmanager
+def open_image(hdf_string, name=None):
+    '''
+    @brief Opens an HDF5 byte string read only, the file has a temp_file attribute set when it went through disk
+    '''
+    name = name or hashlib.sha1(hdf_string).hexdigest().upper()
+    try:
+        fapl = h5py.h5p.create(h5py.h5p.FILE_ACCESS)
+        fapl.set_fapl_core(backing_store=False)
+        fapl.set_file_image(hdf_string)
+        f = h5py.File(h5py.h5f.open(name, h5py.h5f.ACC_RDONLY, fapl=fapl))
+        f.temp_file = False
+    except AttributeError:
+        log.debug('h5py has no file image support, decoding through a temp file')
+        f = None
+
+    if f is not None:
+        try:
+            yield f
+        finally:
+            f.close()
+        return
+
+    temp = FileSystem.mktemp()
+    temp.write(hdf_string)
+    path = temp.name
+    temp.close()
+    try:
+        f = h5py.File(path, 'r')
+        f.temp_file = True
+        try:
+            yield f
+        finally:
+            f.close()
+    finally:
+        FileSystem.unlink(path)
+
+
+def last_values(hdf_string, values_paths=None):
+    '''
+    @brief Reads the last record of datasets without decoding the rest of them
+    @param values_paths full paths of the datasets to read, all of the datasets when None
+    @return dict of full values path to the last value, None for an empty dataset. Missing paths are left out.
+    '''
+    retval = {}
+
+    def read_last(path, dataset):
+        retval['/' + path.lstrip('/')] = dataset[-1] if dataset.shape and dataset.shape[0] else None
+
+    with open_image(hdf_string) as f:
+        if values_paths is None:
+            f.visititems(lambda name, obj : read_last(name, obj) if isinstance(obj, h5py.Dataset) else None)
+        else:
+            for path in values_paths:
+                dataset = f.get(path)
+                if isinstance(dataset, h5py.Dataset):
+                    read_last(path, dataset)
+    return retval
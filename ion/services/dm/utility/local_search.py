@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/local_search.py
+@description In memory search backend for discovery when ElasticSearch is disabled
+
+Resources are indexed under the same index names the IndexBootStrap creates in ElasticSearch, plus the
+resources index holding everything. Each index keeps
+    - an inverted index of field -> lower cased value -> resource ids for term (wildcard) queries
+    - a sorted list of (value, resource id) per numeric field for range queries
+    - a one degree grid of resource ids per geo field for bounding box and distance queries
+The backend follows ResourceModifiedEvents from start and loads the registry on the first query, one
+find_resources call per resource type.
+'''
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from fnmatch import fnmatchcase
+import math
+
+from gevent.coros import RLock
+
+from pyon.core.bootstrap import get_sys_name
+from pyon.core.exception import NotFound
+from pyon.event.event import EventSubscriber
+from pyon.public import RT, log
+from ion.services.dm.utility.geo import EARTH_RADIUS, geo_point, distance
+
+
+def resource_type(resource):
+    if isinstance(resource, dict):
+        return resource.get('type_')
+    return resource._get_type()
+
+
+def resource_fields(resource):
+    if isinstance(resource, dict):
+        return [(field, value) for field, value in resource.iteritems() if field != '_id']
+    return [(field, getattr(resource, field, None)) for field in resource._schema]
+
+
+def getattr_or_key(resource, field):
+    if isinstance(resource, dict):
+        return resource.get(field)
+    return getattr(resource, field, None)
+
+
+class _Last(object):
+    '''
+    Sorts after every resource id, bounds the range of (value, resource id) entries sharing a value.
+    '''
+    def __eq__(self, other):
+        return self is other
+    def __ne__(self, other):
+        return self is not other
+    def __lt__(self, other):
+        return False
+    def __le__(self, other):
+        return self is other
+    def __gt__(self, other):
+        return self is not other
+    def __ge__(self, other):
+        return True
+
+LAST = _Last()
+
+
+class LocalSearchIndex(object):
+    '''
+    Term, range and geo indexes over the fields of a set of resources.
+    '''
+    def __init__(self, name, resource_types=None):
+        self.name = name
+        self.resource_types = set(resource_types) if resource_types else None # None holds every type
+        self.resources = {}
+        self.terms = defaultdict(lambda : defaultdict(set))
+        self.numbers = defaultdict(list)
+        self.grid = defaultdict(lambda : defaultdict(set))
+        self.points = defaultdict(dict)
+        self._entries = defaultdict(list) # resource id -> index entries to remove it
+
+    def accepts(self, resource):
+        return self.resource_types is None or resource_type(resource) in self.resource_types
+
+    def add(self, resource_id, resource):
+        self.remove(resource_id)
+        self.resources[resource_id] = resource
+        entries = self._entries[resource_id]
+        for field, value in resource_fields(resource):
+            if isinstance(value, basestring):
+                value = value.lower()
+                self.terms[field][value].add(resource_id)
+                entries.append(('term', field, value))
+            elif isinstance(value, (int, long, float)) and not isinstance(value, bool):
+                insort(self.numbers[field], (value, resource_id))
+                entries.append(('number', field, value))
+            else:
+                point = geo_point(value)
+                if point is None:
+                    continue
+                cell = self._cell(point)
+                self.grid[field][cell].add(resource_id)
+                self.points[field][resource_id] = point
+                entries.append(('geo', field, cell))
+
+    def remove(self, resource_id):
+        self.resources.pop(resource_id, None)
+        for kind, field, key in self._entries.pop(resource_id, []):
+            if kind == 'term':
+                self.terms[field][key].discard(resource_id)
+                if not self.terms[field][key]:
+                    del self.terms[field][key]
+            elif kind == 'number':
+                values = self.numbers[field]
+                i = bisect_left(values, (key, resource_id))
+                if i < len(values) and values[i] == (key, resource_id):
+                    del values[i]
+            else:
+                self.grid[field][key].discard(resource_id)
+                self.points[field].pop(resource_id, None)
+
+    @staticmethod
+    def _cell(point):
+        return int(math.floor(point[0])), int(math.floor(point[1]))
+
+    #--------------------------------------------------------------------------------
+    # Queries, each returns a set of resource ids
+    #--------------------------------------------------------------------------------
+
+    def term(self, field, value):
+        value = value.lower()
+        fields = self.terms.keys() if field in ('*', '_all') else [field]
+        matches = set()
+        wildcard = any(c in value for c in '*?[')
+        for f in fields:
+            vocabulary = self.terms.get(f, {})
+            if not wildcard:
+                matches.update(vocabulary.get(value, ()))
+                continue
+            for term, resource_ids in vocabulary.iteritems():
+                if fnmatchcase(term, value):
+                    matches.update(resource_ids)
+        return matches
+
+    def range(self, field, from_value, to_value):
+        values = self.numbers.get(field, [])
+        lower = bisect_left(values, (from_value,))
+        upper = bisect_right(values, (to_value, LAST))
+        return set(resource_id for _, resource_id in values[lower:upper])
+
+    def geo_bbox(self, field, top_left, bottom_right):
+        (west, north), (east, south) = top_left, bottom_right
+        return self._in_box(field, west, south, east, north)
+
+    def _in_box(self, field, west, south, east, north):
+        grid = self.grid.get(field, {})
+        points = self.points.get(field, {})
+        x0, x1 = int(math.floor(west)), int(math.floor(east))
+        y0, y1 = int(math.floor(south)), int(math.floor(north))
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(grid):
+            # Large boxes scan the occupied cells instead
+            cells = [resource_ids for (lon, lat), resource_ids in grid.iteritems() if x0 <= lon <= x1 and y0 <= lat <= y1]
+        else:
+            cells = [grid[(lon, lat)] for lon in xrange(x0, x1 + 1) for lat in xrange(y0, y1 + 1) if (lon, lat) in grid]
+        matches = set()
+        for resource_ids in cells:
+            for resource_id in resource_ids:
+                lon, lat = points[resource_id]
+                if west <= lon <= east and south <= lat <= north:
+                    matches.add(resource_id)
+        return matches
+
+    def geo_distance(self, field, origin, dist, units):
+        '''
+        @return list of (distance, resource id) within dist of origin, nearest first
+        '''
+        dist = float(dist)
+        # Degrees spanned by the distance, used to select the candidate cells
+        dlat = math.degrees(dist / EARTH_RADIUS.get(units, EARTH_RADIUS['km']))
+        dlon = min(dlat / max(math.cos(math.radians(origin[1])), 1e-6), 180.)
+        candidates = self._in_box(field, origin[0] - dlon, max(origin[1] - dlat, -90.), origin[0] + dlon, min(origin[1] + dlat, 90.))
+        points = self.points.get(field, {})
+        hits = [(distance(origin, points[resource_id], units), resource_id) for resource_id in candidates]
+        return sorted(hit for hit in hits if hit[0] <= dist)
+
+    #--------------------------------------------------------------------------------
+    # Results
+    #--------------------------------------------------------------------------------
+
+    def results(self, resource_ids, order=None, limit=0, offset=0, id_only=False):
+        '''
+        @brief Orders and pages the matches like the ElasticSearch path does
+        '''
+        resource_ids = list(resource_ids)
+        if order:
+            for field, direction in order.items()[::-1]:
+                resource_ids.sort(key=lambda resource_id : getattr_or_key(self.resources[resource_id], field), reverse=(direction == 'desc'))
+        if offset:
+            resource_ids = resource_ids[offset:]
+        if limit:
+            resource_ids = resource_ids[:limit]
+        if id_only:
+            return resource_ids
+        return [self.resources[resource_id] for resource_id in resource_ids]
+
+
+class LocalSearchBackend(object):
+    '''
+    The set of local indexes discovery searches when ElasticSearch is disabled.
+    '''
+    def __init__(self, resource_registry, indexes=None):
+        '''
+        @param indexes dict of index name to resource types, defaults to the standard ElasticSearch indexes
+        '''
+        self.RR = resource_registry
+        if indexes is None:
+            from ion.processes.bootstrap.index_bootstrap import STD_INDEXES
+            indexes = dict(STD_INDEXES)
+            indexes['%s_resources_index' % get_sys_name().lower()] = None
+        self.indexes = dict((name, LocalSearchIndex(name, types)) for name, types in indexes.iteritems())
+        self.subscriber = None
+        self.loaded = False
+        self._lock = RLock()
+
+    def start(self):
+        self.subscriber = EventSubscriber(event_type="ResourceModifiedEvent", callback=self._resource_modified_callback)
+        self.subscriber.activate()
+
+    def stop(self):
+        if self.subscriber is not None:
+            self.subscriber.deactivate()
+            self.subscriber = None
+
+    def load(self):
+        with self._lock:
+            count = 0
+            for restype in RT.values():
+                resources, _ = self.RR.find_resources(restype=restype, id_only=False)
+                for resource in resources:
+                    self.index_resource(resource)
+                    count += 1
+            self.loaded = True
+            log.debug('Local search indexed %d resources', count)
+
+    def _ensure_loaded(self):
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    self.load()
+
+    def _resource_modified_callback(self, event, *args, **kwargs):
+        try:
+            resource = self.RR.read(event.origin)
+        except NotFound:
+            self.remove_resource(event.origin)
+            return
+        self.index_resource(resource)
+
+    def index_resource(self, resource):
+        resource_id = resource._id
+        # Retired resources are dropped, like the ElasticSearch river script does
+        if getattr_or_key(resource, 'lcstate') == 'RETIRED':
+            self.remove_resource(resource_id)
+            return
+        for index in self.indexes.itervalues():
+            if index.accepts(resource):
+                index.add(resource_id, resource)
+            else:
+                index.remove(resource_id)
+
+    def remove_resource(self, resource_id):
+        for index in self.indexes.itervalues():
+            index.remove(resource_id)
+
+    def get_index(self, source_id):
+        '''
+        @brief Finds a local index by name or by the id of its index resource
+        '''
+        self._ensure_loaded()
+        if source_id in self.indexes:
+            return self.indexes[source_id]
+        try:
+            source = self.RR.read(source_id)
+        except NotFound:
+            source = None
+        name = getattr(source, 'index_name', None) or getattr(source, 'name', None)
+        if name not in self.indexes:
+            raise NotFound('No local search index for %s' % source_id)
+        return self.indexes[name]
+
+    #--------------------------------------------------------------------------------
+    # DiscoveryService query methods
+    #--------------------------------------------------------------------------------
+
+    def query_term(self, source_id, field, value, order=None, limit=0, offset=0, id_only=False):
+        index = self.get_index(source_id)
+        return index.results(index.term(field, value), order, limit, offset, id_only)
+
+    def query_range(self, source_id, field, from_value, to_value, order=None, limit=0, offset=0, id_only=False):
+        index = self.get_index(source_id)
+        return index.results(index.range(field, from_value, to_value), order, limit, offset, id_only)
+
+    def query_geo_bbox(self, source_id, field, top_left, bottom_right, order=None, limit=0, offset=0, id_only=False):
+        index = self.get_index(source_id)
+        return index.results(index.geo_bbox(field, top_left, bottom_right), order, limit, offset, id_only)
+
+    def query_geo_distance(self, source_id, field, origin, dist, units='mi', order=None, limit=0, offset=0, id_only=False):
+        index = self.get_index(source_id)
+        # Nearest first, an explicit order is applied on top of it
+        resource_ids = [resource_id for _, resource_id in index.geo_distance(field, origin, dist, units)]
+        return index.results(resource_ids, order, limit, offset, id_only)
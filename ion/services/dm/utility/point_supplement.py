@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/point_supplement.py
+@description Bulk population of a PointSupplementConstructor from whole arrays
+
+Transforms receive vectors from PointSupplementStreamParser and used to index them one sample at a time, each
+index into a numpy array boxing a new numpy scalar. point_granule hands the constructor the first point only, which
+lays out the identifiables of the granule, and then encodes the whole arrays as the granule's dataset.
+'''
+import hashlib
+
+import numpy as np
+
+from interface.objects import CoordinateAxis, RangeSet
+from prototype.hdf.hdf_codec import HDFEncoder
+from prototype.sci_data.constructor_apis import PointSupplementConstructor
+
+
+def _as_list(values):
+    if isinstance(values, np.ndarray):
+        return values.tolist()
+    return list(values)
+
+
+def add_point_coverages(psc, time, longitude, latitude, height, coverages):
+    '''
+    @brief Adds one point per record and its scalar coverages to the constructor
+    @param psc PointSupplementConstructor to populate
+    @param time vector of times
+    @param longitude vector of longitudes
+    @param latitude vector of latitudes
+    @param height vector of heights
+    @param coverages dict of coverage id to vector of values, all the same length as time
+    @return list of the point ids added
+    '''
+    time = _as_list(time)
+    locations = zip(_as_list(longitude), _as_list(latitude), _as_list(height))
+    coverages = [(coverage_id, _as_list(values)) for coverage_id, values in coverages.iteritems()]
+
+    for coverage_id, values in coverages:
+        if len(values) != len(time):
+            raise ValueError('Coverage %s has %d values for %d points' % (coverage_id, len(values), len(time)))
+
+    add_point = psc.add_point
+    add_coverage = psc.add_scalar_point_coverage
+
+    point_ids = []
+    for i in xrange(len(time)):
+        point_id = add_point(time=time[i], location=locations[i])
+        for coverage_id, values in coverages:
+            add_coverage(point_id=point_id, coverage_id=coverage_id, value=values[i])
+        point_ids.append(point_id)
+    return point_ids
+
+
+def _construct(definition, stream_id, time, longitude, latitude, height, coverages):
+    psc = PointSupplementConstructor(point_definition=definition, stream_id=stream_id)
+    add_point_coverages(psc, time, longitude, latitude, height, coverages)
+    return psc.close_stream_granule()
+
+
+def point_granule(definition, stream_id, time, longitude, latitude, height, coverages):
+    '''
+    @brief Builds the granule of a stream of points from whole arrays
+    @param definition point stream definition
+    @param stream_id id of the stream the granule is published on
+    @param time vector of times
+    @param longitude vector of longitudes
+    @param latitude vector of latitudes
+    @param height vector of heights
+    @param coverages dict of coverage id to vector of values, all the same length as time
+    @return the closed stream granule
+    '''
+    fields = {'time':time, 'longitude':longitude, 'latitude':latitude, 'height':height}
+    fields.update(coverages)
+    fields = dict((field_id, np.asarray(values)) for field_id, values in fields.iteritems())
+    for field_id, values in fields.iteritems():
+        if len(values) != len(fields['time']):
+            raise ValueError('Field %s has %d values for %d points' % (field_id, len(values), len(fields['time'])))
+
+    # Granules whose fields can not all be located in the definition are built one point at a time
+    range_ids = dict((field_id, getattr(definition.identifiables.get(field_id), 'range_id', None)) for field_id in fields)
+    if len(fields['time']) < 2 or None in range_ids.values():
+        return _construct(definition, stream_id, time, longitude, latitude, height, coverages)
+
+    granule = _construct(definition, stream_id, fields['time'][:1], fields['longitude'][:1], fields['latitude'][:1],
+        fields['height'][:1], dict((coverage_id, fields[coverage_id][:1]) for coverage_id in coverages))
+
+    ranges = [key for key, value in granule.identifiables.iteritems() if isinstance(value, (RangeSet, CoordinateAxis))]
+    if not set(ranges).issubset(range_ids.values()):
+        return _construct(definition, stream_id, time, longitude, latitude, height, coverages)
+
+    codec = HDFEncoder()
+    for field_id, values in fields.iteritems():
+        range_id = range_ids[field_id]
+        range_set = granule.identifiables[range_id]
+        values_path = range_set.values_path or definition.identifiables[range_id].values_path
+        codec.add_hdf_dataset(values_path, values)
+        if range_set.bounds_id:
+            granule.identifiables[range_set.bounds_id].value_pair = [float(np.nanmin(values)), float(np.nanmax(values))]
+    hdf_string = codec.encoder_close()
+
+    data_stream_id = definition.data_stream_id
+    data_stream = definition.identifiables[data_stream_id]
+    granule.identifiables[data_stream.element_count_id].value = len(fields['time'])
+    granule.identifiables[data_stream_id].values = hdf_string
+    granule.identifiables[data_stream.encoding_id].sha1 = hashlib.sha1(hdf_string).hexdigest().upper()
+    return granule
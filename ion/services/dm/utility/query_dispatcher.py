@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/query_dispatcher.py
+@description Matches events against many registered queries at once
+
+A parsed query matches when one of its 'or' clauses matches or when its main clause and all of its 'and' clauses
+match. Each of those alternatives is indexed by one clause it needs, an event is then only evaluated against the
+queries with an alternative whose clause it satisfies:
+    - term clauses by field and value
+    - range clauses in an interval tree per field
+    - geo clauses are checked for every event
+'''
+from collections import defaultdict
+
+from ion.services.dm.utility.query_language import QueryLanguage
+
+_MISSING = object()
+
+
+class IntervalTree(object):
+    '''
+    Static centered interval tree of (low, high, key), answers which intervals contain a value.
+    '''
+    def __init__(self, intervals):
+        self.center = None
+        self.by_low = self.by_high = ()
+        self.left = self.right = None
+        if not intervals:
+            return
+        endpoints = sorted(bound for low, high, _ in intervals for bound in (low, high))
+        self.center = endpoints[len(endpoints) // 2]
+        here, left, right = [], [], []
+        for interval in intervals:
+            if interval[1] < self.center:
+                left.append(interval)
+            elif interval[0] > self.center:
+                right.append(interval)
+            else:
+                here.append(interval)
+        self.by_low = sorted(here, key=lambda interval : interval[0])
+        self.by_high = sorted(here, key=lambda interval : interval[1], reverse=True)
+        self.left = IntervalTree(left) if left else None
+        self.right = IntervalTree(right) if right else None
+
+    def stab(self, value, keys):
+        '''
+        @brief Adds the keys of the intervals containing value to the set keys
+        '''
+        node = self
+        while node is not None and node.center is not None:
+            if value < node.center:
+                for low, high, key in node.by_low:
+                    if low > value:
+                        break
+                    keys.add(key)
+                node = node.left
+            elif value > node.center:
+                for low, high, key in node.by_high:
+                    if high < value:
+                        break
+                    keys.add(key)
+                node = node.right
+            else:
+                keys.update(key for _, _, key in node.by_low)
+                break
+        return keys
+
+
+class QueryDispatcher(object):
+    '''
+    Registry of compiled queries keyed by the caller, e.g. by notification id.
+    '''
+    def __init__(self):
+        self.conditions = {}
+        self.terms = defaultdict(lambda : defaultdict(set)) # field -> value -> keys
+        self.ranges = defaultdict(dict) # field -> key -> list of (from, to)
+        self.unindexed = set()
+        self._trees = {} # field -> IntervalTree, rebuilt after the ranges of the field change
+        self._anchors = {} # key -> clauses it is indexed by
+
+    def __len__(self):
+        return len(self.conditions)
+
+    def __contains__(self, key):
+        return key in self.conditions
+
+    def add(self, key, query_dict):
+        '''
+        @brief Registers the parsed query under key, replacing any query already registered under it
+        '''
+        condition = QueryLanguage.compile_condition(query_dict)
+        self.remove(key)
+        self.conditions[key] = condition
+
+        anchors = [self._anchor([query_dict['query']] + list(query_dict['and']))]
+        anchors.extend(self._anchor([query]) for query in query_dict['or'])
+        self._anchors[key] = anchors
+        for anchor in anchors:
+            if anchor is None:
+                self.unindexed.add(key)
+            elif QueryLanguage.query_is_term_search(anchor):
+                self.terms[anchor['field']][anchor['value']].add(key)
+            else:
+                self.ranges[anchor['field']].setdefault(key, []).append((anchor['range']['from'], anchor['range']['to']))
+                self._trees.pop(anchor['field'], None)
+
+    @staticmethod
+    def _anchor(queries):
+        '''
+        @brief Picks the clause to index a conjunction by, terms are the most selective
+        @return a term or range clause, None when the conjunction can only be checked per event
+        '''
+        for is_kind in (QueryLanguage.query_is_term_search, QueryLanguage.query_is_range_search):
+            for query in queries:
+                if is_kind(query):
+                    return query
+        return None
+
+    def remove(self, key):
+        self.conditions.pop(key, None)
+        self.unindexed.discard(key)
+        for anchor in self._anchors.pop(key, None) or []:
+            if anchor is None:
+                continue
+            field = anchor['field']
+            if QueryLanguage.query_is_term_search(anchor):
+                values = self.terms[field]
+                values[anchor['value']].discard(key)
+                if not values[anchor['value']]:
+                    del values[anchor['value']]
+            elif self.ranges[field].pop(key, None) is not None:
+                self._trees.pop(field, None)
+
+    def _tree(self, field):
+        tree = self._trees.get(field)
+        if tree is None:
+            tree = IntervalTree([(low, high, key) for key, intervals in self.ranges[field].iteritems() for low, high in intervals])
+            self._trees[field] = tree
+        return tree
+
+    def candidates(self, event):
+        '''
+        @return set of the keys whose query the event may match
+        '''
+        keys = set(self.unindexed)
+        for field, values in self.terms.iteritems():
+            if not values:
+                continue
+            field_val = getattr(event, field, _MISSING)
+            if field_val is not _MISSING:
+                keys.update(values.get(str(field_val), ()))
+        for field, intervals in self.ranges.iteritems():
+            if not intervals:
+                continue
+            field_val = getattr(event, field, _MISSING)
+            if field_val is not _MISSING:
+                self._tree(field).stab(field_val, keys)
+        return keys
+
+    def match(self, event):
+        '''
+        @return list of the keys whose query matches the event
+        '''
+        conditions = self.conditions
+        return [key for key in self.candidates(event) if conditions[key](event)]
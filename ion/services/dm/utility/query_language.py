@@ -7,6 +7,9 @@
 '''
 from pyparsing import ParseException, Regex, quotedString, CaselessLiteral, MatchFirst, removeQuotes, Optional
 from pyon.core.exception import BadRequest
+from ion.services.dm.utility.geo import geo_point, distance
+
+_MISSING = object()
 
 
 class QueryLanguage(object):
@@ -264,60 +267,76 @@ class QueryLanguage(object):
             return True
         return False
 
+    #=========================================
+    # Event matching
+    #=========================================
     @classmethod
-    def match(cls, event = None, query = None):
-
-        field_val = getattr(event,query['field'])
+    def compile(cls, query=None):
+        '''
+        Compiles a search clause to a predicate on events, the clause is inspected once instead of per event.
+        An event without the field does not match.
+        '''
+        field = query['field']
 
         if cls.query_is_term_search(query):
             # This is a term search - always a string
-
             #@todo implement using regex to mimic lucene...
-
-            if str(field_val) == query['value']:
-                return True
+            value = query['value']
+            def predicate(event):
+                field_val = getattr(event, field, _MISSING)
+                return field_val is not _MISSING and str(field_val) == value
 
         elif cls.query_is_range_search(query):
             # always a numeric value - float or int
-            if (field_val >=  query['range']['from']) and (field_val <= query['range']['to']):
-                return True
-            else:
-                return False
+            from_value, to_value = query['range']['from'], query['range']['to']
+            def predicate(event):
+                field_val = getattr(event, field, _MISSING)
+                return field_val is not _MISSING and from_value <= field_val <= to_value
 
         elif cls.query_is_geo_distance_search(query):
-            #@todo - wait on this one...
-            pass
+            origin, dist, units = (query['lon'], query['lat']), query['dist'], query['units']
+            def predicate(event):
+                point = geo_point(getattr(event, field, None))
+                return point is not None and distance(origin, point, units) <= dist
 
         elif cls.query_is_geo_bbox_search(query):
-            #@todo implement this now.
+            (west, north), (east, south) = query['top_left'], query['bottom_right']
+            def predicate(event):
+                point = geo_point(getattr(event, field, None))
+                return point is not None and west <= point[0] <= east and south <= point[1] <= north
 
-#            self.assertTrue(retval == {'and':[], 'or':[], 'query':{'field':'location', 'top_left':[0.0, 40.0],
-#                                                                       'bottom_right': [40.0, 0.0], 'index':'index'}})
-
-#            if field_val
-
-            pass
         else:
             raise BadRequest("Missing parameters value and range for query: %s" % query)
 
-    @classmethod
-    def evaluate_condition(cls, event = None, query_dict = {} ):
+        return predicate
 
-        query = query_dict['query']
-        or_queries= query_dict['or']
-        and_queries = query_dict['and']
+    @classmethod
+    def compile_condition(cls, query_dict=None):
+        '''
+        Compiles a parsed query to a predicate on events with the semantics of evaluate_condition:
+        any of the 'or' queries, or the main query and all of the 'and' queries
+        '''
+        query = cls.compile(query_dict['query'])
+        or_queries = [cls.compile(q) for q in query_dict['or']]
+        and_queries = [cls.compile(q) for q in query_dict['and']]
 
-        # if any of the queries in the list of 'or queries' gives a match, publish an event
-        if or_queries:
+        def condition(event):
             for or_query in or_queries:
-                if cls.match(event, or_query):
+                if or_query(event):
                     return True
-
-        # if an 'and query' or a list of 'and queries' is provided, return if the match returns false for
-        # any one of them
-        if and_queries:
             for and_query in and_queries:
-                if not cls.match(event, and_query):
+                if not and_query(event):
                     return False
-        return cls.match(event, query)
+            return query(event)
+        return condition
+
+    @classmethod
+    def match(cls, event = None, query = None):
+        return cls.compile(query)(event)
 
+    @classmethod
+    def evaluate_condition(cls, event = None, query_dict = {} ):
+        '''
+        Callers matching many events against the same query should hold on to compile_condition(query_dict)
+        '''
+        return cls.compile_condition(query_dict)(event)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/query_planner.py
+@description Compiles discovery queries to ElasticSearch request bodies and runs them over pooled connections
+
+A request parsed by QueryLanguage is
+    {'query': {...}, 'and': [{...}, ...], 'or': [{...}, ...]}
+and means (query AND and[0] AND ...) OR or[0] OR ...
+Term, range and geo clauses against the same index compile to one bool query so the intersection, union,
+ordering and paging happen in ElasticSearch. Association and collection clauses are not in the index and are
+left to the caller to resolve with set operations.
+'''
+from collections import deque
+import httplib
+import socket
+
+import simplejson
+
+from pyon.public import log
+from ion.services.dm.utility.query_language import QueryLanguage
+
+
+class QueryPlanner(object):
+
+    @staticmethod
+    def is_search_clause(query):
+        '''
+        True for the clauses which can be answered by ElasticSearch
+        '''
+        return QueryLanguage.query_is_term_search(query) or QueryLanguage.query_is_range_search(query) \
+            or QueryLanguage.query_is_geo_distance_search(query) or QueryLanguage.query_is_geo_bbox_search(query)
+
+    @staticmethod
+    def _field(field):
+        if field == '*':
+            return '_all'
+        return field
+
+    @classmethod
+    def term(cls, field, value):
+        return {'wildcard' : {cls._field(field) : value}}
+
+    @classmethod
+    def range(cls, field, from_value, to_value):
+        return {'range' : {cls._field(field) : {'from' : from_value, 'to' : to_value}}}
+
+    @classmethod
+    def geo_distance(cls, field, origin, distance, units):
+        return {'geo_distance' : {'distance' : '%s%s' % (distance, units), cls._field(field) : list(origin)}}
+
+    @classmethod
+    def geo_bbox(cls, field, top_left, bottom_right):
+        return {'geo_bounding_box' : {cls._field(field) : {'top_left' : list(top_left), 'bottom_right' : list(bottom_right)}}}
+
+    @staticmethod
+    def filtered(filter_):
+        return {'filtered' : {'query' : {'match_all' : {}}, 'filter' : filter_}}
+
+    @classmethod
+    def compile_clause(cls, query):
+        '''
+        @brief Compiles a single search clause to an ElasticSearch query
+        '''
+        if QueryLanguage.query_is_term_search(query):
+            return cls.term(query['field'].lower(), query['value'].lower())
+        if QueryLanguage.query_is_range_search(query):
+            return cls.range(query['field'], query['range']['from'], query['range']['to'])
+        if QueryLanguage.query_is_geo_distance_search(query):
+            # Filters go through constant_score so they can sit in a bool query
+            return {'constant_score' : {'filter' : cls.geo_distance(query['field'], [query['lon'], query['lat']], query['dist'], query['units'])}}
+        if QueryLanguage.query_is_geo_bbox_search(query):
+            return {'constant_score' : {'filter' : cls.geo_bbox(query['field'], query['top_left'], query['bottom_right'])}}
+        raise ValueError('Not a search clause: %s' % query)
+
+    @classmethod
+    def compile_bool(cls, must=None, should=None):
+        '''
+        @brief Compiles (must[0] AND must[1] ...) OR should[0] OR ... to a single bool query
+        '''
+        must = [cls.compile_clause(q) for q in must or []]
+        should = [cls.compile_clause(q) for q in should or []]
+        if len(must) == 1 and not should:
+            return must[0]
+        if not should:
+            return {'bool' : {'must' : must}}
+        if must:
+            should.insert(0, must[0] if len(must) == 1 else {'bool' : {'must' : must}})
+        return {'bool' : {'should' : should, 'minimum_number_should_match' : 1}}
+
+    @staticmethod
+    def body(query, order=None, limit=0, offset=0, sort=None):
+        '''
+        @brief Builds the search body, pushing ordering and paging down to ElasticSearch
+        @param order dict of field to 'asc' or 'desc'
+        @param sort list of additional sort clauses appended after order
+        '''
+        body = {'query' : query}
+        sorts = [{field : {'order' : direction}} for field, direction in (order or {}).iteritems()]
+        sorts.extend(sort or [])
+        if sorts:
+            body['sort'] = sorts
+        if limit:
+            body['size'] = limit
+        if offset:
+            body['from'] = offset
+        return body
+
+    @staticmethod
+    def paging(query):
+        '''
+        @brief Gets the order, limit and offset parameters of a parsed clause
+        '''
+        return dict((key, query[key]) for key in ('order', 'limit', 'offset') if query.get(key))
+
+
+class ElasticSearchPool(object):
+    '''
+    Keep-alive HTTP connections to one ElasticSearch host, shared by every caller in the container.
+    '''
+    _pools = {}
+
+    @classmethod
+    def get(cls, host, port):
+        key = (host, str(port))
+        if key not in cls._pools:
+            cls._pools[key] = cls(host, port)
+        return cls._pools[key]
+
+    def __init__(self, host, port, size=4, timeout=10):
+        self.host = host
+        self.port = int(port)
+        self.size = size
+        self.timeout = timeout
+        self._idle = deque()
+
+    def _acquire(self):
+        try:
+            return self._idle.pop(), True
+        except IndexError:
+            return httplib.HTTPConnection(self.host, self.port, timeout=self.timeout), False
+
+    def _release(self, connection):
+        if len(self._idle) < self.size:
+            self._idle.append(connection)
+        else:
+            connection.close()
+
+    def request(self, method, path, body=None):
+        '''
+        @brief Sends a request on a pooled connection
+        @return the decoded JSON response
+        '''
+        payload = simplejson.dumps(body) if body is not None else None
+        while True:
+            connection, reused = self._acquire()
+            try:
+                connection.request(method, path, payload, {'Content-Type' : 'application/json'})
+                data = connection.getresponse().read()
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                if reused:
+                    # The server closed the idle connection, retry on a new one
+                    log.debug('Reconnecting to ElasticSearch at %s:%s', self.host, self.port)
+                    continue
+                raise
+            self._release(connection)
+            return simplejson.loads(data)
+
+    def search(self, index_name, body):
+        return self.request('POST', '/%s/_search' % index_name, body)
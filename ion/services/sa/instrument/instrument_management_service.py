@@ -18,6 +18,7 @@ from pyon.core.exception import Inconsistent,BadRequest, NotFound
 from pyon.ion.resource import ExtendedResourceContainer
 from pyon.util.log import log
 from ion.services.sa.instrument.flag import KeywordFlag
+from ion.services.coi.association_index import indexed_registry
 import os
 import pwd
 import gevent
@@ -81,7 +82,7 @@ class InstrumentManagementService(BaseInstrumentManagementService):
         # we hide these behind checks even though we expect them so that
         # the resource_impl_metatests will work
         if hasattr(self.clients, "resource_registry"):
-            self.RR    = self.clients.resource_registry
+            self.RR    = indexed_registry(self.clients.resource_registry)
 
         if hasattr(self.clients, "data_acquisition_management"):
             self.DAMS  = self.clients.data_acquisition_management
@@ -8,6 +8,7 @@
 from pyon.public import PRED, RT, LCS
 from pyon.ion.resource import get_maturity_visibility
 from ion.services.sa.instrument.flag import KeywordFlag
+from ion.services.coi.association_index import indexed_registry
 
 class Policy(object):
 
@@ -15,7 +16,7 @@ class Policy(object):
         self.clients = clients
 
         if hasattr(clients, "resource_registry"):
-            self.RR = self.clients.resource_registry
+            self.RR = indexed_registry(self.clients.resource_registry)
 
         self.on_policy_init()
 
@@ -20,6 +20,7 @@ from ion.services.sa.observatory.observatory_impl import ObservatoryImpl
 from ion.services.sa.observatory.subsite_impl import SubsiteImpl
 from ion.services.sa.observatory.platform_site_impl import PlatformSiteImpl
 from ion.services.sa.observatory.instrument_site_impl import InstrumentSiteImpl
+from ion.services.coi.association_index import indexed_registry
 
 #for logical/physical associations, it makes sense to search from MFMS
 from ion.services.sa.instrument.instrument_device_impl import InstrumentDeviceImpl
@@ -63,7 +64,7 @@ class ObservatoryManagementService(BaseObservatoryManagementService):
 
         #shortcut names for the import sub-services
         if hasattr(self.clients, "resource_registry"):
-            self.RR    = self.clients.resource_registry
+            self.RR    = indexed_registry(self.clients.resource_registry)
             
         if hasattr(self.clients, "instrument_management"):
             self.IMS   = self.clients.instrument_management
@@ -240,8 +240,14 @@ class DataProductManagementService(BaseDataProductManagementService):
         datastore_name = CACHE_DATASTORE_NAME
         db = self.container.datastore_manager.get_datastore(datastore_name)
         stream_ids,other = self.clients.resource_registry.find_objects(subject=data_product_id, predicate=PRED.hasStream, id_only=True)
+        # The last update cache workers in this container keep the latest values in memory
+        table = getattr(self.container, 'last_update_table', None)
         retval = {}
         for stream_id in stream_ids:
+            lu = table.read(stream_id) if table is not None else None
+            if lu is not None:
+                retval[stream_id] = lu
+                continue
             try:
                 lu = db.read(stream_id)
                 retval[stream_id] = lu
@@ -10,6 +10,7 @@ from pyon.core.exception import BadRequest, NotFound, Inconsistent
 #from pyon.core.bootstrap import IonObject
 from pyon.public import PRED, RT, LCE
 from pyon.util.log import log
+from ion.services.coi.association_index import indexed_registry
 
 import inspect
 
@@ -23,7 +24,7 @@ class ResourceImpl(object):
         self.ionlabel = self._primary_object_label()
 
         if hasattr(clients, "resource_registry"):
-            self.RR = self.clients.resource_registry
+            self.RR = indexed_registry(self.clients.resource_registry)
 
         self.lce_precondition = {}
 